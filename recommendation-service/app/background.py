@@ -0,0 +1,44 @@
+"""Background jobs shared by the service's worker processes.
+
+Jobs that must run on one worker at a time serialise on a Postgres advisory
+lock; the keys are arbitrary but stable, and listed here so they never clash.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock keys (shared by all workers)
+INDEX_BUILD_LOCK_KEY = 720_031_001
+POPULARITY_REFRESH_LOCK_KEY = 720_031_002
+SCHEMA_LOCK_KEY = 720_031_003
+COLLABORATIVE_BUILD_LOCK_KEY = 720_031_004
+NEIGHBORS_BUILD_LOCK_KEY = 720_031_005
+SNAPSHOT_IMPORT_LOCK_KEY = 720_031_006
+SEARCH_INDEX_BUILD_LOCK_KEY = 720_031_007
+
+
+def _run_periodically(job: Callable[[], object], interval: float, description: str) -> None:
+    while True:
+        try:
+            job()
+        except Exception as exc:
+            logger.exception("%s failed: %s", description, exc)
+        if interval <= 0:
+            return
+        time.sleep(interval)
+
+
+def start_periodic(name: str, job: Callable[[], object], interval: float, description: str) -> threading.Thread:
+    """Run ``job`` now, then every ``interval`` seconds (once when <= 0) in a daemon thread.
+
+    Failures are logged as "<description> failed" and retried on the next tick.
+    """
+    thread = threading.Thread(
+        target=_run_periodically, args=(job, interval, description), name=name, daemon=True
+    )
+    thread.start()
+    return thread
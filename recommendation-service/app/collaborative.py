@@ -0,0 +1,329 @@
+"""Item-item collaborative filtering from user_interaction co-occurrence.
+
+Two books co-occur once for every user who interacted with both. The model
+keeps, per book, its ``collaborative_neighbors`` strongest neighbours by
+
+    score(a, b) = users(a, b) / sqrt(users(a) * users(b))
+
+as a CSR matrix in plain NumPy arrays (``indptr``/``neighbours``/``scores``
+indexed by position in the sorted ``items`` array). A user's recommendations
+are the summed neighbour scores of the books in their history, weighted like
+the taste profile — a few array slices and one ``bincount``.
+
+The builder folds in interactions past a ``user_interaction.id`` watermark:
+only (user, book) pairs that are new for the user add pair counts, so the
+result equals a full build. Pair counts (builder state) and the serving model
+are stored as compressed npz blobs in ``collaborative_model``; workers reload
+the model when its version changes. A periodic full rebuild corrects drift
+(ids committed out of order, removed interactions).
+"""
+
+import io
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.background import COLLABORATIVE_BUILD_LOCK_KEY, start_periodic
+from app.config import settings
+from app.profiles import interaction_weight
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "item_item"
+
+# Distinct (user, book) pairs past the watermark that are new for the user, plus
+# the earlier books of the same users (the pairs they complete)
+INTERACTIONS_SQL = """
+    WITH new AS (
+        SELECT DISTINCT ui.user_id, ui.book_id
+        FROM user_interaction ui
+        WHERE ui.id > :after AND ui.id <= :upto
+          AND NOT EXISTS (
+              SELECT 1 FROM user_interaction o
+              WHERE o.user_id = ui.user_id AND o.book_id = ui.book_id AND o.id <= :after
+          )
+    )
+    SELECT user_id, book_id, true AS is_new FROM new
+    UNION ALL
+    SELECT DISTINCT o.user_id, o.book_id, false
+    FROM user_interaction o
+    WHERE o.id <= :after AND o.user_id IN (SELECT user_id FROM new)
+"""
+
+SAVE_SQL = """
+    INSERT INTO collaborative_model (name, version, watermark, items, model, state, full_built_at, built_at)
+    VALUES (:name, 1, :watermark, :items, :model, :state, :full_built_at, :built_at)
+    ON CONFLICT (name) DO UPDATE SET
+        version = collaborative_model.version + 1,
+        watermark = EXCLUDED.watermark,
+        items = EXCLUDED.items,
+        model = EXCLUDED.model,
+        state = EXCLUDED.state,
+        full_built_at = EXCLUDED.full_built_at,
+        built_at = EXCLUDED.built_at
+"""
+
+
+def _pair_keys(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Order-independent uint64 key for book pairs (ids are non-negative int32)."""
+    low, high = np.minimum(a, b).astype(np.uint64), np.maximum(a, b).astype(np.uint64)
+    return (low << np.uint64(32)) | high
+
+
+def _split_keys(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return (keys >> np.uint64(32)).astype(np.int64), (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+
+
+def _sum_by_key(keys: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.uint32)
+
+
+class CooccurrenceCounts(NamedTuple):
+    """Builder state: users per book and per book pair."""
+    item_ids: np.ndarray  # int64, sorted
+    item_users: np.ndarray  # uint32
+    pair_keys: np.ndarray  # uint64, sorted, see _pair_keys
+    pair_users: np.ndarray  # uint32
+
+    @classmethod
+    def empty(cls) -> "CooccurrenceCounts":
+        return cls(
+            np.empty(0, np.int64), np.empty(0, np.uint32), np.empty(0, np.uint64), np.empty(0, np.uint32)
+        )
+
+    def merge(self, other: "CooccurrenceCounts") -> "CooccurrenceCounts":
+        item_ids, item_users = _sum_by_key(
+            np.concatenate([self.item_ids, other.item_ids]),
+            np.concatenate([self.item_users, other.item_users]),
+        )
+        pair_keys, pair_users = _sum_by_key(
+            np.concatenate([self.pair_keys, other.pair_keys]),
+            np.concatenate([self.pair_users, other.pair_users]),
+        )
+        return CooccurrenceCounts(item_ids, item_users, pair_keys, pair_users)
+
+
+def count_cooccurrences(user_ids, book_ids, is_new) -> CooccurrenceCounts:
+    """Counts contributed by the new (user, book) pairs.
+
+    Per user, new books pair with each other and with the user's earlier
+    books; earlier-earlier pairs were counted when those books were new.
+    """
+    users = np.asarray(user_ids, dtype=np.int64)
+    books = np.asarray(book_ids, dtype=np.int64)
+    new = np.asarray(is_new, dtype=bool)
+    if not new.any():
+        return CooccurrenceCounts.empty()
+
+    order = np.argsort(users, kind="stable")
+    users, books, new = users[order], books[order], new[order]
+    bounds = np.flatnonzero(np.diff(users)) + 1
+    chunks = []
+    for user_books, user_new in zip(np.split(books, bounds), np.split(new, bounds)):
+        added, earlier = user_books[user_new], user_books[~user_new]
+        if not len(added) or len(user_books) < 2:
+            continue
+        first, second = np.triu_indices(len(added), k=1)
+        chunks.append(_pair_keys(added[first], added[second]))
+        if len(earlier):
+            chunks.append(_pair_keys(np.repeat(added, len(earlier)), np.tile(earlier, len(added))))
+
+    item_ids, item_users = np.unique(books[new], return_counts=True)
+    keys = np.concatenate(chunks) if chunks else np.empty(0, np.uint64)
+    pair_keys, pair_users = np.unique(keys, return_counts=True)
+    return CooccurrenceCounts(
+        item_ids.astype(np.int64), item_users.astype(np.uint32), pair_keys, pair_users.astype(np.uint32)
+    )
+
+
+class ItemItemModel(NamedTuple):
+    """Top neighbours per book as CSR: row i is book items[i]."""
+    items: np.ndarray  # int64, sorted
+    indptr: np.ndarray  # int64, len(items) + 1
+    neighbours: np.ndarray  # int32 book ids
+    scores: np.ndarray  # float32
+    version: int = 0
+
+    @classmethod
+    def build(cls, counts: CooccurrenceCounts, neighbours: int, version: int = 0) -> "ItemItemModel":
+        a, b = _split_keys(counts.pair_keys)
+        users_a = counts.item_users[np.searchsorted(counts.item_ids, a)].astype(np.float64)
+        users_b = counts.item_users[np.searchsorted(counts.item_ids, b)].astype(np.float64)
+        score = (counts.pair_users / np.sqrt(users_a * users_b)).astype(np.float32)
+
+        # Both directions, best first within each row, then the first `neighbours` of every row
+        rows, cols, values = np.concatenate([a, b]), np.concatenate([b, a]), np.concatenate([score, score])
+        order = np.lexsort((cols, -values, rows))
+        rows, cols, values = rows[order], cols[order], values[order]
+        items, starts, lengths = np.unique(rows, return_index=True, return_counts=True)
+        rank = np.arange(len(rows)) - np.repeat(starts, lengths)
+        keep = rank < neighbours
+        indptr = np.concatenate([[0], np.cumsum(np.minimum(lengths, neighbours))]).astype(np.int64)
+        return cls(items, indptr, cols[keep].astype(np.int32), values[keep], version)
+
+    def recommend(
+        self, history: Sequence[int], weights: Sequence[float], limit: int, exclude: Sequence[int] = ()
+    ) -> list[tuple[int, float]]:
+        """(book_id, score) best first: weighted sum of the history's neighbour scores."""
+        history = np.asarray(history, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float32)
+        if not len(history) or not len(self.items):
+            return []
+        positions = np.searchsorted(self.items, history).clip(max=len(self.items) - 1)
+        known = self.items[positions] == history
+        slices = [
+            (self.indptr[position], self.indptr[position + 1], weight)
+            for position, weight in zip(positions[known], weights[known])
+        ]
+        if not slices:
+            return []
+        candidates = np.concatenate([self.neighbours[start:end] for start, end, _ in slices])
+        scores = np.concatenate([self.scores[start:end] * weight for start, end, weight in slices])
+        books, inverse = np.unique(candidates, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        totals[np.isin(books, np.asarray(list(exclude), dtype=np.int64))] = -np.inf
+
+        top = min(limit, len(books))
+        best = np.argpartition(-totals, top - 1)[:top]
+        best = best[np.lexsort((books[best], -totals[best]))]
+        return [(int(books[i]), float(totals[i])) for i in best if np.isfinite(totals[i]) and totals[i] > 0]
+
+
+def _to_npz(arrays: dict) -> bytes:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _from_npz(blob) -> dict:
+    with np.load(io.BytesIO(bytes(blob))) as data:
+        return {name: data[name] for name in data.files}
+
+
+def dump_model(model: ItemItemModel) -> bytes:
+    return _to_npz({name: getattr(model, name) for name in ("items", "indptr", "neighbours", "scores")})
+
+
+def load_model(blob, version: int = 0) -> ItemItemModel:
+    return ItemItemModel(**_from_npz(blob), version=version)
+
+
+def dump_counts(counts: CooccurrenceCounts) -> bytes:
+    return _to_npz(counts._asdict())
+
+
+def load_counts(blob) -> CooccurrenceCounts:
+    return CooccurrenceCounts(**_from_npz(blob))
+
+
+# ─── Builder (one worker at a time) ───────────────────────────────
+
+
+def refresh_collaborative(bind: Engine, full: bool = False) -> bool:
+    """Fold new interactions into the model (or rebuild it). False if another worker holds the lock."""
+    with bind.connect() as conn:
+        locked = conn.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": COLLABORATIVE_BUILD_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            return False
+        started = time.perf_counter()
+        stored = conn.execute(
+            text("SELECT watermark, state, full_built_at FROM collaborative_model WHERE name = :name"),
+            {"name": MODEL_NAME},
+        ).first()
+        upto = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM user_interaction")).scalar()
+
+        now = datetime.utcnow()
+        full = (
+            full
+            or stored is None
+            or stored.watermark > upto
+            or now - stored.full_built_at >= timedelta(seconds=settings.collaborative_full_rebuild_interval_seconds)
+        )
+        if not full and upto == stored.watermark:
+            return True
+
+        after = 0 if full else stored.watermark
+        rows = conn.execute(text(INTERACTIONS_SQL), {"after": after, "upto": upto}).fetchall()
+        delta = count_cooccurrences([r.user_id for r in rows], [r.book_id for r in rows], [r.is_new for r in rows])
+        counts = delta if full else load_counts(stored.state).merge(delta)
+        model = ItemItemModel.build(counts, settings.collaborative_neighbors)
+
+        conn.execute(
+            text(SAVE_SQL),
+            {
+                "name": MODEL_NAME,
+                "watermark": upto,
+                "items": len(model.items),
+                "model": dump_model(model),
+                "state": dump_counts(counts),
+                "full_built_at": now if full else stored.full_built_at,
+                "built_at": now,
+            },
+        )
+        conn.commit()
+    logger.info(
+        "Collaborative model %s in %.2fs (%d books, %d pairs).",
+        "rebuilt" if full else "updated", time.perf_counter() - started, len(model.items), len(counts.pair_keys),
+    )
+    return True
+
+
+def start_collaborative_builder(bind: Engine) -> threading.Thread:
+    """Build once now, then fold in new interactions every collaborative_refresh_interval_seconds."""
+    return start_periodic(
+        "collaborative-builder",
+        lambda: refresh_collaborative(bind),
+        settings.collaborative_refresh_interval_seconds,
+        "Collaborative model refresh",
+    )
+
+
+# ─── Serving (every worker) ───────────────────────────────────────
+
+_model_lock = threading.Lock()
+_model: Optional[ItemItemModel] = None
+_checked_at = float("-inf")
+
+
+def get_model(db: Session) -> Optional[ItemItemModel]:
+    """The current model, re-checked against the table every collaborative_reload_interval_seconds."""
+    global _model, _checked_at
+    if time.monotonic() - _checked_at < settings.collaborative_reload_interval_seconds:
+        return _model
+    with _model_lock:
+        if time.monotonic() - _checked_at >= settings.collaborative_reload_interval_seconds:
+            version = db.execute(
+                text("SELECT version FROM collaborative_model WHERE name = :name"), {"name": MODEL_NAME}
+            ).scalar()
+            if version is None:
+                _model = None
+            elif _model is None or _model.version != version:
+                row = db.execute(
+                    text("SELECT version, model FROM collaborative_model WHERE name = :name"),
+                    {"name": MODEL_NAME},
+                ).first()
+                _model = load_model(row.model, row.version) if row else None
+            _checked_at = time.monotonic()
+    return _model
+
+
+def user_history(db: Session, user_id: int) -> tuple[list[int], list[float]]:
+    """Distinct books of a user with summed profile weights (1.0 when they sum to zero)."""
+    weights: dict[int, float] = {}
+    for book_id, interaction_type, rating in db.execute(
+        text("SELECT book_id, interaction_type, rating FROM user_interaction WHERE user_id = :user_id"),
+        {"user_id": user_id},
+    ):
+        weights[book_id] = weights.get(book_id, 0.0) + interaction_weight(interaction_type, rating)
+    books = list(weights)
+    return books, [weights[book_id] or 1.0 for book_id in books]
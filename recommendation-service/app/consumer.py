@@ -1,24 +1,115 @@
-"""RabbitMQ consumer — listens for embedding update and interaction events."""
+"""RabbitMQ consumer — listens for embedding update and interaction events.
 
+With ``consumer_workers > 1`` deliveries are spread over a pool of worker
+threads keyed by book id, so events for one book are always handled in
+arrival order by the same worker while different books proceed in parallel.
+Each worker commits a whole batch in one transaction and the deliveries are
+then acknowledged with ``multiple=True`` up to the highest contiguous settled
+delivery tag. pika channels are not thread-safe, so every channel operation
+is handed back to the connection thread via ``add_callback_threadsafe``.
+
+Book events only commit metadata and enqueue an embedding job; vectors are
+generated by ``app.embedding_worker``, so no handler waits on the embedding API.
+"""
+
+import functools
 import json
 import logging
+import queue
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
 
 import pika
 from pika.exceptions import AMQPConnectionError
+from sqlalchemy import delete, update
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from app.config import settings
 from app.database import SessionLocal
-from app.models import BookEmbedding, UserInteraction
-from app.embedding import get_embedding
-from prometheus_client import Counter
+from app.models import BookEmbedding, BookPopularity, EmbeddingJob, UserInteraction
+from app.embedding import book_text, text_fingerprint
+from app.embedding_worker import enqueue_embedding
+from app.ingest import InteractionBuffer, apply_derived, interaction_row
+from app.neighbors import mark_dirty
+from app.profiles import book_vectors, reweigh_readers
+from app.result_cache import result_cache
+from app.search_cache import bump_generation
+from app.vector_store import get_vector_store
+from prometheus_client import Counter, Gauge, Histogram
 
 logger = logging.getLogger(__name__)
 
 EVENTS_RECEIVED = Counter(
     "recommendation_events_received_total", "Events received", ["event_type"]
 )
+CONSUMER_BATCH_SIZE = Histogram(
+    "recommendation_consumer_batch_size",
+    "Events committed per consumer transaction",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+CONSUMER_LAG = Histogram(
+    "recommendation_consumer_lag_seconds",
+    "Time between event publication and processing",
+    buckets=(0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+CONSUMER_INFLIGHT = Gauge(
+    "recommendation_consumer_inflight_messages", "Delivered but not yet acknowledged messages"
+)
+CONSUMER_QUEUE_DEPTH = Gauge(
+    "recommendation_consumer_queue_depth", "Messages ready in the RabbitMQ queue"
+)
+EMBEDDING_CHANGE_CHECKS = Counter(
+    "recommendation_embedding_change_checks_total",
+    "Book upserts that queued a re-embedding (performed) or left the vector as is (skipped)",
+    ["decision"],
+)
+
+BOOK_UPSERT_EVENTS = ("book.created", "book.updated", "book.embedding_updated")
+INTERACTION_EVENTS = ("loan.borrowed", "loan.returned", "rating.created", "favorite.added")
+QUEUE_DEPTH_INTERVAL_SECONDS = 15
+
+
+class _Delivery(NamedTuple):
+    delivery_tag: int
+    event_type: str
+    payload: dict
+    published_at: Optional[float]
+
+
+class _AckTracker:
+    """Tracks unsettled delivery tags of one channel.
+
+    ``settle`` returns the highest tag that can be acknowledged with
+    ``multiple=True`` — every earlier tag is settled and the tag itself
+    succeeded (a nacked tag must never be acked).
+    """
+
+    def __init__(self):
+        self._pending = deque()
+        self._settled: dict[int, bool] = {}
+        self._lock = threading.Lock()
+
+    def delivered(self, tag: int):
+        with self._lock:
+            self._pending.append(tag)
+        CONSUMER_INFLIGHT.inc()
+
+    def settle(self, succeeded: list[int], failed: list[int]) -> Optional[int]:
+        with self._lock:
+            for tag in succeeded:
+                self._settled[tag] = True
+            for tag in failed:
+                self._settled[tag] = False
+            ack_up_to = None
+            while self._pending and self._pending[0] in self._settled:
+                tag = self._pending.popleft()
+                CONSUMER_INFLIGHT.dec()
+                if self._settled.pop(tag):
+                    ack_up_to = tag
+            return ack_up_to
 
 
 class EmbeddingConsumer:
@@ -28,6 +119,11 @@ class EmbeddingConsumer:
         self._connection = None
         self._channel = None
         self._running = False
+        self._local = threading.local()
+        self._tracker = None
+        self._worker_queues: list[queue.Queue] = []
+        self._workers: list[threading.Thread] = []
+        self._interactions: Optional[InteractionBuffer] = None
 
     @retry(stop=stop_after_attempt(10), wait=wait_exponential(multiplier=1, min=2, max=30))
     def _connect(self):
@@ -64,9 +160,12 @@ class EmbeddingConsumer:
                 routing_key=key,
             )
 
-        self._channel.basic_qos(prefetch_count=1)
+        concurrent = settings.consumer_workers > 1
+        self._channel.basic_qos(prefetch_count=settings.consumer_prefetch if concurrent else 1)
         logger.info("Connected to RabbitMQ for embedding events.")
 
+    # ─── Sequential path (consumer_workers == 1) ───────────────────
+
     def _on_message(self, channel, method, properties, body):
         event_type = method.routing_key
         EVENTS_RECEIVED.labels(event_type=event_type).inc()
@@ -74,22 +173,201 @@ class EmbeddingConsumer:
         try:
             payload = json.loads(body)
             logger.info("Event: %s", event_type)
-
-            if event_type in ("book.created", "book.updated", "book.embedding_updated"):
-                self._handle_book_upsert(payload)
-            elif event_type == "book.deleted":
-                self._handle_book_deleted(payload)
-            elif event_type in ("loan.borrowed", "loan.returned", "rating.created", "favorite.added"):
-                self._handle_user_interaction(event_type, payload)
-
+            self._handle(event_type, payload)
             channel.basic_ack(delivery_tag=method.delivery_tag)
         except Exception as exc:
             logger.exception("Failed: %s", exc)
             channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
-    def _handle_book_upsert(self, payload: dict):
+    def _handle(self, event_type: str, payload: dict):
+        if event_type in BOOK_UPSERT_EVENTS:
+            self._handle_book_upsert(payload)
+        elif event_type == "book.deleted":
+            self._handle_book_deleted(payload)
+        elif event_type in INTERACTION_EVENTS:
+            self._handle_user_interaction(event_type, payload)
+
+    # ─── Concurrent path (consumer_workers > 1) ────────────────────
+
+    def _dispatch(self, channel, method, properties, body):
+        """Connection-thread callback: route a delivery to its worker queue."""
+        event_type = method.routing_key
+        EVENTS_RECEIVED.labels(event_type=event_type).inc()
+        self._tracker.delivered(method.delivery_tag)
+
+        try:
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise ValueError("event body is not a JSON object")
+        except ValueError as exc:
+            logger.error("Invalid event body (%s): %s", event_type, exc)
+            self._settle(channel, self._tracker, [], [method.delivery_tag])
+            return
+
+        if event_type in INTERACTION_EVENTS and self._interactions is not None:
+            # Bulk-loaded with COPY; acknowledged only after the flush commits
+            try:
+                row = interaction_row(event_type, payload)
+            except (KeyError, TypeError, ValueError) as exc:
+                logger.error("Invalid interaction event (%s): %s", event_type, exc)
+                self._settle(channel, self._tracker, [], [method.delivery_tag])
+                return
+            self._interactions.add(row, (channel, self._tracker, method.delivery_tag))
+            return
+
+        # Same book → same worker, so per-book ordering is preserved
+        key = payload.get("book_id") or payload.get("user_id") or 0
+        worker = hash(key) % len(self._worker_queues)
+        published_at = getattr(properties, "timestamp", None)
+        self._worker_queues[worker].put(
+            (channel, self._tracker, _Delivery(method.delivery_tag, event_type, payload, published_at))
+        )
+
+    def _start_workers(self):
+        if self._workers:
+            return
+        for index in range(settings.consumer_workers):
+            work = queue.Queue()
+            thread = threading.Thread(
+                target=self._worker_loop, args=(work,), name=f"consumer-worker-{index}", daemon=True
+            )
+            self._worker_queues.append(work)
+            self._workers.append(thread)
+            thread.start()
+
+    def _worker_loop(self, work: queue.Queue):
+        wait = settings.consumer_batch_wait_ms / 1000
+        carry = None
+        while self._running:
+            if carry is not None:
+                first, carry = carry, None
+            else:
+                try:
+                    first = work.get(timeout=1)
+                except queue.Empty:
+                    continue
+            batch = [first]
+            deadline = time.monotonic() + wait
+            while len(batch) < settings.consumer_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = work.get(timeout=remaining) if remaining > 0 else work.get_nowait()
+                except queue.Empty:
+                    break
+                # A batch must settle on a single channel (tags restart after a reconnect)
+                if item[0] is not first[0]:
+                    carry = item
+                    break
+                batch.append(item)
+
+            channel, tracker = first[0], first[1]
+            succeeded, failed = self._process_batch([item[2] for item in batch])
+            try:
+                self._connection.add_callback_threadsafe(
+                    functools.partial(self._settle, channel, tracker, succeeded, failed)
+                )
+            except Exception as exc:
+                # Connection already gone: the broker redelivers these messages
+                logger.warning("Could not acknowledge %d deliveries: %s", len(batch), exc)
+
+    def _process_batch(self, deliveries: list[_Delivery]) -> tuple[list[int], list[int]]:
+        """Handle deliveries in one transaction; on failure retry each one on its own."""
+        now = time.time()
+        for delivery in deliveries:
+            if delivery.published_at:
+                CONSUMER_LAG.observe(max(0.0, now - delivery.published_at))
+
+        db = SessionLocal()
+        self._local.db = db
+        try:
+            for delivery in deliveries:
+                self._handle(delivery.event_type, delivery.payload)
+            db.commit()
+            self._run_after_commit(db)
+            CONSUMER_BATCH_SIZE.observe(len(deliveries))
+            return [d.delivery_tag for d in deliveries], []
+        except Exception as exc:
+            db.rollback()
+            logger.warning("Batch of %d failed (%s); retrying individually.", len(deliveries), exc)
+        finally:
+            self._local.db = None
+            db.close()
+
+        succeeded, failed = [], []
+        for delivery in deliveries:
+            try:
+                self._handle(delivery.event_type, delivery.payload)
+                succeeded.append(delivery.delivery_tag)
+            except Exception as exc:
+                logger.exception("Failed: %s", exc)
+                failed.append(delivery.delivery_tag)
+        CONSUMER_BATCH_SIZE.observe(1)
+        return succeeded, failed
+
+    @staticmethod
+    def _settle(channel, tracker: _AckTracker, succeeded: list[int], failed: list[int]):
+        """Connection-thread callback: nack failures, then ack everything contiguous."""
+        if not channel.is_open:
+            return  # deliveries of a dead channel are redelivered by the broker
+        for tag in failed:
+            channel.basic_nack(delivery_tag=tag, requeue=False)
+        ack_up_to = tracker.settle(succeeded, failed)
+        if ack_up_to is not None:
+            channel.basic_ack(delivery_tag=ack_up_to, multiple=True)
+
+    def _settle_interactions(self, succeeded: list[tuple], failed: list[tuple]):
+        """InteractionBuffer callback: hand flushed delivery tags to their channels."""
+        groups: dict[tuple, tuple[list[int], list[int]]] = {}
+        for (channel, tracker, tag) in succeeded:
+            groups.setdefault((channel, tracker), ([], []))[0].append(tag)
+        for (channel, tracker, tag) in failed:
+            groups.setdefault((channel, tracker), ([], []))[1].append(tag)
+        for (channel, tracker), (ok, bad) in groups.items():
+            try:
+                self._connection.add_callback_threadsafe(
+                    functools.partial(self._settle, channel, tracker, ok, bad)
+                )
+            except Exception as exc:
+                logger.warning("Could not acknowledge %d interactions: %s", len(ok) + len(bad), exc)
+
+    def _report_queue_depth(self):
+        try:
+            declared = self._channel.queue_declare(queue=settings.rabbitmq_queue, passive=True)
+            CONSUMER_QUEUE_DEPTH.set(declared.method.message_count)
+        except Exception as exc:
+            logger.debug("Queue depth probe failed: %s", exc)
+            return
+        self._connection.call_later(QUEUE_DEPTH_INTERVAL_SECONDS, self._report_queue_depth)
+
+    # ─── Handlers ──────────────────────────────────────────────────
+
+    @contextmanager
+    def _session(self):
+        """The worker's shared batch session, or a private one committed on exit."""
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            yield db
+            return
         db = SessionLocal()
         try:
+            yield db
+            db.commit()
+            self._run_after_commit(db)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _after_commit(db, callback):
+        """Defer side effects outside the database until the transaction commits."""
+        db.info.setdefault("after_commit", []).append(callback)
+
+    @staticmethod
+    def _run_after_commit(db):
+        for callback in db.info.pop("after_commit", []):
+            callback()
+
+    def _handle_book_upsert(self, payload: dict):
+        with self._session() as db:
             book_id = payload["book_id"]
             title = payload.get("title", "")
             description = payload.get("description", "")
@@ -98,61 +376,99 @@ class EmbeddingConsumer:
             if not existing:
                 existing = BookEmbedding(id=book_id)
                 db.add(existing)
+            body = book_text(title, description)
+            fingerprint = text_fingerprint(body) if body else None
+            if (
+                existing.text_hash is None
+                and existing.embedding is not None
+                and (existing.title, existing.description) == (title, description)
+            ):
+                existing.text_hash = fingerprint  # embedded before fingerprints were stored
 
             existing.title = title
             existing.author = payload.get("author", "")
             existing.category = payload.get("category", "")
+            db.execute(
+                update(BookPopularity)
+                .where(BookPopularity.book_id == book_id)
+                .values(category=existing.category)
+            )
+            bump_generation(db, [book_id])
             existing.description = description
 
-            # Generate embedding if we have text
-            text = f"{title}\n\n{description}".strip()
-            if text:
-                vector = get_embedding(text)
-                if vector:
-                    existing.embedding = vector
+            # The vector is regenerated by app.embedding_worker only when the embedded text changes
+            unchanged = existing.embedding is not None and fingerprint == existing.text_hash
+            if body and not unchanged:
+                EMBEDDING_CHANGE_CHECKS.labels(decision="performed").inc()
+                existing.embedding_stale = True
+                enqueue_embedding(db, book_id)
+            else:
+                EMBEDDING_CHANGE_CHECKS.labels(decision="skipped").inc()
+                if unchanged and existing.embedding_stale:
+                    # Text reverted to what the current vector embeds: the pending job is moot
+                    db.execute(delete(EmbeddingJob).where(EmbeddingJob.book_id == book_id))
+                    existing.embedding_stale = False
+            # Batch sessions do not autoflush: later events for this book query the row
+            db.flush()
 
-            db.commit()
-            logger.info("Book embedding upserted: %d", book_id)
-        finally:
-            db.close()
+            if result_cache is not None:
+                # Metadata changes only; the worker invalidates again once the vector is written
+                self._after_commit(db, functools.partial(result_cache.invalidate, book_id))
+            logger.info("Book metadata upserted: %d", book_id)
 
     def _handle_book_deleted(self, payload: dict):
-        db = SessionLocal()
-        try:
+        with self._session() as db:
             book_id = payload["book_id"]
+            # Take the book back out of its readers' profiles while its vector is still stored
+            cursor = db.connection().connection.cursor()
+            try:
+                vector = book_vectors(cursor, [book_id]).get(book_id)
+                reweigh_readers(cursor, {book_id: (vector, None)})
+            finally:
+                cursor.close()
             db.query(BookEmbedding).filter_by(id=book_id).delete()
-            db.commit()
-        finally:
-            db.close()
+            db.execute(delete(EmbeddingJob).where(EmbeddingJob.book_id == book_id))
+            db.execute(delete(BookPopularity).where(BookPopularity.book_id == book_id))
+            mark_dirty(db, book_id)
+            bump_generation(db, [book_id])
+
+            store = get_vector_store()
+            if store is not None:
+                self._after_commit(db, functools.partial(store.remove, book_id))
+            if result_cache is not None:
+                self._after_commit(db, functools.partial(result_cache.invalidate, book_id))
 
     def _handle_user_interaction(self, event_type: str, payload: dict):
-        db = SessionLocal()
-        try:
-            interaction_map = {
-                "loan.borrowed": "borrow",
-                "loan.returned": "return",
-                "rating.created": "rate",
-                "favorite.added": "favorite",
-            }
-            interaction = UserInteraction(
-                user_id=payload["user_id"],
-                book_id=payload["book_id"],
-                interaction_type=interaction_map.get(event_type, event_type),
-                rating=payload.get("rating"),
-            )
-            db.add(interaction)
-            db.commit()
-        finally:
-            db.close()
+        with self._session() as db:
+            row = interaction_row(event_type, payload)
+            db.add(UserInteraction(**row._asdict()))
+            # Profiles and popularity share the row's transaction via the session's connection
+            cursor = db.connection().connection.cursor()
+            try:
+                apply_derived(cursor, [row])
+            finally:
+                cursor.close()
 
     def start(self):
         self._running = True
+        concurrent = settings.consumer_workers > 1
+        if concurrent:
+            self._start_workers()
+            self._interactions = InteractionBuffer(self._settle_interactions, is_live=lambda token: token[0].is_open)
+            self._interactions.start()
         while self._running:
             try:
                 self._connect()
+                if concurrent:
+                    self._tracker = _AckTracker()
+                    CONSUMER_INFLIGHT.set(0)
+                    callback = self._dispatch
+                    self._connection.call_later(0, self._report_queue_depth)
+                else:
+                    callback = self._on_message
                 self._channel.basic_consume(
                     queue=settings.rabbitmq_queue,
-                    on_message_callback=self._on_message,
+                    on_message_callback=callback,
                     auto_ack=False,
                 )
                 self._channel.start_consuming()
@@ -165,6 +481,8 @@ class EmbeddingConsumer:
 
     def stop(self):
         self._running = False
+        if self._interactions is not None:
+            self._interactions.stop()
         try:
             self._channel and self._channel.stop_consuming()
         except Exception:
@@ -1,19 +1,53 @@
-"""SQLAlchemy database setup — own pgvector-enabled database."""
+"""SQLAlchemy database setup — own pgvector-enabled database.
 
+The sync engine (psycopg2) serves background jobs, the consumer and most
+routes. With ``database_async`` an asyncpg engine is added for the vector
+search routes: their query code runs on an ``AsyncSession`` through
+``run_sync`` (a greenlet on the event loop), so an in-flight search holds a
+pooled connection but no threadpool slot. ``run_sync`` code runs on the event
+loop thread, so CPU-bound work (the mmap vector store's matrix products) is
+still sent to the threadpool on the sync engine. The ``/for-user`` routes stay
+sync handlers on the sync engine: their profile backfill writes through raw
+psycopg2 cursors (app.profiles).
+"""
+
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 
 from app.config import settings
 
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10,
-)
+
+def pool_limits(engines: int = 1) -> dict:
+    """Pool options of one engine: its share of db_max_connections in this process."""
+    share = max(2, settings.db_max_connections // max(1, settings.web_workers) // engines)
+    pool_size = settings.db_pool_size if settings.db_pool_size is not None else max(1, share // 2)
+    max_overflow = settings.db_max_overflow if settings.db_max_overflow is not None else max(0, share - pool_size)
+    return {"pool_size": pool_size, "max_overflow": max_overflow, "pool_timeout": settings.db_pool_timeout_seconds}
+
+
+def async_database_url() -> str:
+    if settings.async_database_url:
+        return settings.async_database_url
+    return make_url(settings.database_url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+ENGINES = 2 if settings.database_async else 1
+
+engine = create_engine(settings.database_url, pool_pre_ping=True, **pool_limits(ENGINES))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = None
+AsyncSessionLocal = None
+if settings.database_async:
+    # Imported only when enabled: needs greenlet and the asyncpg driver
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(async_database_url(), pool_pre_ping=True, **pool_limits(ENGINES))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 def get_db():
     db = SessionLocal()
@@ -21,3 +55,30 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """AsyncSession on the asyncpg engine, or None without ``database_async``."""
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+class QueryRunner:
+    """Runs sync query code ``fn(session, *args)`` from an async route.
+
+    On the async session when there is one (no thread involved), otherwise on
+    the sync session in the threadpool. ``threaded=True`` always takes the
+    threadpool, for calls that would hold the event loop with CPU work.
+    """
+
+    def __init__(self, db: Session, async_db=None):
+        self.db = db
+        self.async_db = async_db
+
+    async def __call__(self, fn, *args, threaded: bool = False):
+        if self.async_db is not None and not threaded:
+            return await self.async_db.run_sync(fn, *args)
+        return await run_in_threadpool(fn, self.db, *args)
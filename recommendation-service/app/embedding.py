@@ -1,47 +1,328 @@
-"""Embedding service — calls OpenAI for vector generation."""
+"""Embedding service — OpenAI API or a local model (``embedding_backend``) for vector generation."""
 
+import asyncio
+import hashlib
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from typing import Optional
 
 import httpx
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import AsyncRetrying, retry, stop_after_attempt, wait_exponential
 from prometheus_client import Counter, Histogram
 
 from app.config import settings
+from app.embedding_cache import cache_key, embedding_cache, normalize_text
+from app.local_embedding import get_local_embedder
 
 logger = logging.getLogger(__name__)
 
 EMBEDDING_REQUESTS = Counter("recommendation_embedding_requests_total", "Total embedding API calls")
 EMBEDDING_ERRORS = Counter("recommendation_embedding_errors_total", "Failed embedding API calls")
 EMBEDDING_LATENCY = Histogram("recommendation_embedding_latency_seconds", "Embedding API latency")
+LOCAL_EMBEDDING_LATENCY = Histogram(
+    "recommendation_local_embedding_latency_seconds",
+    "Local model inference latency per batch",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "recommendation_embedding_batch_size",
+    "Texts sent per embedding API call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048),
+)
 
+OPENAI_EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
+MAX_INPUT_CHARS = 8000
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
-def get_embedding(text: str) -> Optional[list[float]]:
-    """Get embedding vector from OpenAI API."""
+# Shared keep-alive client for the async request path (opened in app lifespan)
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def book_text(title: Optional[str], description: Optional[str]) -> str:
+    """Text that represents a book in embedding space."""
+    return f"{title or ''}\n\n{description or ''}".strip()
+
+
+def text_fingerprint(text: str) -> str:
+    """Model-independent sha256 of the normalised text a book vector embeds."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap upper-bound style estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def embedding_model_id() -> str:
+    """Identity of the configured model (embedding cache keys, re-embed job names)."""
+    if settings.embedding_backend == "local":
+        return f"local:{settings.local_embedding_model}"
+    return settings.openai_model
+
+
+def _backend_configured() -> bool:
+    if settings.embedding_backend == "local":
+        return True
     if settings.openai_api_key == "change_me_openai_key":
         logger.warning("OpenAI API key not configured — returning None")
-        return None
+        return False
+    return True
+
 
+def _post_embeddings(inputs: list[str]) -> list[list[float]]:
+    """One embeddings API call for a list of already-normalised inputs."""
     EMBEDDING_REQUESTS.inc()
+    EMBEDDING_BATCH_SIZE.observe(len(inputs))
     with EMBEDDING_LATENCY.time():
         try:
             response = httpx.post(
-                "https://api.openai.com/v1/embeddings",
-                headers={
-                    "Authorization": f"Bearer {settings.openai_api_key}",
-                    "Content-Type": "application/json",
-                },
+                OPENAI_EMBEDDINGS_URL,
+                headers=_headers(),
                 json={
-                    "input": text[:8000],
+                    "input": inputs,
                     "model": settings.openai_model,
                 },
                 timeout=30.0,
             )
             response.raise_for_status()
-            data = response.json()
-            return data["data"][0]["embedding"]
+            data = response.json()["data"]
+        except Exception as exc:
+            EMBEDDING_ERRORS.inc()
+            logger.error("Embedding API error: %s", exc)
+            raise
+    return _ordered_embeddings(data)
+
+
+def _fetch_embeddings(inputs: list[str]) -> list[list[float]]:
+    if settings.embedding_backend == "local":
+        with LOCAL_EMBEDDING_LATENCY.time():
+            return get_local_embedder().embed(inputs)
+    return _post_embeddings(inputs)
+
+
+def _headers() -> dict:
+    return {
+        "Authorization": f"Bearer {settings.openai_api_key}",
+        "Content-Type": "application/json",
+    }
+
+
+def _ordered_embeddings(data: list[dict]) -> list[list[float]]:
+    # The API may return items out of order; "index" refers to the input position
+    ordered = sorted(enumerate(data), key=lambda pair: pair[1].get("index", pair[0]))
+    return [item["embedding"] for _, item in ordered]
+
+
+def _embed_with_cache(texts: list[str]) -> list[list[float]]:
+    """Serve cached vectors and fetch the distinct remaining texts in one call."""
+    texts = [normalize_text(t)[:MAX_INPUT_CHARS] for t in texts]
+    keys = [cache_key(t, embedding_model_id(), settings.embedding_dimensions) for t in texts]
+    vectors = [
+        embedding_cache.get(key) if settings.embedding_cache_enabled else None for key in keys
+    ]
+
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if missing:
+        fetched = dict(zip(missing, _fetch_embeddings(missing)))
+        for position, text in enumerate(texts):
+            if vectors[position] is None:
+                vectors[position] = fetched[text]
+        if settings.embedding_cache_enabled:
+            for text, key in dict(zip(texts, keys)).items():
+                if text in fetched:
+                    embedding_cache.put(
+                        key, fetched[text], embedding_model_id(), settings.embedding_dimensions
+                    )
+    return vectors
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
+def get_embedding(text: str) -> Optional[list[float]]:
+    """Get an embedding vector from the configured backend (served from the embedding cache when possible)."""
+    if not _backend_configured():
+        return None
+    return _embed_with_cache([text])[0]
+
+
+def open_http_client() -> httpx.AsyncClient:
+    """Create the shared HTTP/2 keep-alive client (idempotent)."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=settings.embedding_http_max_connections,
+                max_keepalive_connections=settings.embedding_http_max_keepalive,
+                keepalive_expiry=settings.embedding_http_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(settings.embedding_http_timeout, connect=5.0),
+        )
+    return _async_client
+
+
+async def close_http_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def _apost_embeddings(inputs: list[str]) -> list[list[float]]:
+    EMBEDDING_REQUESTS.inc()
+    EMBEDDING_BATCH_SIZE.observe(len(inputs))
+    with EMBEDDING_LATENCY.time():
+        try:
+            response = await open_http_client().post(
+                OPENAI_EMBEDDINGS_URL,
+                headers=_headers(),
+                json={"input": inputs, "model": settings.openai_model},
+            )
+            response.raise_for_status()
+            data = response.json()["data"]
         except Exception as exc:
             EMBEDDING_ERRORS.inc()
             logger.error("Embedding API error: %s", exc)
             raise
+    return _ordered_embeddings(data)
+
+
+async def _afetch_embeddings(inputs: list[str]) -> list[list[float]]:
+    if settings.embedding_backend == "local":
+        with LOCAL_EMBEDDING_LATENCY.time():
+            return await get_local_embedder().aembed(inputs)
+    return await _apost_embeddings(inputs)
+
+
+async def aget_embedding(text: str) -> Optional[list[float]]:
+    """Async get_embedding over the pooled client — never blocks a threadpool slot on the API."""
+    if not _backend_configured():
+        return None
+
+    text = normalize_text(text)[:MAX_INPUT_CHARS]
+    key = cache_key(text, embedding_model_id(), settings.embedding_dimensions)
+    if settings.embedding_cache_enabled:
+        cached = embedding_cache.peek(key)
+        if cached is None:
+            cached = await asyncio.to_thread(embedding_cache.get, key)
+        if cached is not None:
+            return cached
+
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10)
+    ):
+        with attempt:
+            vector = (await _afetch_embeddings([text]))[0]
+
+    if settings.embedding_cache_enabled:
+        await asyncio.to_thread(
+            embedding_cache.put, key, vector, embedding_model_id(), settings.embedding_dimensions
+        )
+    return vector
+
+
+def _chunks(texts: list[str]):
+    """Split texts into API-sized batches by count and estimated token budget."""
+    batch, tokens = [], 0
+    for text in texts:
+        cost = estimate_tokens(text[:MAX_INPUT_CHARS])
+        if batch and (
+            len(batch) >= settings.embedding_batch_max_size
+            or tokens + cost > settings.embedding_batch_max_tokens
+        ):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += cost
+    if batch:
+        yield batch
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=10))
+def _get_embeddings_chunk(texts: list[str]) -> list[list[float]]:
+    return _embed_with_cache(texts)
+
+
+def get_embeddings(texts: list[str]) -> list[Optional[list[float]]]:
+    """Embed many texts with as few API calls as the batch limits allow."""
+    if not _backend_configured():
+        return [None] * len(texts)
+    vectors = []
+    for chunk in _chunks(texts):
+        vectors.extend(_get_embeddings_chunk(chunk))
+    return vectors
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text requests into batched API calls.
+
+    A batch is sent once it reaches ``max_batch_size`` texts, would exceed
+    ``max_batch_tokens``, or the oldest pending text has waited ``max_wait_ms``.
+    """
+
+    def __init__(self, max_batch_size: int, max_batch_tokens: int, max_wait_ms: int):
+        self._max_batch_size = max_batch_size
+        self._max_batch_tokens = max_batch_tokens
+        self._max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        if not _backend_configured():
+            future.set_result(None)
+            return future
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> Optional[list[float]]:
+        return self.submit(text).result(timeout)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        carry = None
+        while True:
+            first = carry or self._queue.get()
+            carry = None
+            batch, tokens = [first], estimate_tokens(first[0][:MAX_INPUT_CHARS])
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                cost = estimate_tokens(item[0][:MAX_INPUT_CHARS])
+                if tokens + cost > self._max_batch_tokens:
+                    carry = item
+                    break
+                batch.append(item)
+                tokens += cost
+            self._flush(batch)
+
+    def _flush(self, batch: list[tuple[str, Future]]):
+        try:
+            vectors = get_embeddings([text for text, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+embedding_batcher = EmbeddingBatcher(
+    settings.embedding_batch_max_size,
+    settings.embedding_batch_max_tokens,
+    settings.embedding_batch_max_wait_ms,
+)
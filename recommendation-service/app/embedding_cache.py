@@ -0,0 +1,119 @@
+"""Embedding cache — in-memory LRU tier in front of the embedding_cache table."""
+
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from prometheus_client import Counter
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models import EmbeddingCacheEntry
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_HITS = Counter(
+    "recommendation_embedding_cache_hits_total", "Embedding cache hits", ["tier"]
+)
+EMBEDDING_CACHE_MISSES = Counter(
+    "recommendation_embedding_cache_misses_total", "Embedding cache misses"
+)
+EMBEDDING_CACHE_EVICTIONS = Counter(
+    "recommendation_embedding_cache_evictions_total", "Entries evicted from the in-memory tier"
+)
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC + collapsed whitespace — byte-identical input for identical content."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, model: str, dimensions: int) -> str:
+    payload = f"{model}\x00{dimensions}\x00{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier cache: bounded LRU per process, backed by the service database."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key: str) -> Optional[list[float]]:
+        """Memory tier only — safe to call from the event loop (a miss is not counted)."""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+        if vector is not None:
+            EMBEDDING_CACHE_HITS.labels(tier="memory").inc()
+        return vector
+
+    def get(self, key: str) -> Optional[list[float]]:
+        vector = self.peek(key)
+        if vector is not None:
+            return vector
+
+        if settings.embedding_cache_persist:
+            vector = self._load(key)
+            if vector is not None:
+                EMBEDDING_CACHE_HITS.labels(tier="database").inc()
+                self._remember(key, vector)
+                return vector
+
+        EMBEDDING_CACHE_MISSES.inc()
+        return None
+
+    def put(self, key: str, vector: list[float], model: str, dimensions: int):
+        self._remember(key, vector)
+        if settings.embedding_cache_persist:
+            self._store(key, vector, model, dimensions)
+
+    def clear(self):
+        """Drop the in-memory tier (the database tier is left untouched)."""
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key: str, vector: list[float]):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                EMBEDDING_CACHE_EVICTIONS.inc()
+
+    def _load(self, key: str) -> Optional[list[float]]:
+        # A cache must never take the embedding path down — degrade to a miss
+        db = SessionLocal()
+        try:
+            entry = db.get(EmbeddingCacheEntry, key)
+            return None if entry is None else [float(v) for v in entry.embedding]
+        except Exception as exc:
+            logger.warning("Embedding cache lookup failed: %s", exc)
+            return None
+        finally:
+            db.close()
+
+    def _store(self, key: str, vector: list[float], model: str, dimensions: int):
+        db = SessionLocal()
+        try:
+            db.execute(
+                insert(EmbeddingCacheEntry)
+                .values(key=key, model=model, dimensions=dimensions, embedding=vector)
+                .on_conflict_do_nothing(index_elements=["key"])
+            )
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            logger.warning("Embedding cache write failed: %s", exc)
+        finally:
+            db.close()
+
+
+embedding_cache = EmbeddingCache(settings.embedding_cache_memory_entries)
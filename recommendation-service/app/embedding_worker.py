@@ -0,0 +1,275 @@
+"""Embedding work queue — book vectors are generated off the consumer path.
+
+The consumer commits book metadata at once and enqueues an ``embedding_job``
+row (marking the book ``embedding_stale``) in the same transaction, so a slow
+or failing embedding API never stalls event ingestion. A pool of worker
+threads per process claims due jobs with ``FOR UPDATE SKIP LOCKED`` under a
+lease, embeds them through the shared batcher (texts of concurrent workers
+share API calls) and writes the vectors back.
+
+A job is completed only if it was not re-enqueued while the API call was in
+flight (``enqueued_at`` unchanged); otherwise the newer job embeds the newer
+text. Failed jobs keep their row with ``attempts``, ``last_error`` and an
+exponential ``next_attempt_at`` backoff; after ``embedding_job_max_attempts``
+the job is parked (``next_attempt_at = 'infinity'``) until the book changes and
+re-enqueues it. The old vector keeps serving until the new one is written.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from pgvector.utils import from_db
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.embedding import book_text, embedding_batcher, text_fingerprint
+from app.neighbors import mark_dirty
+from app.profiles import reweigh_readers
+from app.result_cache import result_cache
+from app.search_cache import bump_generation
+from app.vector_search import vector_literal
+from app.vector_store import get_vector_store
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_JOBS = Counter(
+    "recommendation_embedding_jobs_total",
+    "Embedding jobs by outcome (embedded, unchanged, skipped, superseded, failed, parked)",
+    ["outcome"],
+)
+EMBEDDING_JOB_LAG = Histogram(
+    "recommendation_embedding_job_lag_seconds",
+    "Time from enqueueing a book to writing its new embedding",
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+
+ENQUEUE_SQL = """
+    INSERT INTO embedding_job (book_id, enqueued_at, attempts, next_attempt_at)
+    VALUES (:book_id, clock_timestamp(), 0, clock_timestamp())
+    ON CONFLICT (book_id) DO UPDATE SET
+        enqueued_at = EXCLUDED.enqueued_at,
+        attempts = 0,
+        next_attempt_at = EXCLUDED.next_attempt_at,
+        locked_until = NULL,
+        last_error = NULL
+"""
+
+CLAIM_SQL = """
+    UPDATE embedding_job j
+    SET locked_until = clock_timestamp() + make_interval(secs => :lease), attempts = j.attempts + 1
+    FROM (
+        SELECT book_id FROM embedding_job
+        WHERE next_attempt_at <= clock_timestamp()
+          AND (locked_until IS NULL OR locked_until < clock_timestamp())
+        ORDER BY next_attempt_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    ) due
+    WHERE j.book_id = due.book_id
+    RETURNING j.book_id, j.enqueued_at, j.attempts
+"""
+
+# Only jobs that were not re-enqueued in the meantime are completed and written.
+# Returns the vector each book had before, which readers' profiles are moved off.
+COMPLETE_SQL = """
+    WITH done AS (
+        DELETE FROM embedding_job j
+        USING unnest(CAST(:ids AS integer[]), CAST(:enqueued AS timestamptz[])) AS c(book_id, enqueued_at)
+        WHERE j.book_id = c.book_id AND j.enqueued_at = c.enqueued_at
+        RETURNING j.book_id
+    ), previous AS (
+        SELECT id, embedding FROM book_embedding WHERE id = ANY(CAST(:ids AS integer[]))
+    )
+    UPDATE book_embedding b
+    SET embedding = COALESCE(v.vec, b.embedding), text_hash = COALESCE(v.hash, b.text_hash),
+        embedding_stale = false
+    FROM unnest(CAST(:ids AS integer[]), CAST(:vecs AS vector[]), CAST(:hashes AS varchar[])) AS v(id, vec, hash)
+    JOIN previous p ON p.id = v.id
+    WHERE b.id = v.id AND b.id IN (SELECT book_id FROM done)
+    RETURNING b.id, p.embedding::text AS previous
+"""
+
+# The exponent is clamped so power() cannot overflow before LEAST applies
+FAIL_SQL = """
+    UPDATE embedding_job j
+    SET locked_until = NULL,
+        last_error = :error,
+        next_attempt_at = CASE
+            WHEN j.attempts >= :max_attempts THEN 'infinity'::timestamptz
+            ELSE clock_timestamp()
+                + make_interval(secs => LEAST(:base * power(2, LEAST(j.attempts, 20) - 1), :max))
+        END
+    FROM unnest(CAST(:ids AS integer[]), CAST(:enqueued AS timestamptz[])) AS c(book_id, enqueued_at)
+    WHERE j.book_id = c.book_id AND j.enqueued_at = c.enqueued_at
+"""
+
+
+def enqueue_embedding(db: Session, book_id: int) -> None:
+    """Queue (or re-queue) a book for embedding; call inside the metadata transaction."""
+    db.execute(text(ENQUEUE_SQL), {"book_id": book_id})
+
+
+def _embed(texts: dict[int, str]) -> tuple[dict[int, list[float]], dict[int, str]]:
+    """Vectors and errors by book id; the batcher coalesces texts across workers."""
+    futures = {book_id: embedding_batcher.submit(body) for book_id, body in texts.items()}
+    vectors, errors = {}, {}
+    for book_id, future in futures.items():
+        try:
+            vector = future.result()
+        except Exception as exc:
+            errors[book_id] = str(exc) or type(exc).__name__
+            continue
+        if vector is None:
+            errors[book_id] = "embedding API is not configured"
+        else:
+            vectors[book_id] = vector
+    return vectors, errors
+
+
+def process_jobs(limit: Optional[int] = None) -> int:
+    """Claim, embed and complete one round of due jobs. Returns the number claimed."""
+    limit = limit or settings.embedding_job_batch_size
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            text(CLAIM_SQL), {"lease": settings.embedding_job_lease_seconds, "limit": limit}
+        ).fetchall()
+        db.commit()
+        if not claimed:
+            return 0
+
+        books = db.execute(
+            text("""
+                SELECT id, title, description, text_hash, embedding IS NOT NULL AS embedded
+                FROM book_embedding WHERE id = ANY(:ids)
+            """),
+            {"ids": [job.book_id for job in claimed]},
+        ).fetchall()
+        db.commit()
+        texts = {row.id: book_text(row.title, row.description) for row in books}
+        hashes = {book_id: text_fingerprint(body) for book_id, body in texts.items() if body}
+        # The text may have reverted to what the stored vector already embeds
+        unchanged = {row.id for row in books if row.embedded and row.text_hash == hashes.get(row.id)}
+        vectors, errors = _embed(
+            {book_id: body for book_id, body in texts.items() if body and book_id not in unchanged}
+        )
+
+        # Deleted, unchanged and text-less books complete without a vector
+        done = [job for job in claimed if job.book_id not in errors]
+        written = set()
+        if done:
+            completed = db.execute(
+                text(COMPLETE_SQL),
+                {
+                    "ids": [job.book_id for job in done],
+                    "enqueued": [job.enqueued_at for job in done],
+                    "vecs": [
+                        vector_literal(vectors[job.book_id]) if job.book_id in vectors else None
+                        for job in done
+                    ],
+                    "hashes": [hashes.get(job.book_id) if job.book_id in vectors else None for job in done],
+                },
+            ).fetchall()
+            written = {row.id for row in completed}
+            for book_id in written & vectors.keys():
+                mark_dirty(db, book_id)
+            bump_generation(db, written & vectors.keys())
+            # Interactions that arrived before the vector (or counted the old one)
+            _reweigh_readers(db, {
+                row.id: (
+                    None if row.previous is None else from_db(row.previous),
+                    np.asarray(vectors[row.id], dtype=np.float32),
+                )
+                for row in completed if row.id in vectors
+            })
+        failed = [job for job in claimed if job.book_id in errors]
+        if failed:
+            db.execute(
+                text(FAIL_SQL),
+                {
+                    "ids": [job.book_id for job in failed],
+                    "enqueued": [job.enqueued_at for job in failed],
+                    "error": "; ".join(sorted(set(errors.values())))[:1000],
+                    "base": settings.embedding_job_retry_base_seconds,
+                    "max": settings.embedding_job_retry_max_seconds,
+                    "max_attempts": settings.embedding_job_max_attempts,
+                },
+            )
+        db.commit()
+    finally:
+        db.close()
+
+    EMBEDDING_JOBS.labels(outcome="unchanged").inc(len(unchanged & written))
+    _after_write(claimed, written - unchanged, vectors)
+    parked = 0
+    for job in failed:
+        if job.attempts >= settings.embedding_job_max_attempts:
+            parked += 1
+            logger.error(
+                "Embedding book %d failed %d times, parked until it changes: %s",
+                job.book_id, job.attempts, errors[job.book_id],
+            )
+        else:
+            logger.warning("Embedding book %d failed (attempt %d): %s", job.book_id, job.attempts, errors[job.book_id])
+    EMBEDDING_JOBS.labels(outcome="failed").inc(len(failed) - parked)
+    EMBEDDING_JOBS.labels(outcome="parked").inc(parked)
+    return len(claimed)
+
+
+def _reweigh_readers(db: Session, changes: dict) -> None:
+    if not changes:
+        return
+    cursor = db.connection().connection.cursor()
+    try:
+        reweigh_readers(cursor, changes)
+    finally:
+        cursor.close()
+
+
+def _after_write(claimed: list, written: set[int], vectors: dict[int, list[float]]) -> None:
+    """Post-commit side effects: mmap replica, result cache and metrics."""
+    store = get_vector_store()
+    now = time.time()
+    for job in claimed:
+        if job.book_id in written and job.book_id in vectors:
+            if store is not None:
+                store.upsert(job.book_id, vectors[job.book_id])
+            if result_cache is not None:
+                result_cache.invalidate(job.book_id, reembedded=True)
+            EMBEDDING_JOB_LAG.observe(max(0.0, now - job.enqueued_at.timestamp()))
+            EMBEDDING_JOBS.labels(outcome="embedded").inc()
+        elif job.book_id in written:
+            EMBEDDING_JOBS.labels(outcome="skipped").inc()
+        elif job.book_id in vectors:
+            EMBEDDING_JOBS.labels(outcome="superseded").inc()
+
+
+def _worker_loop(stop: threading.Event) -> None:
+    idle = settings.embedding_job_poll_interval_ms / 1000
+    while not stop.is_set():
+        try:
+            claimed = process_jobs()
+        except Exception as exc:
+            logger.exception("Embedding job round failed: %s", exc)
+            claimed = 0
+        if not claimed:
+            stop.wait(idle)
+
+
+def start_embedding_workers(stop: Optional[threading.Event] = None) -> list[threading.Thread]:
+    """Start ``embedding_workers`` daemon threads draining the embedding_job queue."""
+    stop = stop or threading.Event()
+    threads = []
+    for index in range(settings.embedding_workers):
+        thread = threading.Thread(
+            target=_worker_loop, args=(stop,), name=f"embedding-worker-{index}", daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -0,0 +1,171 @@
+"""Streaming export of book embeddings and interactions.
+
+Rows are read through a server-side cursor (``yield_per``) and encoded chunk
+by chunk, so memory stays constant however large the table is. Formats:
+
+* ``ndjson`` — one JSON object per line; vectors are copied verbatim from
+  pgvector's text form (already a JSON array), never parsed;
+* ``npy`` — embeddings only: one NumPy file of a structured array with ``id``
+  (int64) and ``embedding`` (float32) fields, loadable with ``np.load``. The
+  row count in the header and the rows come from one REPEATABLE READ snapshot.
+
+Used by ``GET /api/export/...`` (when ``export_api_enabled``) and the CLI::
+
+    python -m app.export embeddings --format npy --output books.npy
+    python -m app.export interactions --output interactions.ndjson
+    python -m app.export snapshot DIRECTORY
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Iterator
+
+import numpy as np
+from pgvector.utils import from_db
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_ROWS = 2000
+
+SNAPSHOT_FILES = {"embeddings": "book_embedding.ndjson", "interactions": "user_interaction.ndjson"}
+
+EMBEDDINGS_SQL = """
+    SELECT id, title, author, category, description, text_hash, embedding::text AS embedding
+    FROM book_embedding
+    WHERE id > :after_id
+    ORDER BY id
+"""
+
+INTERACTIONS_SQL = """
+    SELECT id, user_id, book_id, interaction_type, rating, created_at
+    FROM user_interaction
+    WHERE id > :after_id
+    ORDER BY id
+"""
+
+
+def _rows(bind: Engine, sql: str, params: dict, isolation_level: str = "READ COMMITTED"):
+    """Yield rows from a server-side cursor inside one read-only transaction."""
+    with bind.connect().execution_options(isolation_level=isolation_level) as conn:
+        result = conn.execution_options(yield_per=EXPORT_CHUNK_ROWS).execute(text(sql), params)
+        for partition in result.partitions():
+            yield from partition
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def embeddings_ndjson(bind: Engine, after_id: int = 0) -> Iterator[bytes]:
+    chunk = []
+    for row in _rows(bind, EMBEDDINGS_SQL, {"after_id": after_id}):
+        fields = {key: value for key, value in row._mapping.items() if key != "embedding"}
+        # pgvector's text form is a JSON array: splice it in as-is
+        chunk.append(f'{json.dumps(fields)[:-1]}, "embedding": {row.embedding or "null"}}}\n')
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "".join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield "".join(chunk).encode()
+
+
+def interactions_ndjson(bind: Engine, after_id: int = 0) -> Iterator[bytes]:
+    chunk = []
+    for row in _rows(bind, INTERACTIONS_SQL, {"after_id": after_id}):
+        chunk.append(json.dumps({key: _json_value(value) for key, value in row._mapping.items()}) + "\n")
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "".join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield "".join(chunk).encode()
+
+
+def embeddings_npy(bind: Engine, after_id: int = 0) -> Iterator[bytes]:
+    """Embedded books as one .npy structured array (books without a vector are left out)."""
+    dtype = np.dtype([("id", "<i8"), ("embedding", "<f4", (settings.embedding_dimensions,))])
+    with bind.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        count = conn.execute(
+            text("SELECT COUNT(*) FROM book_embedding WHERE id > :after_id AND embedding IS NOT NULL"),
+            {"after_id": after_id},
+        ).scalar()
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(
+            header, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (count,)}
+        )
+        yield header.getvalue()
+
+        result = conn.execution_options(yield_per=EXPORT_CHUNK_ROWS).execute(
+            text("""
+                SELECT id, embedding::text AS embedding FROM book_embedding
+                WHERE id > :after_id AND embedding IS NOT NULL
+                ORDER BY id
+            """),
+            {"after_id": after_id},
+        )
+        for partition in result.partitions():
+            block = np.empty(len(partition), dtype=dtype)
+            for position, row in enumerate(partition):
+                block[position] = (row.id, from_db(row.embedding))
+            yield block.tobytes()
+
+
+EXPORTERS = {
+    ("embeddings", "ndjson"): embeddings_ndjson,
+    ("embeddings", "npy"): embeddings_npy,
+    ("interactions", "ndjson"): interactions_ndjson,
+}
+
+
+def write_snapshot(bind: Engine, directory: str) -> dict[str, str]:
+    """Write every table as NDJSON into ``directory`` (the input of app.snapshot_import)."""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for table, filename in SNAPSHOT_FILES.items():
+        paths[table] = os.path.join(directory, filename)
+        with open(paths[table], "wb") as output:
+            for chunk in EXPORTERS[(table, "ndjson")](bind):
+                output.write(chunk)
+        logger.info("Exported %s to %s.", table, paths[table])
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream recommendation data out of the database.")
+    parser.add_argument("table", choices=["embeddings", "interactions", "snapshot"])
+    parser.add_argument("directory", nargs="?", help="snapshot: output directory")
+    parser.add_argument("--format", choices=["ndjson", "npy"], default="ndjson")
+    parser.add_argument("--after-id", type=int, default=0, help="only rows with a larger id")
+    parser.add_argument("--output", help="file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    from app.database import engine
+
+    if args.table == "snapshot":
+        if not args.directory:
+            parser.error("snapshot needs an output directory")
+        write_snapshot(engine, args.directory)
+        return
+    exporter = EXPORTERS.get((args.table, args.format))
+    if exporter is None:
+        parser.error(f"{args.table} cannot be exported as {args.format}")
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in exporter(engine, args.after_id):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Hybrid search — PostgreSQL full-text/trigram matching fused with vector search.
+
+The lexical probe is a GIN index lookup (``search_document @@ tsquery`` or a
+trigram match on title/author) that costs a few milliseconds. When its best
+hit matches the query's title or author almost exactly, the embedding call
+is skipped altogether; otherwise both rankings are merged with reciprocal
+rank fusion (RRF), which needs no score calibration between the two.
+"""
+
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.schema import search_document
+from app.vector_search import SearchFilters
+
+
+class LexicalHit(NamedTuple):
+    id: int
+    title: str
+    author: Optional[str]
+    category: Optional[str]
+    description: Optional[str]
+    text_rank: float  # ts_rank_cd, normalised to [0, 1)
+    trigram: float  # best of similarity(title, q) / similarity(author, q)
+
+
+class FusedHit(NamedTuple):
+    id: int
+    title: str
+    author: Optional[str]
+    category: Optional[str]
+    description: Optional[str]
+    score: float  # RRF score
+    similarity: Optional[float]  # cosine similarity, when the book came from the vector search
+
+
+def lexical_search(
+    db: Session, query: str, limit: int, filters: SearchFilters = SearchFilters()
+) -> list[LexicalHit]:
+    """Full-text + trigram candidates ordered by combined text score."""
+    clauses, params = filters.conditions()
+    document = search_document()
+    rows = db.execute(
+        text(f"""
+            WITH q AS (SELECT websearch_to_tsquery(CAST(:config AS regconfig), :query) AS tsq)
+            SELECT id, title, author, category, description,
+                   ts_rank_cd({document}, q.tsq, 32) AS text_rank,
+                   GREATEST(similarity(title, :query), similarity(coalesce(author, ''), :query)) AS trigram
+            FROM book_embedding be, q
+            WHERE ({document} @@ q.tsq OR title % :query OR author % :query)
+              {"".join(f" AND {clause}" for clause in clauses)}
+            ORDER BY ts_rank_cd({document}, q.tsq, 32)
+                     + GREATEST(similarity(title, :query), similarity(coalesce(author, ''), :query)) DESC,
+                     id
+            LIMIT :limit
+        """),
+        {"config": settings.search_text_config, "query": query, "limit": limit, **params},
+    ).fetchall()
+    return [LexicalHit(*row) for row in rows]
+
+
+def is_confident(hits: list[LexicalHit]) -> bool:
+    """True when the top hit is an (almost) exact title/author match."""
+    return bool(hits) and hits[0].trigram >= settings.hybrid_confident_similarity
+
+
+def reciprocal_rank_fusion(lexical: Iterable, semantic: Iterable, limit: int) -> list[FusedHit]:
+    """Merge two ranked lists: score(d) = Σ 1 / (k + rank(d))."""
+    k = settings.hybrid_rrf_k
+    scores: dict[int, float] = {}
+    books: dict[int, object] = {}
+    similarity: dict[int, float] = {}
+    for rank, row in enumerate(lexical, start=1):
+        scores[row.id] = scores.get(row.id, 0.0) + 1.0 / (k + rank)
+        books[row.id] = row
+    for rank, row in enumerate(semantic, start=1):
+        scores[row.id] = scores.get(row.id, 0.0) + 1.0 / (k + rank)
+        books.setdefault(row.id, row)
+        similarity[row.id] = float(row.similarity)
+
+    ranked = sorted(scores, key=lambda book_id: (-scores[book_id], book_id))[:limit]
+    return [
+        FusedHit(
+            book_id,
+            books[book_id].title,
+            books[book_id].author,
+            books[book_id].category,
+            books[book_id].description,
+            scores[book_id],
+            similarity.get(book_id),
+        )
+        for book_id in ranked
+    ]
@@ -0,0 +1,235 @@
+"""Interaction ingestion — buffers user_interaction rows and bulk-loads them with COPY.
+
+Rows are flushed by a background thread once ``interaction_flush_size`` rows
+are buffered or ``interaction_flush_interval_ms`` has passed. Each row carries
+an opaque token (the consumer passes its RabbitMQ delivery) which is reported
+back through ``on_settled`` only after the flush committed — or was rejected
+by the database as bad data. Connection loss, deadlocks and other errors keep
+the rows buffered (still unacknowledged) for the next flush. Rows whose token
+is no longer live (``is_live``: the delivery's channel closed, so the broker
+redelivers the message) are dropped before writing rather than stored twice.
+User taste profiles and book popularity are updated within the same
+transaction.
+"""
+
+import csv
+import io
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, NamedTuple, Optional
+
+import psycopg2
+from prometheus_client import Gauge, Histogram
+
+from app.config import settings
+from app.database import engine
+from app.popularity import bump_popularity
+from app.profiles import apply_interactions
+
+logger = logging.getLogger(__name__)
+
+INTERACTION_FLUSH_ROWS = Histogram(
+    "recommendation_interaction_flush_rows",
+    "Rows written per interaction flush",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+INTERACTION_FLUSH_LATENCY = Histogram(
+    "recommendation_interaction_flush_seconds", "Time spent writing one interaction flush"
+)
+INTERACTION_BUFFERED = Gauge(
+    "recommendation_interaction_buffered_rows", "Interaction rows waiting to be flushed"
+)
+
+INTERACTION_TYPES = {
+    "loan.borrowed": "borrow",
+    "loan.returned": "return",
+    "rating.created": "rate",
+    "favorite.added": "favorite",
+}
+
+COPY_SQL = (
+    "COPY user_interaction (user_id, book_id, interaction_type, rating, created_at) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+INSERT_SQL = (
+    "INSERT INTO user_interaction (user_id, book_id, interaction_type, rating, created_at) "
+    "VALUES (%s, %s, %s, %s, %s)"
+)
+
+# Errors caused by the rows themselves: isolated row by row and dead-lettered
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+class InteractionRow(NamedTuple):
+    user_id: int
+    book_id: int
+    interaction_type: str
+    rating: Optional[float]
+    created_at: datetime
+
+
+def event_time(payload: dict) -> datetime:
+    """Publication time from the event envelope (keeps replayed history dated correctly)."""
+    stamp = (payload.get("_meta") or {}).get("timestamp")
+    if stamp:
+        try:
+            parsed = datetime.fromisoformat(stamp)
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            return parsed
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def interaction_row(event_type: str, payload: dict) -> InteractionRow:
+    rating = payload.get("rating")
+    return InteractionRow(
+        user_id=int(payload["user_id"]),
+        book_id=int(payload["book_id"]),
+        interaction_type=INTERACTION_TYPES.get(event_type, event_type),
+        rating=None if rating is None else float(rating),
+        created_at=event_time(payload),
+    )
+
+
+def copy_rows(cursor, rows: list[InteractionRow]):
+    """Stream rows through COPY ... FROM STDIN (CSV, empty field = NULL)."""
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for row in rows:
+        writer.writerow([
+            row.user_id,
+            row.book_id,
+            row.interaction_type,
+            "" if row.rating is None else row.rating,
+            row.created_at.isoformat(),
+        ])
+    data.seek(0)
+    cursor.copy_expert(COPY_SQL, data)
+
+
+def apply_derived(cursor, rows: list[InteractionRow]):
+    """Update the tables maintained from interactions (taste profiles, popularity)."""
+    apply_interactions(cursor, rows)
+    bump_popularity(cursor, rows)
+
+
+class InteractionBuffer:
+    """Size/time-bounded buffer flushed to Postgres with a single COPY."""
+
+    def __init__(
+        self,
+        on_settled: Callable[[list[Any], list[Any]], None],
+        flush_size: int = None,
+        flush_interval_ms: int = None,
+        is_live: Callable[[Any], bool] = lambda token: True,
+    ):
+        self._on_settled = on_settled
+        self._is_live = is_live
+        self._flush_size = flush_size or settings.interaction_flush_size
+        self._flush_interval = (flush_interval_ms or settings.interaction_flush_interval_ms) / 1000
+        self._rows: list[tuple[InteractionRow, Any]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="interaction-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def add(self, row: InteractionRow, token: Any):
+        with self._lock:
+            self._rows.append((row, token))
+            size = len(self._rows)
+        INTERACTION_BUFFERED.set(size)
+        if size >= self._flush_size:
+            self._wakeup.set()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                logger.exception("Interaction flush crashed: %s", exc)
+
+    def flush(self):
+        with self._lock:
+            pending, self._rows = self._rows, []
+        INTERACTION_BUFFERED.set(0)
+        live = [(row, token) for row, token in pending if self._is_live(token)]
+        if len(live) < len(pending):
+            logger.warning("Dropped %d buffered interactions redelivered on a new channel.", len(pending) - len(live))
+        pending = live
+        if not pending:
+            return
+
+        started = time.perf_counter()
+        try:
+            succeeded, failed, retry = self._write(pending)
+        except Exception as exc:
+            # Database unreachable: keep the rows (still unacknowledged) for the next tick
+            logger.error("Interaction flush failed, will retry: %s", exc)
+            retry, succeeded, failed = pending, [], []
+        if retry:
+            with self._lock:
+                self._rows[:0] = retry
+        if not succeeded and not failed:
+            return
+        INTERACTION_FLUSH_LATENCY.observe(time.perf_counter() - started)
+        INTERACTION_FLUSH_ROWS.observe(len(succeeded))
+        self._on_settled(succeeded, failed)
+
+    def _write(
+        self, pending: list[tuple[InteractionRow, Any]]
+    ) -> tuple[list[Any], list[Any], list[tuple[InteractionRow, Any]]]:
+        """Write the rows; returns (succeeded tokens, failed tokens, rows to retry)."""
+        connection = engine.raw_connection()
+        try:
+            try:
+                with connection.cursor() as cursor:
+                    rows = [row for row, _ in pending]
+                    copy_rows(cursor, rows)
+                    apply_derived(cursor, rows)
+                connection.commit()
+                return [token for _, token in pending], [], []
+            except ROW_ERRORS as exc:
+                connection.rollback()
+                logger.warning("COPY of %d interactions failed (%s); inserting row by row.", len(pending), exc)
+
+            # Isolate bad rows so one malformed event does not block the rest
+            succeeded, failed = [], []
+            for index, (row, token) in enumerate(pending):
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(INSERT_SQL, tuple(row))
+                        apply_derived(cursor, [row])
+                    connection.commit()
+                    succeeded.append(token)
+                except ROW_ERRORS as exc:
+                    connection.rollback()
+                    logger.error("Interaction insert failed: %s", exc)
+                    failed.append(token)
+                except Exception as exc:
+                    # Not the row's fault: settle what was written, retry the rest
+                    logger.error(
+                        "Interaction inserts interrupted, %d rows kept for retry: %s", len(pending) - index, exc
+                    )
+                    return succeeded, failed, pending[index:]
+            return succeeded, failed, []
+        finally:
+            connection.close()
@@ -0,0 +1,83 @@
+"""Local embedding backend — a sentence-transformers model inside the service process.
+
+Selected with ``embedding_backend="local"`` (air-gapped deployments, query
+embedding without a network round trip). The model is loaded once per
+process, texts are encoded in batches on the CPU (optionally through ONNX
+Runtime) and async callers run inference on a small dedicated thread pool.
+
+Vectors of different models are not comparable: the model's dimension must
+equal ``embedding_dimensions``, and switching backends needs a re-embed run
+(``python -m app.reembed``).
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional: only needed for embedding_backend="local"
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbedder:
+    """Batched, L2-normalised CPU inference with one loaded model."""
+
+    def __init__(self, model_name: str, onnx: bool = False, batch_size: int = 32, threads: int = 0, workers: int = 2):
+        if SentenceTransformer is None:
+            raise RuntimeError("embedding_backend=local requires the 'sentence-transformers' package")
+        if threads > 0 and not onnx:
+            import torch  # installed with sentence-transformers
+
+            torch.set_num_threads(threads)
+        self._model = SentenceTransformer(model_name, device="cpu", **({"backend": "onnx"} if onnx else {}))
+        dimensions = self._model.get_sentence_embedding_dimension()
+        if dimensions != settings.embedding_dimensions:
+            raise RuntimeError(
+                f"Local model {model_name} produces {dimensions}-dimensional vectors but "
+                f"embedding_dimensions is {settings.embedding_dimensions}"
+            )
+        self._batch_size = batch_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="local-embedder")
+        logger.info("Local embedding model %s loaded (%d dimensions).", model_name, dimensions)
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        vectors = self._model.encode(
+            texts,
+            batch_size=self._batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return np.asarray(vectors, dtype=np.float32).tolist()
+
+    async def aembed(self, texts: list[str]) -> list[list[float]]:
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self.embed, texts)
+
+
+_embedder: Optional[LocalEmbedder] = None
+_lock = threading.Lock()
+
+
+def get_local_embedder() -> LocalEmbedder:
+    """The process-wide model (loaded on first use; the app lifespan warms it up)."""
+    global _embedder
+    if _embedder is None:
+        with _lock:
+            if _embedder is None:
+                _embedder = LocalEmbedder(
+                    settings.local_embedding_model,
+                    onnx=settings.local_embedding_onnx,
+                    batch_size=settings.local_embedding_batch_size,
+                    threads=settings.local_embedding_threads,
+                    workers=settings.local_embedding_workers,
+                )
+    return _embedder
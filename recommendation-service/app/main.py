@@ -14,10 +14,20 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from prometheus_client import make_asgi_app
 
+from app.collaborative import start_collaborative_builder
 from app.config import settings
 from app.consumer import EmbeddingConsumer
-from app.database import engine, Base
-from app.routes import health, recommendations
+from app.database import async_engine, engine, Base, SessionLocal
+from app.embedding import close_http_client, open_http_client
+from app.embedding_worker import start_embedding_workers
+from app.local_embedding import get_local_embedder
+from app.neighbors import start_neighbor_builder
+from app.popularity import start_popularity_refresher
+from app.routes import export, health, recommendations
+from app.schema import ensure_schema, start_schema_index_build
+from app.snapshot_import import import_snapshot
+from app.vector_index import start_index_build
+from app.vector_store import get_vector_store
 
 logging.basicConfig(
     level=logging.INFO,
@@ -35,8 +45,41 @@ async def lifespan(application: FastAPI):
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         conn.commit()
     Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
     logger.info("Database tables ensured (pgvector enabled).")
 
+    # New replica: load the configured snapshot (no embedding calls) before consuming or serving
+    if settings.bootstrap_snapshot_dir:
+        import_snapshot(engine, settings.bootstrap_snapshot_dir, if_empty=True)
+
+    # Build / repair the ANN and secondary indexes in the background (CREATE INDEX CONCURRENTLY)
+    start_index_build(engine)
+    start_schema_index_build(engine)
+
+    # Backfill book_popularity, then recompute it periodically
+    start_popularity_refresher(engine)
+
+    # Item-item co-occurrence model: incremental rebuilds on a schedule (one worker at a time)
+    start_collaborative_builder(engine)
+
+    # Exact top-K neighbour lists for /similar: full build once, then dirty books only
+    start_neighbor_builder(engine)
+
+    # Shared mmap replica of the embedding matrix (vector_engine="mmap")
+    store = get_vector_store()
+    if store is not None:
+        store.sync_from_db(SessionLocal)
+
+    # One pooled keep-alive client per worker for the embedding API
+    open_http_client()
+    if settings.embedding_backend == "local":
+        # Load the local model before serving so no request pays for it
+        get_local_embedder()
+
+    # Embedding generation runs beside, not inside, event consumption
+    embedding_workers_stop = threading.Event()
+    start_embedding_workers(embedding_workers_stop)
+
     # Start RabbitMQ consumer for embedding updates
     consumer = EmbeddingConsumer()
     consumer_thread = threading.Thread(target=consumer.start, daemon=True)
@@ -46,6 +89,10 @@ async def lifespan(application: FastAPI):
     yield
 
     consumer.stop()
+    embedding_workers_stop.set()
+    await close_http_client()
+    if async_engine is not None:
+        await async_engine.dispose()
     logger.info("Recommendation service shutting down.")
 
 
@@ -63,3 +110,4 @@ app.mount("/metrics", metrics_app)
 # Routers
 app.include_router(health.router)
 app.include_router(recommendations.router, prefix="/api/recommendations")
+app.include_router(export.router, prefix="/api/export")
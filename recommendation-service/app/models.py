@@ -1,7 +1,7 @@
 """Models — book embeddings and interaction data stored locally."""
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, Float, DateTime, Text, Index, LargeBinary, false
 from pgvector.sqlalchemy import Vector
 
 from app.config import settings
@@ -17,7 +17,9 @@ class BookEmbedding(Base):
     author = Column(String(500), nullable=True)
     category = Column(String(255), nullable=True)
     description = Column(Text, nullable=True)
-    embedding = Column(Vector(settings.embedding_dimensions), nullable=True)
+    embedding = Column(Vector(settings.embedding_dimensions), nullable=True)  # ANN index: app.vector_index
+    embedding_stale = Column(Boolean, nullable=False, default=False, server_default=false())  # job pending
+    text_hash = Column(String(64), nullable=True)  # text_fingerprint of the text the embedding embeds
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
@@ -34,3 +36,137 @@ class UserInteraction(Base):
     interaction_type = Column(String(30), nullable=False)  # borrow, return, rate, favorite
     rating = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class EmbeddingCacheEntry(Base):
+    """Persistent embedding cache keyed by sha256(model, dimensions, normalised text)."""
+    __tablename__ = "embedding_cache"
+
+    key = Column(String(64), primary_key=True)
+    model = Column(String(100), nullable=False)
+    dimensions = Column(Integer, nullable=False)
+    embedding = Column(Vector(), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class EmbeddingJob(Base):
+    """Pending embedding generation for one book (see app.embedding_worker)."""
+    __tablename__ = "embedding_job"
+
+    book_id = Column(Integer, primary_key=True)
+    enqueued_at = Column(DateTime(timezone=True), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    locked_until = Column(DateTime(timezone=True), nullable=True)  # lease of the claiming worker
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_embedding_job_next_attempt", next_attempt_at),
+    )
+
+
+class EmbeddingJobCheckpoint(Base):
+    """Progress of a resumable bulk re-embedding run (see app.reembed)."""
+    __tablename__ = "embedding_job_checkpoint"
+
+    job = Column(String(200), primary_key=True)  # reembed:<model>:<dimensions>
+    last_book_id = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class UserProfile(Base):
+    """Per-user taste vector: running weighted sum of interacted book embeddings (see app.profiles)."""
+    __tablename__ = "user_profile"
+
+    user_id = Column(Integer, primary_key=True)
+    embedding_sum = Column(Vector(settings.embedding_dimensions), nullable=True)
+    weight_total = Column(Float, nullable=False, default=0.0)
+    interaction_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UserTasteCluster(Base):
+    """One of up to k taste centroids per user (sequential k-means, see app.profiles)."""
+    __tablename__ = "user_taste_cluster"
+
+    user_id = Column(Integer, primary_key=True)
+    cluster = Column(Integer, primary_key=True)
+    centroid = Column(Vector(settings.embedding_dimensions), nullable=True)  # weighted mean of unit vectors
+    weight = Column(Float, nullable=False, default=0.0)
+    member_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class BookPopularity(Base):
+    """Maintained interaction counts per book for the "popular" strategy (see app.popularity)."""
+    __tablename__ = "book_popularity"
+
+    book_id = Column(Integer, primary_key=True)
+    category = Column(String(255), nullable=True)
+    interaction_count = Column(Integer, nullable=False, default=0)
+    decayed_score = Column(Float, nullable=False, default=0.0)  # ln of the forward-decay sum, see DECAY_EPOCH
+    last_interaction_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_book_popularity_count", interaction_count.desc()),
+        Index("ix_book_popularity_decayed", decayed_score.desc()),
+        Index("ix_book_popularity_category_count", category, interaction_count.desc()),
+        Index("ix_book_popularity_category_decayed", category, decayed_score.desc()),
+    )
+
+
+class CatalogGeneration(Base):
+    """Catalog change counter, sharded by book id (see app.search_cache)."""
+    __tablename__ = "catalog_generation"
+
+    shard = Column(Integer, primary_key=True)
+    generation = Column(BigInteger, nullable=False, default=0)
+
+
+class BookNeighbor(Base):
+    """Precomputed exact top-K neighbour list entry (see app.neighbors)."""
+    __tablename__ = "book_neighbors"
+
+    book_id = Column(Integer, primary_key=True)
+    rank = Column(Integer, primary_key=True)  # 0 = most similar
+    neighbor_id = Column(Integer, nullable=False)
+    similarity = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_book_neighbors_neighbor_id", neighbor_id),
+    )
+
+
+class BookNeighborDirty(Base):
+    """Books whose embedding changed since their neighbour lists were last refreshed."""
+    __tablename__ = "book_neighbors_dirty"
+
+    book_id = Column(Integer, primary_key=True)
+    marked_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class NeighborState(Base):
+    """Version and K of the stored neighbour lists (bumped by every refresh)."""
+    __tablename__ = "book_neighbors_state"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+    k = Column(Integer, nullable=False)
+    refreshed_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CollaborativeModel(Base):
+    """Serialized item-item co-occurrence model (see app.collaborative), one row per model."""
+    __tablename__ = "collaborative_model"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+    watermark = Column(Integer, nullable=False, default=0)  # last user_interaction.id folded in
+    items = Column(Integer, nullable=False, default=0)
+    model = Column(LargeBinary, nullable=False)  # npz: top neighbours per book (CSR), read by workers
+    state = Column(LargeBinary, nullable=False)  # npz: pair counts, read only by the builder
+    full_built_at = Column(DateTime, nullable=False)
+    built_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,312 @@
+"""Precomputed neighbour lists — exact top-K similar books for the whole catalog.
+
+``book_neighbors`` holds, per book, its ``neighbors_k`` most similar books by
+rank, so ``/similar`` is a primary-key range read. Lists are computed by a
+background builder with batched matrix products over the L2-normalised
+embedding matrix (exact, unlike the ANN index).
+
+Upserted and deleted books are marked in ``book_neighbors_dirty`` by the
+consumer, in the event's transaction. A refresh recomputes only the books
+whose list can change:
+
+* the dirty books themselves,
+* books whose list contains a dirty book, and
+* books a dirty book's new vector now beats at rank K (the list's *floor*).
+
+The builder keeps the matrix and floors in memory between runs and reloads
+them when another worker refreshed in between (``book_neighbors_state``
+version). Dirty books are served by the live search until refreshed.
+"""
+
+import io
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+from pgvector.utils import from_db
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.background import NEIGHBORS_BUILD_LOCK_KEY, start_periodic
+from app.config import settings
+from app.vector_search import SearchFilters
+
+logger = logging.getLogger(__name__)
+
+MARK_DIRTY_SQL = """
+    INSERT INTO book_neighbors_dirty (book_id, marked_at)
+    VALUES (:book_id, clock_timestamp())
+    ON CONFLICT (book_id) DO UPDATE SET marked_at = EXCLUDED.marked_at
+"""
+
+COPY_SQL = "COPY book_neighbors (book_id, rank, neighbor_id, similarity) FROM STDIN"
+
+
+def mark_dirty(db: Session, book_id: int) -> None:
+    """Queue a book for neighbour recomputation (call inside the change's transaction)."""
+    db.execute(text(MARK_DIRTY_SQL), {"book_id": book_id})
+
+
+# ─── Computation ──────────────────────────────────────────────────
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def top_neighbors(
+    query_ids: np.ndarray, queries: np.ndarray, ids: np.ndarray, vectors: np.ndarray, k: int, batch_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Exact top-k cosine neighbours (self excluded) of each normalised query row.
+
+    Returns (neighbour ids, similarities), both shaped (len(queries), k') with
+    k' = min(k, len(ids) - 1), best first.
+    """
+    width = max(0, min(k, len(ids) - 1))
+    neighbor_ids = np.empty((len(queries), width), dtype=np.int64)
+    similarities = np.empty((len(queries), width), dtype=np.float32)
+    if not width:
+        return neighbor_ids, similarities
+    for start in range(0, len(queries), batch_size):
+        stop = min(start + batch_size, len(queries))
+        scores = queries[start:stop] @ vectors.T
+        scores[ids[None, :] == query_ids[start:stop, None]] = -np.inf
+        top = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        neighbor_ids[start:stop] = ids[np.take_along_axis(top, order, axis=1)]
+        similarities[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbor_ids, similarities
+
+
+def reached_floor(
+    ids: np.ndarray, vectors: np.ndarray, floors: np.ndarray, changed_ids: np.ndarray, changed: np.ndarray,
+    batch_size: int,
+) -> np.ndarray:
+    """Mask of books for which some changed vector is at least as similar as their floor."""
+    hit = np.zeros(len(ids), dtype=bool)
+    for start in range(0, len(changed), batch_size):
+        block_ids = changed_ids[start:start + batch_size]
+        scores = vectors @ changed[start:start + batch_size].T
+        scores[ids[:, None] == block_ids[None, :]] = -np.inf
+        hit |= (scores >= floors[:, None]).any(axis=1)
+    return hit
+
+
+class Catalog(NamedTuple):
+    """Builder-side replica: sorted ids, normalised vectors and each list's floor."""
+    version: int
+    ids: np.ndarray
+    vectors: np.ndarray
+    floors: np.ndarray  # similarity at rank K; -inf while a list is shorter than K
+
+    def replace(self, removed: np.ndarray, added_ids: np.ndarray, added: np.ndarray) -> "Catalog":
+        """Drop ``removed`` and (re)insert ``added`` rows, keeping ids sorted (floors of new rows: -inf)."""
+        keep = ~np.isin(self.ids, np.concatenate([removed, added_ids]))
+        ids = np.concatenate([self.ids[keep], added_ids])
+        vectors = np.concatenate([self.vectors[keep], added]) if len(added) else self.vectors[keep]
+        floors = np.concatenate([self.floors[keep], np.full(len(added_ids), -np.inf, np.float32)])
+        order = np.argsort(ids, kind="stable")
+        return Catalog(self.version, ids[order], vectors[order], floors[order])
+
+
+# ─── Builder (one worker at a time) ───────────────────────────────
+
+_catalog: Optional[Catalog] = None
+
+
+def _load_catalog(cursor, version: int, k: int) -> Catalog:
+    cursor.execute("SELECT COUNT(*) FROM book_embedding WHERE embedding IS NOT NULL")
+    expected = cursor.fetchone()[0]
+    ids = np.empty(expected, dtype=np.int64)
+    vectors = np.empty((expected, settings.embedding_dimensions), dtype=np.float32)
+    cursor.execute(
+        "SELECT id, embedding::text FROM book_embedding WHERE embedding IS NOT NULL ORDER BY id"
+    )
+    loaded = 0
+    while loaded < expected and (rows := cursor.fetchmany(1000)):
+        for book_id, embedding in rows[: expected - loaded]:
+            ids[loaded] = book_id
+            vectors[loaded] = from_db(embedding)
+            loaded += 1
+    ids, vectors = ids[:loaded], _normalize(vectors[:loaded])
+
+    floors = np.full(loaded, -np.inf, dtype=np.float32)
+    cursor.execute("SELECT book_id, similarity FROM book_neighbors WHERE rank = %s", (k - 1,))
+    stored = cursor.fetchall()
+    if stored:
+        book_ids = np.array([row[0] for row in stored], dtype=np.int64)
+        positions = np.searchsorted(ids, book_ids).clip(max=max(loaded - 1, 0))
+        known = (ids[positions] == book_ids) if loaded else np.zeros(len(stored), bool)
+        floors[positions[known]] = np.array([row[1] for row in stored], dtype=np.float32)[known]
+    return Catalog(version, ids, vectors, floors)
+
+
+def _write_lists(cursor, catalog: Catalog, book_ids: np.ndarray) -> Catalog:
+    """Recompute and replace the lists of ``book_ids`` (present in the catalog); returns new floors."""
+    k = settings.neighbors_k
+    positions = np.searchsorted(catalog.ids, book_ids)
+    neighbor_ids, similarities = top_neighbors(
+        book_ids, catalog.vectors[positions], catalog.ids, catalog.vectors, k, settings.neighbors_batch_size
+    )
+    data = io.StringIO()
+    for book_id, row_ids, row_similarities in zip(book_ids, neighbor_ids, similarities):
+        for rank, (neighbor_id, similarity) in enumerate(zip(row_ids, row_similarities)):
+            data.write(f"{book_id}\t{rank}\t{neighbor_id}\t{similarity:.7g}\n")
+    data.seek(0)
+    cursor.copy_expert(COPY_SQL, data)
+
+    floors = catalog.floors.copy()
+    floors[positions] = similarities[:, k - 1] if neighbor_ids.shape[1] == k else -np.inf
+    return catalog._replace(floors=floors)
+
+
+def refresh_neighbors(bind: Engine, full: bool = False) -> Optional[int]:
+    """Bring book_neighbors up to date. Returns the number of lists rewritten, None if locked."""
+    global _catalog
+    k = settings.neighbors_k
+    connection = bind.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (NEIGHBORS_BUILD_LOCK_KEY,))
+            if not cursor.fetchone()[0]:
+                connection.rollback()
+                return None
+            started = time.perf_counter()
+            cursor.execute("SELECT version, k FROM book_neighbors_state WHERE name = 'catalog'")
+            state = cursor.fetchone()
+            full = full or state is None or state[1] != k
+            version = (state[0] if state else 0) + 1
+
+            if full:
+                cursor.execute("SELECT book_id, marked_at FROM book_neighbors_dirty")
+                dirty = cursor.fetchall()
+                cursor.execute("DELETE FROM book_neighbors")
+                catalog = _load_catalog(cursor, version, k)
+                catalog = _write_lists(cursor, catalog, catalog.ids)
+                rewritten = len(catalog.ids)
+            else:
+                if _catalog is None or _catalog.version != state[0]:
+                    _catalog = _load_catalog(cursor, state[0], k)
+                cursor.execute("SELECT book_id, marked_at FROM book_neighbors_dirty")
+                dirty = cursor.fetchall()
+                if not dirty:
+                    connection.rollback()
+                    return 0
+                catalog, rewritten = _refresh_dirty(cursor, _catalog, [row[0] for row in dirty])
+
+            # Marks made after the read above stay queued for the next run
+            cursor.execute(
+                """
+                DELETE FROM book_neighbors_dirty d
+                USING unnest(%s::integer[], %s::timestamptz[]) AS p(book_id, marked_at)
+                WHERE d.book_id = p.book_id AND d.marked_at = p.marked_at
+                """,
+                ([row[0] for row in dirty], [row[1] for row in dirty]),
+            )
+            cursor.execute(
+                """
+                INSERT INTO book_neighbors_state (name, version, k, refreshed_at)
+                VALUES ('catalog', %s, %s, now())
+                ON CONFLICT (name) DO UPDATE SET
+                    version = EXCLUDED.version, k = EXCLUDED.k, refreshed_at = EXCLUDED.refreshed_at
+                """,
+                (version, k),
+            )
+        connection.commit()
+        _catalog = catalog._replace(version=version)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    logger.info(
+        "Neighbour lists %s: %d rewritten in %.2fs.",
+        "rebuilt" if full else "refreshed", rewritten, time.perf_counter() - started,
+    )
+    return rewritten
+
+
+def _refresh_dirty(cursor, catalog: Catalog, dirty: Sequence[int]) -> tuple[Catalog, int]:
+    cursor.execute(
+        "SELECT id, embedding::text FROM book_embedding WHERE id = ANY(%s) AND embedding IS NOT NULL",
+        (list(dirty),),
+    )
+    current = cursor.fetchall()
+    changed_ids = np.array([row[0] for row in current], dtype=np.int64)
+    changed = _normalize(np.array([from_db(row[1]) for row in current], dtype=np.float32)).reshape(
+        len(current), -1
+    )
+    dirty_ids = np.array(sorted(dirty), dtype=np.int64)
+    catalog = catalog.replace(np.setdiff1d(dirty_ids, changed_ids), changed_ids, changed)
+
+    # Lists that hold a dirty book, plus lists a new vector now enters
+    cursor.execute(
+        "SELECT DISTINCT book_id FROM book_neighbors WHERE neighbor_id = ANY(%s)", (dirty_ids.tolist(),)
+    )
+    holders = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+    entered = catalog.ids[
+        reached_floor(catalog.ids, catalog.vectors, catalog.floors, changed_ids, changed, settings.neighbors_batch_size)
+    ]
+    affected = np.union1d(np.union1d(changed_ids, holders), entered)
+    affected = affected[np.isin(affected, catalog.ids)]
+
+    cursor.execute(
+        "DELETE FROM book_neighbors WHERE book_id = ANY(%s)", (np.union1d(affected, dirty_ids).tolist(),)
+    )
+    return _write_lists(cursor, catalog, affected), len(affected)
+
+
+def start_neighbor_builder(bind: Engine) -> Optional[threading.Thread]:
+    """Build missing lists now, then refresh dirty books every neighbors_refresh_interval_seconds."""
+    if not settings.neighbors_enabled:
+        return None
+    return start_periodic(
+        "neighbor-builder",
+        lambda: refresh_neighbors(bind),
+        settings.neighbors_refresh_interval_seconds,
+        "Neighbour list refresh",
+    )
+
+
+# ─── Reads ────────────────────────────────────────────────────────
+
+
+def precomputed_neighbors(
+    db: Session, book_ids: Sequence[int], limit: int, filters: SearchFilters = SearchFilters()
+) -> dict[int, list]:
+    """Stored lists of up to ``limit`` rows per book, for books whose list can answer the request.
+
+    A list answers when it yields ``limit`` rows after the filters. Books that
+    are dirty, not built yet or filtered below ``limit`` are left out — the
+    caller searches those live. ``min_similarity`` trims the returned rows.
+    """
+    if not settings.neighbors_enabled or limit > settings.neighbors_k or not book_ids:
+        return {}
+    clauses, params = filters.conditions()
+    rows = db.execute(
+        text(f"""
+            SELECT bn.book_id AS source_id, be.id, be.title, be.author, be.category, be.description,
+                   bn.similarity
+            FROM book_neighbors bn
+            JOIN book_embedding be ON be.id = bn.neighbor_id
+            WHERE bn.book_id = ANY(:book_ids)
+              AND NOT EXISTS (SELECT 1 FROM book_neighbors_dirty d WHERE d.book_id = bn.book_id)
+              {"".join(f" AND {clause}" for clause in clauses)}
+            ORDER BY bn.book_id, bn.rank
+        """),
+        {"book_ids": list(book_ids), **params},
+    ).fetchall()
+    lists: dict[int, list] = {}
+    for row in rows:
+        lists.setdefault(row.source_id, []).append(row)
+    return {
+        book_id: filters.above_minimum(found[:limit])
+        for book_id, found in lists.items()
+        if len(found) >= limit
+    }
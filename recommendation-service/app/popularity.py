@@ -0,0 +1,197 @@
+"""Book popularity — maintained all-time and time-decayed interaction counts.
+
+``book_popularity`` is bumped by the consumer together with every interaction
+flush, so the cold-start "popular" strategy is an indexed top-N read instead of
+a GROUP BY over the whole user_interaction table. The trending score uses
+forward decay: each interaction weighs ``2 ** ((t - DECAY_EPOCH) / half_life)``,
+which never has to be rewritten as time passes — ordering by the stored score
+is ordering by the decayed count. The weights grow without bound, so the table
+stores the natural log of their sum (``decayed_score``) and adds to it with
+log-sum-exp; neither side can overflow however far ``t`` is from the epoch. A
+background refresher recomputes the table from user_interaction periodically
+(and on first start), correcting any drift.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.background import POPULARITY_REFRESH_LOCK_KEY, start_periodic
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+DECAY_EPOCH = datetime(2024, 1, 1)
+
+ORDER_COLUMNS = {"all_time": "interaction_count", "trending": "decayed_score"}
+
+# ln(exp(a) + exp(b)) without leaving the log domain; exp() of a large negative
+# float8 raises an underflow error in Postgres, so the difference is clamped
+LOG_ADD_SQL = "GREATEST({a}, {b}) + ln(1 + exp(GREATEST(-abs({a} - {b}), -700)))"
+
+BUMP_SQL = """
+    INSERT INTO book_popularity (book_id, category, interaction_count, decayed_score, last_interaction_at)
+    SELECT d.book_id, be.category, d.n, d.score, d.last_at
+    FROM unnest(%s::integer[], %s::integer[], %s::float8[], %s::timestamp[])
+         AS d(book_id, n, score, last_at)
+    LEFT JOIN book_embedding be ON be.id = d.book_id
+    ON CONFLICT (book_id) DO UPDATE SET
+        category = COALESCE(EXCLUDED.category, book_popularity.category),
+        interaction_count = book_popularity.interaction_count + EXCLUDED.interaction_count,
+        decayed_score = {log_add},
+        last_interaction_at = GREATEST(book_popularity.last_interaction_at, EXCLUDED.last_interaction_at)
+""".format(log_add=LOG_ADD_SQL.format(a="book_popularity.decayed_score", b="EXCLUDED.decayed_score"))
+
+REFRESH_SQL = """
+    INSERT INTO book_popularity (book_id, category, interaction_count, decayed_score, last_interaction_at)
+    SELECT w.book_id, MAX(be.category), COUNT(*),
+           MAX(w.top) + ln(SUM(exp(GREATEST(w.weight - w.top, -700)))),
+           MAX(w.created_at)
+    FROM (
+        SELECT book_id, created_at, weight, MAX(weight) OVER (PARTITION BY book_id) AS top
+        FROM (
+            SELECT book_id, created_at,
+                   extract(epoch FROM created_at - :epoch) / :half_life * ln(2.0) AS weight
+            FROM user_interaction
+        ) ui
+    ) w
+    LEFT JOIN book_embedding be ON be.id = w.book_id
+    GROUP BY w.book_id
+    ON CONFLICT (book_id) DO UPDATE SET
+        category = EXCLUDED.category,
+        interaction_count = EXCLUDED.interaction_count,
+        decayed_score = EXCLUDED.decayed_score,
+        last_interaction_at = EXCLUDED.last_interaction_at
+"""
+
+
+def _half_life_seconds() -> float:
+    return settings.popularity_half_life_days * 86400
+
+
+def log_decay_weight(at: datetime) -> float:
+    """Natural log of the forward-decay weight of one interaction at ``at`` (naive UTC)."""
+    return (at - DECAY_EPOCH).total_seconds() / _half_life_seconds() * math.log(2.0)
+
+
+def log_add(a: float, b: float) -> float:
+    """``ln(exp(a) + exp(b))`` without overflow."""
+    high, low = max(a, b), min(a, b)
+    if low == -math.inf:
+        return high
+    return high + math.log1p(math.exp(low - high))
+
+
+def trending_score(decayed_score: float, now: Optional[datetime] = None) -> float:
+    """Stored log forward-decay score as a decayed interaction count at ``now``."""
+    return math.exp(min(decayed_score - log_decay_weight(now or datetime.utcnow()), 700.0))
+
+
+def bump_popularity(cursor, rows: Iterable) -> int:
+    """Add interaction rows (user_id, book_id, type, rating, created_at) to the counters.
+
+    One upsert per flush on a DBAPI cursor, sharing the interaction rows'
+    transaction. Returns the number of books touched.
+    """
+    counts: dict[int, int] = defaultdict(int)
+    scores: dict[int, float] = defaultdict(lambda: -math.inf)
+    last: dict[int, datetime] = {}
+    for row in rows:
+        book_id, created_at = row[1], row[4]
+        counts[book_id] += 1
+        scores[book_id] = log_add(scores[book_id], log_decay_weight(created_at))
+        last[book_id] = max(last.get(book_id, created_at), created_at)
+    if not counts:
+        return 0
+
+    book_ids = list(counts)
+    cursor.execute(
+        BUMP_SQL,
+        (
+            book_ids,
+            [counts[book_id] for book_id in book_ids],
+            [scores[book_id] for book_id in book_ids],
+            [last[book_id] for book_id in book_ids],
+        ),
+    )
+    return len(book_ids)
+
+
+def top_books(db: Session, limit: int, window: str = "all_time", category: Optional[str] = None) -> list:
+    """Top-N books by popularity — an index scan on book_popularity.
+
+    Rows: id, title, author, category, interaction_count, decayed_score.
+    Padded with not-yet-interacted books when fewer than ``limit`` are ranked.
+    """
+    order = ORDER_COLUMNS[window]
+    params = {"limit": limit, "category": category}
+    where = "WHERE bp.category = :category" if category is not None else ""
+    ranked = db.execute(
+        text(f"""
+            SELECT be.id, be.title, be.author, be.category,
+                   bp.interaction_count, bp.decayed_score
+            FROM book_popularity bp
+            JOIN book_embedding be ON be.id = bp.book_id
+            {where}
+            ORDER BY bp.{order} DESC, bp.book_id
+            LIMIT :limit
+        """),
+        params,
+    ).fetchall()
+    if len(ranked) >= limit:
+        return ranked
+
+    padding = db.execute(
+        text(f"""
+            SELECT be.id, be.title, be.author, be.category,
+                   0 AS interaction_count, '-Infinity'::float8 AS decayed_score
+            FROM book_embedding be
+            WHERE NOT EXISTS (SELECT 1 FROM book_popularity bp WHERE bp.book_id = be.id)
+              {"AND be.category = :category" if category is not None else ""}
+            ORDER BY be.id
+            LIMIT :limit
+        """),
+        {**params, "limit": limit - len(ranked)},
+    ).fetchall()
+    return list(ranked) + list(padding)
+
+
+def refresh_popularity(bind: Engine) -> bool:
+    """Recompute book_popularity from user_interaction. False if another worker holds the lock."""
+    with bind.connect() as conn:
+        locked = conn.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": POPULARITY_REFRESH_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            return False
+        started = time.perf_counter()
+        conn.execute(
+            text(REFRESH_SQL), {"epoch": DECAY_EPOCH, "half_life": _half_life_seconds()}
+        )
+        conn.execute(
+            text("""
+                DELETE FROM book_popularity bp
+                WHERE NOT EXISTS (SELECT 1 FROM user_interaction ui WHERE ui.book_id = bp.book_id)
+            """)
+        )
+        conn.commit()
+    logger.info("Book popularity refreshed in %.2fs.", time.perf_counter() - started)
+    return True
+
+
+def start_popularity_refresher(bind: Engine) -> threading.Thread:
+    """Refresh once now (backfills a new table), then every popularity_refresh_interval_seconds."""
+    return start_periodic(
+        "popularity-refresher",
+        lambda: refresh_popularity(bind),
+        settings.popularity_refresh_interval_seconds,
+        "Popularity refresh",
+    )
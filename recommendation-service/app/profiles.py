@@ -0,0 +1,334 @@
+"""User taste profiles — running weighted sums of interacted book embeddings.
+
+``user_profile.embedding_sum`` is updated incrementally as interactions arrive.
+Cosine distance is scale-invariant, so the sum can be searched with directly —
+it ranks exactly like the weighted mean would. Functions here work on a DBAPI
+cursor so the COPY ingestion path and ORM sessions
+(``session.connection().connection.cursor()``) share one implementation and
+one transaction with the interaction rows.
+
+A single centroid collapses mixed tastes into a midpoint, so next to the sum
+each user keeps up to ``profile_clusters`` centroids in ``user_taste_cluster``,
+maintained by sequential (mini-batch size 1) k-means: every interacted book
+either opens a new cluster — while fewer than k exist and none is at least
+``profile_cluster_spawn_similarity`` similar — or moves its nearest centroid
+towards it with a per-cluster learning rate of weight / cluster weight.
+
+Interactions with books that have no vector yet add nothing when they arrive.
+Whenever a book's vector is written, replaced or removed, its readers'
+profiles and clusters are shifted by weight x (new - old) in the same
+transaction (``reweigh_readers``) — only the interactions with that book are
+read. Replaying whole histories (``rebuild_profiles``) is left to backfills.
+"""
+
+from collections import defaultdict
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+from pgvector.utils import from_db
+
+from app.config import settings
+from app.vector_search import vector_literal
+
+UPSERT_PROFILES_SQL = """
+    INSERT INTO user_profile (user_id, embedding_sum, weight_total, interaction_count, updated_at)
+    SELECT d.user_id, d.embedding_sum, d.weight_total, d.interaction_count, now() AT TIME ZONE 'utc'
+    FROM unnest(%s::integer[], %s::vector[], %s::float8[], %s::integer[])
+         AS d(user_id, embedding_sum, weight_total, interaction_count)
+    ON CONFLICT (user_id) DO UPDATE SET
+        embedding_sum = COALESCE(user_profile.embedding_sum + EXCLUDED.embedding_sum,
+                                 EXCLUDED.embedding_sum),
+        weight_total = user_profile.weight_total + EXCLUDED.weight_total,
+        interaction_count = user_profile.interaction_count + EXCLUDED.interaction_count,
+        updated_at = EXCLUDED.updated_at
+"""
+
+# Row locks serialise concurrent writers of the same user's clusters
+SELECT_CLUSTERS_SQL = """
+    SELECT user_id, cluster, centroid::text, weight, member_count
+    FROM user_taste_cluster
+    WHERE user_id = ANY(%s)
+    ORDER BY user_id, cluster
+    FOR UPDATE
+"""
+
+UPSERT_CLUSTERS_SQL = """
+    INSERT INTO user_taste_cluster (user_id, cluster, centroid, weight, member_count, updated_at)
+    SELECT d.user_id, d.cluster, d.centroid, d.weight, d.member_count, now() AT TIME ZONE 'utc'
+    FROM unnest(%s::integer[], %s::integer[], %s::vector[], %s::float8[], %s::integer[])
+         AS d(user_id, cluster, centroid, weight, member_count)
+    ON CONFLICT (user_id, cluster) DO UPDATE SET
+        centroid = EXCLUDED.centroid,
+        weight = EXCLUDED.weight,
+        member_count = EXCLUDED.member_count,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+class TasteCluster(NamedTuple):
+    centroid: np.ndarray  # weighted mean of unit book vectors
+    weight: float
+    member_count: int
+
+
+def interaction_weight(interaction_type: str, rating=None) -> float:
+    """How strongly one interaction pulls the profile towards the book."""
+    if interaction_type == "borrow":
+        return settings.profile_weight_borrow
+    if interaction_type == "favorite":
+        return settings.profile_weight_favorite
+    if interaction_type == "rate":
+        return settings.profile_weight_rate * (float(rating or 0) / 5.0)
+    return 0.0  # "return" adds nothing beyond the borrow
+
+
+def book_vectors(cursor, book_ids: Iterable[int]) -> dict[int, np.ndarray]:
+    """Stored vectors of the books that have one."""
+    cursor.execute(
+        "SELECT id, embedding::text FROM book_embedding WHERE id = ANY(%s) AND embedding IS NOT NULL",
+        (list(book_ids),),
+    )
+    return {book_id: from_db(embedding) for book_id, embedding in cursor.fetchall()}
+
+
+def apply_interactions(cursor, rows: Iterable) -> int:
+    """Fold interaction rows (user_id, book_id, interaction_type, rating, ...) into profiles.
+
+    One query fetches the book vectors and one statement upserts every touched
+    profile, with the addition done server-side so concurrent writers never
+    lose updates. Returns the number of profiles touched.
+    """
+    return len(_apply(cursor, rows))
+
+
+def _apply(cursor, rows: Iterable) -> list[int]:
+    weighted = [
+        (row[0], row[1], weight)
+        for row in rows
+        if (weight := interaction_weight(row[2], row[3])) > 0
+    ]
+    if not weighted:
+        return []
+
+    vectors = book_vectors(cursor, {book_id for _, book_id, _ in weighted})
+    sums: dict[int, np.ndarray] = {}
+    weights: dict[int, float] = defaultdict(float)
+    counts: dict[int, int] = defaultdict(int)
+    for user_id, book_id, weight in weighted:
+        vector = vectors.get(book_id)
+        if vector is None:
+            continue  # not embedded yet: reweigh_readers adds it once it is
+        sums[user_id] = sums.get(user_id, 0) + weight * vector
+        weights[user_id] += weight
+        counts[user_id] += 1
+    if not sums:
+        return []
+
+    if settings.profile_clusters > 1:
+        update_clusters(
+            cursor,
+            [(user_id, vectors[book_id], weight) for user_id, book_id, weight in weighted if book_id in vectors],
+        )
+
+    # Sorted like the cluster locks, so concurrent flushes take row locks in one order
+    user_ids = sorted(sums)
+    cursor.execute(
+        UPSERT_PROFILES_SQL,
+        (
+            user_ids,
+            [vector_literal(sums[user_id]) for user_id in user_ids],
+            [weights[user_id] for user_id in user_ids],
+            [counts[user_id] for user_id in user_ids],
+        ),
+    )
+    return user_ids
+
+
+def _unit(vector) -> np.ndarray:
+    unit = np.asarray(vector, dtype=np.float64)
+    norm = np.linalg.norm(unit)
+    return unit / norm if norm else unit
+
+
+def _similarities(clusters: list[TasteCluster], unit: np.ndarray) -> np.ndarray:
+    centroids = np.stack([cluster.centroid for cluster in clusters])
+    lengths = np.linalg.norm(centroids, axis=1)
+    lengths[lengths == 0] = 1.0
+    return centroids @ unit / lengths
+
+
+def add_to_clusters(clusters: list[TasteCluster], vector, weight: float) -> int:
+    """One sequential k-means step; updates ``clusters`` in place, returns the touched index."""
+    unit = _unit(vector)
+    if clusters:
+        similarities = _similarities(clusters, unit)
+        best = int(np.argmax(similarities))
+    if not clusters or (
+        len(clusters) < settings.profile_clusters
+        and similarities[best] < settings.profile_cluster_spawn_similarity
+    ):
+        clusters.append(TasteCluster(unit, weight, 1))
+        return len(clusters) - 1
+
+    cluster = clusters[best]
+    total = cluster.weight + weight
+    clusters[best] = TasteCluster(
+        cluster.centroid + (weight / total) * (unit - cluster.centroid), total, cluster.member_count + 1
+    )
+    return best
+
+
+def remove_from_clusters(clusters: list[TasteCluster], vector, weight: float) -> None:
+    """Undo one observation: take it back out of its nearest centroid (dropped when emptied)."""
+    if not clusters:
+        return
+    unit = _unit(vector)
+    best = int(np.argmax(_similarities(clusters, unit)))
+    cluster = clusters[best]
+    total = cluster.weight - weight
+    if cluster.member_count <= 1 or total <= 0:
+        del clusters[best]
+        return
+    clusters[best] = TasteCluster(
+        (cluster.weight * cluster.centroid - weight * unit) / total, total, cluster.member_count - 1
+    )
+
+
+def _read_clusters(cursor, user_ids: list[int]) -> dict[int, list[TasteCluster]]:
+    cursor.execute(SELECT_CLUSTERS_SQL, (user_ids,))
+    clusters: dict[int, list[TasteCluster]] = defaultdict(list)
+    for user_id, _, centroid, weight, member_count in cursor.fetchall():
+        clusters[user_id].append(TasteCluster(from_db(centroid).astype(np.float64), weight, member_count))
+    return clusters
+
+
+def _write_clusters(cursor, keys: list[tuple[int, int]], clusters: dict[int, list[TasteCluster]]):
+    rows = [clusters[user_id][index] for user_id, index in keys]
+    cursor.execute(
+        UPSERT_CLUSTERS_SQL,
+        (
+            [user_id for user_id, _ in keys],
+            [index for _, index in keys],
+            [vector_literal(row.centroid) for row in rows],
+            [row.weight for row in rows],
+            [row.member_count for row in rows],
+        ),
+    )
+
+
+def update_clusters(cursor, observations: list[tuple[int, np.ndarray, float]]) -> int:
+    """Fold (user_id, book vector, weight) observations into the users' clusters.
+
+    One locking read and one upsert per flush. Returns the number of clusters written.
+    """
+    user_ids = sorted({user_id for user_id, _, _ in observations})
+    if not user_ids:
+        return 0
+    clusters = _read_clusters(cursor, user_ids)
+
+    touched: set[tuple[int, int]] = set()
+    for user_id, vector, weight in observations:
+        touched.add((user_id, add_to_clusters(clusters[user_id], vector, weight)))
+
+    keys = sorted(touched)
+    _write_clusters(cursor, keys, clusters)
+    return len(keys)
+
+
+def shift_clusters(cursor, removed: list[tuple[int, np.ndarray, float]], added: list[tuple[int, np.ndarray, float]]):
+    """Take (user_id, vector, weight) observations out of the users' clusters and fold others in.
+
+    Removing can empty a cluster, so the users' cluster rows are rewritten.
+    """
+    user_ids = sorted({user_id for user_id, _, _ in [*removed, *added]})
+    if not user_ids:
+        return
+    clusters = _read_clusters(cursor, user_ids)
+    for user_id, vector, weight in removed:
+        remove_from_clusters(clusters[user_id], vector, weight)
+    for user_id, vector, weight in added:
+        add_to_clusters(clusters[user_id], vector, weight)
+
+    cursor.execute("DELETE FROM user_taste_cluster WHERE user_id = ANY(%s)", (user_ids,))
+    keys = [(user_id, index) for user_id in user_ids for index in range(len(clusters[user_id]))]
+    if keys:
+        _write_clusters(cursor, keys, clusters)
+
+
+def rebuild_profiles(cursor, user_ids: Iterable[int]) -> set[int]:
+    """Recompute profiles (and clusters) from the users' full histories in one pass.
+
+    Returns the users that have a profile afterwards.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return set()
+    cursor.execute("DELETE FROM user_profile WHERE user_id = ANY(%s)", (user_ids,))
+    cursor.execute("DELETE FROM user_taste_cluster WHERE user_id = ANY(%s)", (user_ids,))
+    cursor.execute(
+        "SELECT user_id, book_id, interaction_type, rating FROM user_interaction "
+        "WHERE user_id = ANY(%s) ORDER BY id",
+        (user_ids,),
+    )
+    return set(_apply(cursor, cursor.fetchall()))
+
+
+def rebuild_profile(cursor, user_id: int) -> bool:
+    """Recompute one profile (and its clusters) from the full history. Returns True if it exists."""
+    return user_id in rebuild_profiles(cursor, [user_id])
+
+
+def reweigh_readers(cursor, changes: dict[int, tuple[Optional[np.ndarray], Optional[np.ndarray]]]) -> int:
+    """Move the readers' profiles from each book's old vector to its new one.
+
+    ``changes`` maps book ids to (old, new) vectors, None meaning no vector
+    (not embedded yet, or deleted). Call in the transaction that writes,
+    replaces or removes the vectors. Returns the number of profiles touched.
+    """
+    changes = {book_id: (old, new) for book_id, (old, new) in changes.items() if old is not None or new is not None}
+    if not changes:
+        return 0
+    cursor.execute(
+        "SELECT user_id, book_id, interaction_type, rating FROM user_interaction "
+        "WHERE book_id = ANY(%s) ORDER BY id",
+        (sorted(changes),),
+    )
+    deltas: dict[int, np.ndarray] = {}
+    weights: dict[int, float] = defaultdict(float)
+    counts: dict[int, int] = defaultdict(int)
+    removed, added = [], []
+    for user_id, book_id, interaction_type, rating in cursor.fetchall():
+        weight = interaction_weight(interaction_type, rating)
+        if weight <= 0:
+            continue
+        old, new = changes[book_id]
+        delta = deltas.get(user_id, 0)
+        if old is not None:
+            delta = delta - weight * old
+            weights[user_id] -= weight
+            counts[user_id] -= 1
+            removed.append((user_id, old, weight))
+        if new is not None:
+            delta = delta + weight * new
+            weights[user_id] += weight
+            counts[user_id] += 1
+            added.append((user_id, new, weight))
+        deltas[user_id] = delta
+    if not deltas:
+        return 0
+
+    if settings.profile_clusters > 1:
+        shift_clusters(cursor, removed, added)
+    user_ids = sorted(deltas)
+    cursor.execute(
+        UPSERT_PROFILES_SQL,
+        (
+            user_ids,
+            [vector_literal(deltas[user_id]) for user_id in user_ids],
+            [weights[user_id] for user_id in user_ids],
+            [counts[user_id] for user_id in user_ids],
+        ),
+    )
+    # No embedded interaction left
+    cursor.execute("DELETE FROM user_profile WHERE user_id = ANY(%s) AND interaction_count <= 0", (user_ids,))
+    return len(user_ids)
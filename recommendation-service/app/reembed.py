@@ -0,0 +1,202 @@
+"""Bulk re-embedding job — re-embeds the whole book_embedding table in batches.
+
+Run inside the service container after changing ``embedding_backend``,
+``openai_model``, ``local_embedding_model`` or ``embedding_dimensions``::
+
+    python -m app.reembed [--batch-size 256] [--concurrency 4] [--restart]
+
+New vectors are written to a staging column (``embedding_next``) so the live
+service keeps answering from the old vectors until the run completes; the
+columns are then swapped, the catalog generation bumped (cached /search
+responses go stale) and the indexes on the new column rebuilt. The checkpoint row is
+committed together with every round of writes, so an interrupted run resumes
+from the last committed book id.
+"""
+
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.embedding import book_text, embedding_model_id, get_embeddings
+from app.models import EmbeddingJobCheckpoint
+from app.schema import ensure_indexes
+from app.search_cache import GENERATION_SHARDS, bump_generation
+from app.vector_index import ensure_vector_index
+from app.vector_search import vector_literal
+
+logger = logging.getLogger(__name__)
+
+STAGING_COLUMN = "embedding_next"
+
+
+def job_name() -> str:
+    return f"reembed:{embedding_model_id()}:{settings.embedding_dimensions}"
+
+
+def prepare_staging_column(db: Session):
+    """(Re)create embedding_next with the configured dimensions."""
+    current = db.execute(
+        text("""
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = CAST('book_embedding' AS regclass)
+              AND attname = :column AND NOT attisdropped
+        """),
+        {"column": STAGING_COLUMN},
+    ).scalar()
+    wanted = f"vector({int(settings.embedding_dimensions)})"
+    if current is not None and current != wanted:
+        db.execute(text(f"ALTER TABLE book_embedding DROP COLUMN {STAGING_COLUMN}"))
+        current = None
+    if current is None:
+        db.execute(text(f"ALTER TABLE book_embedding ADD COLUMN {STAGING_COLUMN} {wanted}"))
+    db.commit()
+
+
+def _fetch_page(db: Session, after_id: int, size: int, since: datetime = None) -> list:
+    return db.execute(
+        text(f"""
+            SELECT id, title, description
+            FROM book_embedding
+            WHERE id > :after_id
+              {"AND updated_at >= :since" if since else ""}
+            ORDER BY id
+            LIMIT :size
+        """),
+        {"after_id": after_id, "size": size, "since": since},
+    ).fetchall()
+
+
+def _embed_page(rows: list) -> list[tuple[int, str]]:
+    """Embed one page; returns (book_id, vector literal) for books that have text."""
+    texted = [(row.id, book_text(row.title, row.description)) for row in rows]
+    texted = [(book_id, body) for book_id, body in texted if body]
+    vectors = get_embeddings([body for _, body in texted])
+    if any(vector is None for vector in vectors):
+        raise RuntimeError("Embedding API is not configured — aborting re-embed")
+    return [(book_id, vector_literal(vector)) for (book_id, _), vector in zip(texted, vectors)]
+
+
+def _write_page(db: Session, embedded: list[tuple[int, str]]):
+    if not embedded:
+        return
+    db.execute(
+        text(f"""
+            UPDATE book_embedding AS b
+            SET {STAGING_COLUMN} = v.vec
+            FROM unnest(CAST(:ids AS integer[]), CAST(:vecs AS vector[])) AS v(id, vec)
+            WHERE b.id = v.id
+        """),
+        {"ids": [book_id for book_id, _ in embedded], "vecs": [vec for _, vec in embedded]},
+    )
+
+
+def _run_pass(db, checkpoint, pool, batch_size, concurrency, since=None) -> int:
+    """Process pages in rounds of `concurrency` parallel API calls; commit per round."""
+    after_id = 0 if since else checkpoint.last_book_id
+    processed = 0
+    while True:
+        pages = []
+        for _ in range(concurrency):
+            rows = _fetch_page(db, after_id, batch_size, since)
+            if not rows:
+                break
+            pages.append(rows)
+            after_id = rows[-1].id
+        if not pages:
+            return processed
+
+        for embedded in pool.map(_embed_page, pages):
+            _write_page(db, embedded)
+        processed += sum(len(rows) for rows in pages)
+        if since is None:
+            checkpoint.last_book_id = after_id
+            checkpoint.processed += sum(len(rows) for rows in pages)
+        db.commit()
+        logger.info("Re-embedded up to book %d (%d this pass).", after_id, processed)
+
+
+def swap_columns(db: Session):
+    """Promote embedding_next to embedding (drops the old column and every index on it).
+
+    User taste profiles and clusters are built from the old vectors, so they
+    are cleared too and rebuilt lazily on the next /for-user request; the
+    neighbour lists are dropped for a full rebuild. Not
+    committed here: the caller commits it together with the checkpoint.
+    """
+    db.execute(text("ALTER TABLE book_embedding DROP COLUMN embedding"))
+    db.execute(text(f"ALTER TABLE book_embedding RENAME COLUMN {STAGING_COLUMN} TO embedding"))
+    db.execute(text("TRUNCATE user_profile"))
+    db.execute(text(
+        "ALTER TABLE user_profile ALTER COLUMN embedding_sum "
+        f"TYPE vector({int(settings.embedding_dimensions)}) USING NULL"
+    ))
+    db.execute(text("TRUNCATE book_neighbors, book_neighbors_dirty, book_neighbors_state"))
+    db.execute(text("TRUNCATE user_taste_cluster"))
+    db.execute(text(
+        "ALTER TABLE user_taste_cluster ALTER COLUMN centroid "
+        f"TYPE vector({int(settings.embedding_dimensions)}) USING NULL"
+    ))
+    # Every book changed: bump all shards
+    bump_generation(db, range(GENERATION_SHARDS))
+
+
+def run(batch_size: int = 256, concurrency: int = 4, restart: bool = False) -> int:
+    db = SessionLocal()
+    try:
+        checkpoint = db.get(EmbeddingJobCheckpoint, job_name())
+        if checkpoint is not None and checkpoint.finished_at and not restart:
+            logger.info("Job %s already finished at %s.", job_name(), checkpoint.finished_at)
+            return 0
+        if checkpoint is None or restart:
+            if checkpoint is not None:
+                db.delete(checkpoint)
+                db.flush()
+            checkpoint = EmbeddingJobCheckpoint(job=job_name(), last_book_id=0, processed=0)
+            db.add(checkpoint)
+            db.commit()
+            prepare_staging_column(db)
+        else:
+            logger.info("Resuming %s after book %d.", job_name(), checkpoint.last_book_id)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            _run_pass(db, checkpoint, pool, batch_size, concurrency)
+            # Books changed by the consumer after their page was processed
+            caught_up = _run_pass(
+                db, checkpoint, pool, batch_size, concurrency, since=checkpoint.started_at
+            )
+            logger.info("Catch-up pass re-embedded %d recently updated books.", caught_up)
+
+        swap_columns(db)
+        checkpoint.finished_at = datetime.utcnow()
+        db.commit()
+        processed = checkpoint.processed
+    finally:
+        db.close()
+
+    # The partial indexes (WHERE embedding IS NOT NULL) went with the old column
+    ensure_indexes(engine)
+    ensure_vector_index(engine)
+    logger.info("Re-embed %s finished: %d books.", job_name(), processed)
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-embed every book with the configured model.")
+    parser.add_argument("--batch-size", type=int, default=settings.embedding_batch_max_size)
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel API calls")
+    parser.add_argument("--restart", action="store_true", help="ignore any existing checkpoint")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    run(args.batch_size, args.concurrency, args.restart)
+
+
+if __name__ == "__main__":
+    main()
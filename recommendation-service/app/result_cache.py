@@ -0,0 +1,363 @@
+"""Result cache for /similar — bounded, invalidated precisely by catalog events.
+
+Entries are keyed by source book, limit and ANN recall knobs. Next to the
+result rows each entry records its member ids and the similarity of its last
+hit (the *floor*), so when a book is upserted or deleted only the entries that
+can actually change are dropped:
+
+* the book is the source or one of the results, or
+* its new vector is at least as similar to the source as the floor.
+
+The second check runs in PostgreSQL — one query compares the changed book's
+stored embedding with every cached source by id — so neither the routes nor
+the cache ever hold vectors.
+
+Entries also expire after ``result_cache_ttl_seconds``. With the per-process
+memory backend another worker's consumer cannot reach this process's entries,
+so the TTL is what bounds staleness there; the Redis backend is shared by all
+workers and is invalidated everywhere at once.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional, Protocol, Sequence
+
+from prometheus_client import Counter
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import SessionLocal
+
+try:
+    import redis
+except ImportError:  # optional: only needed for result_cache_backend="redis"
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_REQUESTS = Counter(
+    "recommendation_result_cache_requests_total", "Result cache lookups", ["endpoint", "result"]
+)
+RESULT_CACHE_INVALIDATIONS = Counter(
+    "recommendation_result_cache_invalidations_total", "Result cache entries dropped by catalog events"
+)
+
+
+class CachedResult(NamedTuple):
+    source: int
+    rows: list[dict]  # id, title, author, category, similarity
+    floor: float  # similarity a new book needs to enter the result
+    expires_at: float
+
+    @property
+    def members(self) -> set[int]:
+        return {row["id"] for row in self.rows}
+
+
+def is_stale(entry: CachedResult, book_id: int, similarities: dict[int, float]) -> bool:
+    """Could a change of ``book_id`` alter this entry?
+
+    ``similarities`` maps source ids to their similarity with the book's new
+    vector (empty when it was deleted or its embedding did not change).
+    """
+    if book_id == entry.source or book_id in entry.members:
+        return True
+    similarity = similarities.get(entry.source)
+    return similarity is not None and similarity >= entry.floor
+
+
+def catalog_similarities(book_id: int, sources: Sequence[int]) -> dict[int, float]:
+    """Cosine similarity of ``book_id``'s stored embedding to each source book."""
+    with SessionLocal() as db:
+        rows = db.execute(
+            text("""
+                SELECT src.id, 1 - (src.embedding <=> b.embedding) AS similarity
+                FROM book_embedding b
+                JOIN book_embedding src ON src.id = ANY(:sources)
+                WHERE b.id = :book_id AND b.embedding IS NOT NULL AND src.embedding IS NOT NULL
+            """),
+            {"book_id": book_id, "sources": list(sources)},
+        ).fetchall()
+    return {row.id: float(row.similarity) for row in rows}
+
+
+class CacheBackend(Protocol):
+    """Storage for cached results; swap in any object with these methods."""
+
+    def get(self, key: str) -> Optional[CachedResult]: ...
+
+    def set(self, key: str, entry: CachedResult) -> None: ...
+
+    def sources(self) -> list[int]: ...
+
+    def invalidate(self, book_id: int, similarities: dict[int, float]) -> int: ...
+
+    def clear(self) -> None: ...
+
+    def generation(self) -> int: ...
+
+    def bump_generation(self) -> None: ...
+
+
+class MemoryBackend:
+    """Per-process LRU bounded by entry count (expiry is checked by ResultCache)."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._refs: dict[int, int] = {}  # entries per source book
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CachedResult):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._refs[entry.source] = self._refs.get(entry.source, 0) + 1
+            while len(self._entries) > self._max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def sources(self) -> list[int]:
+        with self._lock:
+            return sorted(self._refs)
+
+    def invalidate(self, book_id: int, similarities: dict[int, float]) -> int:
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if is_stale(entry, book_id, similarities)]
+            for key in stale:
+                self._drop(key)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refs.clear()
+
+    def generation(self) -> int:
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation += 1
+
+    def _drop(self, key: str):
+        source = self._entries.pop(key).source
+        self._refs[source] -= 1
+        if not self._refs[source]:
+            del self._refs[source]
+
+
+class RedisBackend:
+    """Shared backend for any Redis-protocol server.
+
+    Layout: ``<prefix>:entry:<key>`` holds the JSON entry (with a TTL),
+    ``<prefix>:index`` maps every key to its source/floor/members/expiry, so
+    an invalidation is one HGETALL plus one pipelined delete, and
+    ``<prefix>:expiry`` scores every key by its deadline so each write first
+    drops the index entries of keys Redis has already expired.
+    ``<prefix>:generation`` counts invalidations across all workers.
+    """
+
+    def __init__(self, client, max_entries: int, prefix: str = "recommendation:similar"):
+        self._client = client
+        self._max_entries = max_entries
+        self._prefix = prefix
+        self._index = f"{prefix}:index"
+        self._expiry = f"{prefix}:expiry"
+        self._generation = f"{prefix}:generation"
+
+    @classmethod
+    def from_url(cls, url: str, max_entries: int) -> "RedisBackend":
+        if redis is None:
+            raise RuntimeError("result_cache_backend=redis requires the 'redis' package")
+        return cls(redis.Redis.from_url(url), max_entries)
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self._prefix}:entry:{key}"
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        raw = self._client.get(self._entry_key(key))
+        if raw is None:
+            return None
+        return CachedResult(**json.loads(raw))
+
+    def _prune_expired(self):
+        expired = [_text(key) for key in self._client.zrangebyscore(self._expiry, "-inf", time.time())]
+        if expired:
+            pipe = self._client.pipeline()
+            pipe.hdel(self._index, *expired)
+            pipe.zrem(self._expiry, *expired)
+            pipe.execute()
+
+    def set(self, key: str, entry: CachedResult):
+        self._prune_expired()
+        if self._client.hlen(self._index) >= self._max_entries and not self._client.hexists(self._index, key):
+            return  # full — room is made by invalidations and expiry
+        meta = {
+            "source": entry.source,
+            "floor": entry.floor,
+            "members": sorted(entry.members),
+            "expires_at": entry.expires_at,
+        }
+        pipe = self._client.pipeline()
+        pipe.set(
+            self._entry_key(key),
+            json.dumps(entry._asdict()),
+            ex=max(1, int(entry.expires_at - time.time())),
+        )
+        pipe.hset(self._index, key, json.dumps(meta))
+        pipe.zadd(self._expiry, {key: entry.expires_at})
+        pipe.execute()
+
+    def sources(self) -> list[int]:
+        return sorted({json.loads(meta)["source"] for meta in self._client.hvals(self._index)})
+
+    def invalidate(self, book_id: int, similarities: dict[int, float]) -> int:
+        index = {_text(k): json.loads(v) for k, v in self._client.hgetall(self._index).items()}
+        now = time.time()
+        stale, expired = [], []
+        for key, meta in index.items():
+            if meta["expires_at"] <= now:
+                expired.append(key)
+                continue
+            entry = CachedResult(meta["source"], [{"id": i} for i in meta["members"]], meta["floor"], 0)
+            if is_stale(entry, book_id, similarities):
+                stale.append(key)
+
+        dropped = stale + expired
+        if dropped:
+            pipe = self._client.pipeline()
+            pipe.delete(*[self._entry_key(key) for key in dropped])
+            pipe.hdel(self._index, *dropped)
+            pipe.zrem(self._expiry, *dropped)
+            pipe.execute()
+        return len(stale)
+
+    def generation(self) -> int:
+        return int(self._client.get(self._generation) or 0)
+
+    def bump_generation(self):
+        self._client.incr(self._generation)
+
+    def clear(self):
+        keys = [self._index, self._expiry, *self._client.scan_iter(f"{self._prefix}:entry:*")]
+        self._client.delete(*keys)
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ResultCache:
+    """Front end used by the routes (lookups) and the consumer (invalidation)."""
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        ttl_seconds: float,
+        clock=time.time,
+        similarities: Callable[[int, Sequence[int]], dict[int, float]] = catalog_similarities,
+    ):
+        self.backend = backend
+        self._ttl = ttl_seconds
+        self._clock = clock
+        self._similarities = similarities
+
+    @property
+    def generation(self) -> Optional[int]:
+        """Read before computing a result and hand to ``put`` (see there).
+
+        Kept by the backend, so with Redis it counts every worker's invalidations.
+        """
+        try:
+            return self.backend.generation()
+        except Exception as exc:
+            logger.warning("Result cache generation lookup failed: %s", exc)
+            return None
+
+    @staticmethod
+    def key(book_id: int, limit: int, search: dict) -> str:
+        knobs = ":".join(f"{name}={search[name]}" for name in sorted(search))
+        return f"{book_id}:{limit}:{knobs}"
+
+    def get(self, endpoint: str, key: str) -> Optional[list[dict]]:
+        try:
+            entry = self.backend.get(key)
+        except Exception as exc:
+            logger.warning("Result cache lookup failed: %s", exc)
+            entry = None
+        if entry is not None and entry.expires_at <= self._clock():
+            entry = None
+        RESULT_CACHE_REQUESTS.labels(endpoint=endpoint, result="hit" if entry else "miss").inc()
+        return None if entry is None else entry.rows
+
+    def put(
+        self,
+        key: str,
+        source: int,
+        limit: int,
+        rows: Sequence[dict],
+        generation: Optional[int],
+        min_similarity: Optional[float] = None,
+    ):
+        """Store rows computed while ``generation`` was current.
+
+        Skipped if an invalidation ran in between — the rows may predate it.
+        A short result can only gain books at or above ``min_similarity``.
+        """
+        if generation is None or generation != self.generation:
+            return
+        if len(rows) >= limit:
+            floor = float(rows[-1]["similarity"])
+        else:
+            floor = float("-inf") if min_similarity is None else min_similarity
+        entry = CachedResult(source, list(rows), floor, self._clock() + self._ttl)
+        try:
+            self.backend.set(key, entry)
+        except Exception as exc:
+            logger.warning("Result cache write failed: %s", exc)
+
+    def invalidate(self, book_id: int, reembedded: bool = False) -> int:
+        """Drop every entry a change of ``book_id`` can affect.
+
+        ``reembedded``: the book's new embedding is committed, so entries whose
+        floor it reaches are dropped too.
+        """
+        try:
+            self.backend.bump_generation()
+            similarities = {}
+            if reembedded and (sources := self.backend.sources()):
+                similarities = self._similarities(book_id, sources)
+            dropped = self.backend.invalidate(book_id, similarities)
+        except Exception as exc:
+            logger.warning("Result cache invalidation failed: %s", exc)
+            return 0
+        RESULT_CACHE_INVALIDATIONS.inc(dropped)
+        return dropped
+
+    def clear(self):
+        self.backend.clear()
+
+
+def _create_result_cache() -> Optional[ResultCache]:
+    if settings.result_cache_backend == "none":
+        return None
+    if settings.result_cache_backend == "redis":
+        backend = RedisBackend.from_url(settings.result_cache_url, settings.result_cache_max_entries)
+    else:
+        backend = MemoryBackend(settings.result_cache_max_entries)
+    return ResultCache(backend, settings.result_cache_ttl_seconds)
+
+
+result_cache = _create_result_cache()
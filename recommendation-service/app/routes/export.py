@@ -0,0 +1,31 @@
+"""Streaming data export routes (disabled unless export_api_enabled)."""
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.config import settings
+from app.database import engine
+from app.export import EXPORTERS
+
+router = APIRouter(tags=["Export"])
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "npy": "application/octet-stream"}
+
+
+@router.get("/{table}")
+def export_table(
+    table: str,
+    format: str = Query("ndjson", pattern="^(ndjson|npy)$"),
+    after_id: int = Query(0, ge=0, description="Resume after this row id"),
+):
+    """Stream ``embeddings`` or ``interactions`` with constant memory (see app.export)."""
+    if not settings.export_api_enabled:
+        raise HTTPException(status_code=404, detail="Export API is disabled")
+    exporter = EXPORTERS.get((table, format))
+    if exporter is None:
+        raise HTTPException(status_code=404, detail=f"No {format} export for {table}")
+    return StreamingResponse(
+        exporter(engine, after_id),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
@@ -8,6 +8,7 @@ from sqlalchemy import text
 
 from app.config import settings
 from app.database import engine
+from app.vector_index import get_index_status
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["Health"])
@@ -46,3 +47,12 @@ def health_check():
         "status": "ok" if all_ok else "degraded",
         "checks": checks,
     }
+
+
+@router.get("/health/vector-index")
+def vector_index_status():
+    """Report ANN index build state (type, validity, size, build progress)."""
+    try:
+        return get_index_status(engine)
+    except Exception as exc:
+        return {"status": "error", "error": str(exc)}
@@ -1,204 +1,819 @@
 """Recommendation API routes."""
 
+import logging
 from typing import Optional
 
+import httpx
+import numpy as np
 from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy import text
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from sqlalchemy import func, text
 from sqlalchemy.orm import Session
+from tenacity import RetryError
 
+from app.collaborative import get_model as get_collaborative_model, user_history
 from app.config import settings
-from app.database import get_db
-from app.embedding import get_embedding
-from app.models import BookEmbedding, UserInteraction
-from prometheus_client import Histogram
+from app.database import QueryRunner, get_async_db, get_db
+from app.embedding import aget_embedding
+from app.hybrid_search import FusedHit, is_confident, lexical_search, reciprocal_rank_fusion
+from app.neighbors import precomputed_neighbors
+from app.models import BookEmbedding, UserInteraction, UserProfile, UserTasteCluster
+from app.popularity import top_books, trending_score
+from app.profiles import rebuild_profile, rebuild_profiles
+from app.result_cache import ResultCache, result_cache
+from app.search_cache import SearchCache, normalize_query, search_cache
+from app.vector_index import ann_distance, apply_search_params, candidate_limit, resolve_search_params
+from app.vector_search import (
+    OVERFETCH_FACTOR,
+    SearchFilters,
+    book_vector,
+    cluster_vector,
+    hydrate,
+    hydrate_many,
+    interleave,
+    nearest,
+    nearest_in_store,
+    nearest_many,
+    profile_vector,
+)
+from app.vector_store import get_vector_store
+from prometheus_client import Counter, Histogram
 
+logger = logging.getLogger(__name__)
 router = APIRouter(tags=["Recommendations"])
 
+BATCH_MAX_IDS = 100
+
 RECOMMENDATION_LATENCY = Histogram(
     "recommendation_request_latency_seconds",
     "Latency of recommendation requests",
     ["endpoint"],
 )
+SEARCH_REQUESTS = Counter(
+    "recommendation_search_requests_total",
+    "Search requests by execution path (lexical paths make no embedding call)",
+    ["path"],
+)
+SIMILAR_LOOKUPS = Counter(
+    "recommendation_similar_lookups_total",
+    "/similar sources answered from precomputed neighbour lists or by a live search",
+    ["path"],
+)
+
+
+def search_params(
+    profile: Optional[str] = Query(None, pattern="^(fast|balanced|accurate)$"),
+    ef_search: Optional[int] = Query(None, ge=1, le=1000, description="HNSW candidate list size"),
+    probes: Optional[int] = Query(None, ge=1, le=1000, description="IVFFlat lists to scan"),
+) -> dict:
+    """Per-request ANN recall knobs (see app.vector_index.SEARCH_PROFILES)."""
+    return {"profile": profile, "ef_search": ef_search, "probes": probes}
+
+
+def search_filters(
+    category: Optional[str] = Query(None, max_length=255),
+    author: Optional[str] = Query(None, max_length=500),
+    exclude: list[int] = Query([], description="Book ids to leave out"),
+    min_similarity: Optional[float] = Query(None, ge=-1, le=1),
+) -> SearchFilters:
+    """Result filters applied inside the vector search (see app.vector_search)."""
+    if min_similarity is None:
+        min_similarity = settings.similarity_threshold
+    return SearchFilters(category, author, tuple(sorted(set(exclude))), min_similarity)
+
+
+def _store_bound() -> bool:
+    """Vector-store searches are CPU-bound NumPy work: keep them off the event loop."""
+    return get_vector_store() is not None
+
+
+def query_runner(db: Session = Depends(get_db), async_db=Depends(get_async_db)) -> QueryRunner:
+    """Database access of the async search routes (asyncpg with database_async, else threadpool)."""
+    return QueryRunner(db, async_db)
+
+
+def _cache_knobs(search: dict, filters: SearchFilters) -> dict:
+    """Everything besides book id and limit that shapes a /similar result."""
+    return {**resolve_search_params(**search), **filters._asdict()}
+
+
+def _compute_similar(
+    db: Session, book_id: int, limit: int, search: dict, filters: SearchFilters
+) -> tuple[list, bool]:
+    """Nearest neighbours of one book (404 without an embedding), and whether they were precomputed.
+
+    Precomputed lists lag catalog changes until the next neighbour refresh,
+    which does not invalidate the result cache, so they are not cached.
+    """
+    stored = precomputed_neighbors(db, [book_id], limit, filters).get(book_id)
+    if stored is not None:
+        SIMILAR_LOOKUPS.labels(path="precomputed").inc()
+        return stored, True
+    SIMILAR_LOOKUPS.labels(path="live").inc()
+
+    store = get_vector_store()
+    if store is not None:
+        source_vector = store.get([book_id]).get(book_id)
+        if source_vector is None:
+            raise HTTPException(status_code=404, detail="Book embedding not found")
+        return nearest_in_store(db, store, source_vector, limit, filters, exclude=[book_id]), False
+
+    # The source vector never leaves the database: the query references it by id
+    results = nearest(
+        db, book_vector(book_id), limit, search, filters,
+        where=["be.id != :book_id"], params={"book_id": book_id},
+    )
+    if not results and not _has_embedding(db, book_id):
+        raise HTTPException(status_code=404, detail="Book embedding not found")
+    return results, False
+
+
+def _has_embedding(db: Session, book_id: int) -> bool:
+    return db.query(BookEmbedding.id).filter(
+        BookEmbedding.id == book_id, BookEmbedding.embedding.isnot(None)
+    ).first() is not None
+
+
+def _similar_row(row) -> dict:
+    """Result row as stored in the result cache."""
+    return {
+        "id": row.id,
+        "title": row.title,
+        "author": row.author,
+        "category": row.category,
+        "similarity": float(row.similarity),
+    }
+
+
+def _similar_recommendations(rows: list[dict]) -> list[dict]:
+    return [
+        {
+            "book_id": row["id"],
+            "title": row["title"],
+            "author": row["author"],
+            "category": row["category"],
+            "similarity": round(row["similarity"], 4),
+        }
+        for row in rows
+    ]
 
 
 @router.get("/similar/{book_id}")
-def get_similar_books(
+async def get_similar_books(
     book_id: int,
     limit: int = Query(10, le=50),
-    db: Session = Depends(get_db),
+    search: dict = Depends(search_params),
+    filters: SearchFilters = Depends(search_filters),
+    run: QueryRunner = Depends(query_runner),
 ):
     """Find books similar to a given book using cosine distance."""
     with RECOMMENDATION_LATENCY.labels(endpoint="similar").time():
-        source = db.query(BookEmbedding).filter_by(id=book_id).first()
-        if not source or source.embedding is None:
-            raise HTTPException(status_code=404, detail="Book embedding not found")
+        # Hot book pages are answered from the result cache (invalidated by the consumer)
+        key = ResultCache.key(book_id, limit, _cache_knobs(search, filters))
+        rows = result_cache.get("similar", key) if result_cache else None
+        if rows is None:
+            generation = result_cache.generation if result_cache else 0
+            results, precomputed = await run(
+                _compute_similar, book_id, limit, search, filters, threaded=_store_bound()
+            )
+            rows = [_similar_row(row) for row in results]
+            if result_cache and not precomputed:
+                result_cache.put(key, book_id, limit, rows, generation, filters.min_similarity)
 
-        # pgvector cosine distance query
-        results = db.execute(
-            text("""
-                SELECT id, title, author, category,
-                       1 - (embedding <=> :embedding) AS similarity
-                FROM book_embedding
-                WHERE id != :book_id AND embedding IS NOT NULL
-                ORDER BY embedding <=> :embedding
-                LIMIT :limit
-            """),
-            {
-                "embedding": str(source.embedding),
-                "book_id": book_id,
-                "limit": limit,
-            },
-        ).fetchall()
+        return {"source_book_id": book_id, "recommendations": _similar_recommendations(rows)}
 
-        return {
-            "source_book_id": book_id,
-            "recommendations": [
-                {
-                    "book_id": row.id,
-                    "title": row.title,
-                    "author": row.author,
-                    "category": row.category,
-                    "similarity": round(float(row.similarity), 4),
-                }
-                for row in results
-                if float(row.similarity) >= settings.similarity_threshold
-            ],
+
+def _profile_rows(db: Session, user_ids: list[int]):
+    """(user_id, interaction_count) of stored profiles — the vectors stay in the database."""
+    return db.query(UserProfile.user_id, UserProfile.interaction_count).filter(
+        UserProfile.user_id.in_(user_ids), UserProfile.embedding_sum.isnot(None)
+    )
+
+
+def _clusters_behind(db: Session, profile) -> bool:
+    """True when the taste clusters miss interactions the profile sum holds.
+
+    Profiles created before multi-vector profiles (or while they were off) have
+    no clusters; searching the clusters alone would ignore that history.
+    """
+    if settings.profile_clusters <= 1:
+        return False
+    clustered = (
+        db.query(func.coalesce(func.sum(UserTasteCluster.member_count), 0))
+        .filter(UserTasteCluster.user_id == profile.user_id)
+        .scalar()
+    )
+    return clustered < profile.interaction_count
+
+
+def _cluster_stats(db: Session, user_ids: list[int]) -> dict[int, tuple[int, int]]:
+    """user_id -> (interactions the taste clusters hold, clusters with a centroid)."""
+    if settings.profile_clusters <= 1 or not user_ids:
+        return {}
+    rows = (
+        db.query(
+            UserTasteCluster.user_id,
+            func.coalesce(func.sum(UserTasteCluster.member_count), 0),
+            func.count(UserTasteCluster.centroid),
+        )
+        .filter(UserTasteCluster.user_id.in_(user_ids))
+        .group_by(UserTasteCluster.user_id)
+    )
+    return {user_id: (int(members), int(clusters)) for user_id, members, clusters in rows}
+
+
+def _load_profile(db: Session, user_id: int):
+    """The user's profile row, backfilled from history when it or its clusters are missing."""
+    profile = _profile_rows(db, [user_id]).first()
+    if profile is not None and not _clusters_behind(db, profile):
+        return profile
+    cursor = db.connection().connection.cursor()
+    try:
+        rebuilt = rebuild_profile(cursor, user_id)
+    finally:
+        cursor.close()
+    db.commit()
+    return _profile_rows(db, [user_id]).first() if rebuilt else None
+
+
+def _popular_recommendations(popular: list) -> list[dict]:
+    return [
+        {
+            "book_id": row.id,
+            "title": row.title,
+            "author": row.author,
+            "score": int(row.interaction_count),
         }
+        for row in popular
+    ]
+
+
+def _user_recommendations(results: list) -> list[dict]:
+    return [
+        {
+            "book_id": row.id,
+            "title": row.title,
+            "author": row.author,
+            "similarity": round(float(row.similarity), 4),
+        }
+        for row in results
+    ]
+
+
+def _taste_clusters(db: Session, user_id: int, vectors: bool = False) -> list:
+    """The user's cluster rows (cluster, weight[, centroid]) when multi-vector profiles are on."""
+    if settings.profile_clusters <= 1:
+        return []
+    columns = [UserTasteCluster.cluster, UserTasteCluster.weight]
+    if vectors:
+        columns.append(UserTasteCluster.centroid)
+    return (
+        db.query(*columns)
+        .filter(UserTasteCluster.user_id == user_id, UserTasteCluster.centroid.isnot(None))
+        .order_by(UserTasteCluster.cluster)
+        .all()
+    )
+
+
+def _content_results(
+    db: Session, user_id: int, limit: int, search: dict, filters: SearchFilters
+) -> list:
+    """Nearest unseen books to the user's taste profile.
+
+    Users with several taste clusters get one search per centroid — a single
+    UNION ALL statement, or one batched matrix product on the vector store —
+    interleaved by cluster weight.
+    """
+    store = get_vector_store()
+    if store is not None:
+        seen = [
+            r[0]
+            for r in db.query(UserInteraction.book_id)
+            .filter(UserInteraction.user_id == user_id)
+            .distinct()
+        ]
+        clusters = _taste_clusters(db, user_id, vectors=True)
+        if len(clusters) > 1:
+            fetch = limit * (OVERFETCH_FACTOR if filters.selective else 1)
+            hits = store.search_many(
+                np.stack([np.asarray(c.centroid) for c in clusters]), fetch,
+                exclude=[[*seen, *filters.exclude]] * len(clusters),
+            )
+            ranked = [
+                filters.above_minimum([row for row in rows if filters.accepts(row)])
+                for rows in hydrate_many(db, hits)
+            ]
+            return interleave(ranked, [c.weight for c in clusters], limit)
+        # Cosine distance ignores magnitude, so the sum ranks exactly like the mean
+        taste = db.query(UserProfile.embedding_sum).filter(UserProfile.user_id == user_id).scalar()
+        return nearest_in_store(db, store, taste, limit, filters, exclude=seen)
+
+    # Books the user has already seen are excluded by an index probe per candidate
+    unseen = (
+        ["NOT EXISTS (SELECT 1 FROM user_interaction ui WHERE ui.user_id = :user_id AND ui.book_id = be.id)"],
+        {"user_id": user_id},
+    )
+    clusters = _taste_clusters(db, user_id)
+    if len(clusters) > 1:
+        ranked = nearest_many(
+            db, [cluster_vector(user_id, c.cluster) for c in clusters], limit, search, filters, *unseen
+        )
+        return interleave(ranked, [c.weight for c in clusters], limit)
+    return nearest(db, profile_vector(user_id), limit, search, filters, *unseen)
+
+
+def _collaborative_results(db: Session, user_id: int, limit: int, filters: SearchFilters) -> tuple[int, list]:
+    """(books in history, unseen books ranked by item-item co-occurrence); empty without a model."""
+    model = get_collaborative_model(db)
+    if model is None:
+        return 0, []
+    history, weights = user_history(db, user_id)
+    hits = model.recommend(
+        history, weights, max(limit, settings.collaborative_candidates), exclude=[*history, *filters.exclude]
+    )
+    return len(history), [row for row in hydrate(db, hits) if filters.accepts(row)][:limit]
+
+
+def _collaborative_recommendations(results: list) -> list[dict]:
+    return [
+        {
+            "book_id": row.id,
+            "title": row.title,
+            "author": row.author,
+            "score": round(float(row.similarity), 4),
+        }
+        for row in results
+    ]
+
+
+def _blended_recommendations(fused: list[FusedHit]) -> list[dict]:
+    return [
+        {
+            "book_id": hit.id,
+            "title": hit.title,
+            "author": hit.author,
+            "similarity": None if hit.similarity is None else round(hit.similarity, 4),
+            "score": round(hit.score, 6),
+        }
+        for hit in fused
+    ]
 
 
 @router.get("/for-user/{user_id}")
 def get_user_recommendations(
     user_id: int,
     limit: int = Query(10, le=50),
+    strategy: Optional[str] = Query(None, pattern="^(content_based|collaborative|blended)$"),
+    search: dict = Depends(search_params),
+    filters: SearchFilters = Depends(search_filters),
     db: Session = Depends(get_db),
 ):
-    """Get personalized recommendations based on user interaction history."""
-    with RECOMMENDATION_LATENCY.labels(endpoint="for_user").time():
-        # Get books the user has interacted with (borrowed, rated, favorited)
-        interacted_book_ids = (
-            db.query(UserInteraction.book_id)
-            .filter(UserInteraction.user_id == user_id)
-            .distinct()
-            .all()
-        )
+    """Get personalized recommendations based on user interaction history.
 
-        if not interacted_book_ids:
-            # Cold start — return popular books
-            popular = db.execute(
-                text("""
-                    SELECT be.id, be.title, be.author, be.category,
-                           COUNT(ui.id) AS interaction_count
-                    FROM book_embedding be
-                    LEFT JOIN user_interaction ui ON ui.book_id = be.id
-                    GROUP BY be.id, be.title, be.author, be.category
-                    ORDER BY interaction_count DESC
-                    LIMIT :limit
-                """),
-                {"limit": limit},
-            ).fetchall()
+    ``strategy=collaborative`` ranks by item-item co-occurrence ("readers of
+    your books also read"), ``blended`` fuses it with the taste-profile
+    ranking. Both fall back to content_based while no model covers the user.
 
+    A sync handler on the sync engine even with ``database_async``: the
+    profile backfill writes through psycopg2 cursors (app.profiles).
+    """
+    strategy = strategy or settings.recommendation_strategy
+    with RECOMMENDATION_LATENCY.labels(endpoint="for_user").time():
+        # Blending fuses two deeper lists; either way the lookup is a few array slices
+        fetch = limit if strategy != "blended" else max(limit, settings.collaborative_candidates)
+        history_size, collaborative = 0, []
+        if strategy in ("collaborative", "blended"):
+            history_size, collaborative = _collaborative_results(db, user_id, fetch, filters)
+        if collaborative and strategy == "collaborative":
             return {
                 "user_id": user_id,
-                "strategy": "popular",
-                "recommendations": [
-                    {
-                        "book_id": row.id,
-                        "title": row.title,
-                        "author": row.author,
-                        "score": int(row.interaction_count),
-                    }
-                    for row in popular
-                ],
+                "strategy": "collaborative",
+                "books_used": history_size,
+                "recommendations": _collaborative_recommendations(collaborative),
             }
 
-        book_ids = [r[0] for r in interacted_book_ids]
-
-        # Average embedding of interacted books → user "taste profile"
-        embeddings = (
-            db.query(BookEmbedding)
-            .filter(BookEmbedding.id.in_(book_ids), BookEmbedding.embedding.isnot(None))
-            .all()
-        )
+        # Taste profile — running weighted sum maintained by the consumer
+        profile = _load_profile(db, user_id)
 
-        if not embeddings:
-            raise HTTPException(404, "No embeddings for user's books")
-
-        # Compute centroid in Python (simple average)
-        import numpy as np
+        if profile is None:
+            if collaborative:
+                # History without embeddings: co-occurrence still knows these books
+                return {
+                    "user_id": user_id,
+                    "strategy": "collaborative",
+                    "books_used": history_size,
+                    "recommendations": _collaborative_recommendations(collaborative[:limit]),
+                }
+            has_history = db.query(
+                db.query(UserInteraction).filter(UserInteraction.user_id == user_id).exists()
+            ).scalar()
+            if has_history:
+                raise HTTPException(404, "No embeddings for user's books")
 
-        vectors = [e.embedding for e in embeddings if e.embedding is not None]
-        if not vectors:
-            raise HTTPException(404, "No embeddings available")
+            # Cold start — return popular books (indexed read of book_popularity)
+            popular = top_books(db, limit)
 
-        centroid = np.mean(vectors, axis=0).tolist()
+            return {
+                "user_id": user_id,
+                "strategy": "popular",
+                "recommendations": _popular_recommendations(popular),
+            }
 
-        # Find closest books to centroid that user hasn't seen
-        # Use parameterized ANY() instead of f-string interpolation to prevent SQL injection
-        results = db.execute(
-            text("""
-                SELECT id, title, author, category,
-                       1 - (embedding <=> :centroid) AS similarity
-                FROM book_embedding
-                WHERE id != ALL(:excluded_ids)
-                  AND embedding IS NOT NULL
-                ORDER BY embedding <=> :centroid
-                LIMIT :limit
-            """),
-            {"centroid": str(centroid), "excluded_ids": book_ids, "limit": limit},
-        ).fetchall()
+        if collaborative:
+            # Blended: rank fusion of both lists, like hybrid search
+            results = _content_results(db, user_id, fetch, search, filters)
+            return {
+                "user_id": user_id,
+                "strategy": "blended",
+                "books_used": profile.interaction_count,
+                "recommendations": _blended_recommendations(
+                    reciprocal_rank_fusion(collaborative, results, limit)
+                ),
+            }
 
+        results = _content_results(db, user_id, limit, search, filters)
         return {
             "user_id": user_id,
             "strategy": "content_based",
-            "books_used": len(vectors),
-            "recommendations": [
+            "books_used": profile.interaction_count,
+            "recommendations": _user_recommendations(results),
+        }
+
+
+@router.get("/popular")
+def get_popular_books(
+    limit: int = Query(10, le=50),
+    window: str = Query("all_time", pattern="^(all_time|trending)$"),
+    category: Optional[str] = Query(None, max_length=255),
+    db: Session = Depends(get_db),
+):
+    """Most popular books overall or recently (time-decayed), optionally per category."""
+    with RECOMMENDATION_LATENCY.labels(endpoint="popular").time():
+        rows = top_books(db, limit, window=window, category=category)
+        return {
+            "window": window,
+            "category": category,
+            "books": [
                 {
                     "book_id": row.id,
                     "title": row.title,
                     "author": row.author,
-                    "similarity": round(float(row.similarity), 4),
+                    "category": row.category,
+                    "interactions": int(row.interaction_count),
+                    "trending_score": round(trending_score(float(row.decayed_score)), 4),
                 }
-                for row in results
-                if float(row.similarity) >= settings.similarity_threshold
+                for row in rows
             ],
         }
 
 
+class SimilarBatchRequest(BaseModel):
+    book_ids: list[int] = Field(..., min_length=1, max_length=BATCH_MAX_IDS)
+    limit: int = Field(10, ge=1, le=50)
+
+
+class UserBatchRequest(BaseModel):
+    user_ids: list[int] = Field(..., min_length=1, max_length=BATCH_MAX_IDS)
+    limit: int = Field(10, ge=1, le=50)
+
+
+def _batch_similar(
+    db: Session, book_ids: list[int], limit: int, search: dict, filters: SearchFilters
+) -> tuple[dict[int, list[dict]], set[int]]:
+    """Result rows of the given books (precomputed lists, then one live search); unknown ids are left out.
+
+    Also returns the ids answered from precomputed lists (not cached, see _compute_similar).
+    """
+    rows_by_id: dict[int, list[dict]] = {}
+    stored = precomputed_neighbors(db, book_ids, limit, filters)
+    for book_id, results in stored.items():
+        rows_by_id[book_id] = [_similar_row(row) for row in results]
+    SIMILAR_LOOKUPS.labels(path="precomputed").inc(len(stored))
+    live = [book_id for book_id in book_ids if book_id not in stored]
+    SIMILAR_LOOKUPS.labels(path="live").inc(len(live))
+    if not live:
+        return rows_by_id, set(stored)
+
+    store = get_vector_store()
+    if store is not None:
+        vectors = store.get(live)
+        sources = [book_id for book_id in live if book_id in vectors]
+        if sources:
+            hits = store.search_many(
+                np.stack([vectors[book_id] for book_id in sources]),
+                limit,
+                exclude=[[book_id] for book_id in sources],
+            )
+            for book_id, results in zip(sources, hydrate_many(db, hits)):
+                rows_by_id[book_id] = [_similar_row(row) for row in filters.above_minimum(results)]
+        return rows_by_id, set(stored)
+
+    apply_search_params(db, candidate_limit(limit), **search)
+    # One ANN scan per source, driven by the index inside a LATERAL join
+    results = db.execute(
+        text(f"""
+            SELECT src.id AS source_id, nn.id, nn.title, nn.author, nn.category, nn.similarity
+            FROM book_embedding src
+            LEFT JOIN LATERAL (
+                SELECT * FROM (
+                    SELECT b.id, b.title, b.author, b.category,
+                           1 - (b.embedding <=> src.embedding) AS similarity
+                    FROM book_embedding b
+                    WHERE b.id != src.id AND b.embedding IS NOT NULL
+                    ORDER BY {ann_distance("b.embedding", "src.embedding")}
+                    LIMIT :candidates
+                ) c
+                ORDER BY c.similarity DESC
+                LIMIT :limit
+            ) nn ON true
+            WHERE src.id = ANY(:ids) AND src.embedding IS NOT NULL
+            ORDER BY src.id, nn.similarity DESC
+        """),
+        {"ids": live, "limit": limit, "candidates": candidate_limit(limit)},
+    ).fetchall()
+    for row in results:
+        neighbours = rows_by_id.setdefault(row.source_id, [])
+        if row.id is not None and row.similarity >= filters.min_similarity:
+            neighbours.append(_similar_row(row))
+    return rows_by_id, set(stored)
+
+
+@router.post("/similar:batch")
+async def get_similar_books_batch(
+    body: SimilarBatchRequest,
+    search: dict = Depends(search_params),
+    run: QueryRunner = Depends(query_runner),
+):
+    """Similar books for several books in one round trip (one LATERAL query)."""
+    with RECOMMENDATION_LATENCY.labels(endpoint="similar_batch").time():
+        book_ids = list(dict.fromkeys(body.book_ids))
+        default_filters = SearchFilters(min_similarity=settings.similarity_threshold)
+        knobs = _cache_knobs(search, default_filters)
+        rows_by_id: dict[int, list[dict]] = {}
+        # Shares entries with the single-book endpoint (same key for default filters)
+        generation = result_cache.generation if result_cache else 0
+        if result_cache:
+            for book_id in book_ids:
+                cached = result_cache.get("similar", ResultCache.key(book_id, body.limit, knobs))
+                if cached is not None:
+                    rows_by_id[book_id] = cached
+
+        missing = [book_id for book_id in book_ids if book_id not in rows_by_id]
+        precomputed: set[int] = set()
+        if missing:
+            computed, precomputed = await run(
+                _batch_similar, missing, body.limit, search, default_filters, threaded=_store_bound()
+            )
+            rows_by_id.update(computed)
+
+        if result_cache:
+            for book_id in missing:
+                if book_id in rows_by_id and book_id not in precomputed:
+                    result_cache.put(
+                        ResultCache.key(book_id, body.limit, knobs), book_id, body.limit,
+                        rows_by_id[book_id], generation, default_filters.min_similarity,
+                    )
+
+        return {
+            "results": [
+                {"source_book_id": book_id, "recommendations": _similar_recommendations(rows_by_id[book_id])}
+                for book_id in book_ids
+                if book_id in rows_by_id
+            ],
+            "not_found": [book_id for book_id in book_ids if book_id not in rows_by_id],
+        }
+
+
+@router.post("/for-user:batch")
+def get_user_recommendations_batch(
+    body: UserBatchRequest,
+    search: dict = Depends(search_params),
+    db: Session = Depends(get_db),
+):
+    """Personalized recommendations for several users in one round trip.
+
+    Ranks like ``/for-user?strategy=content_based``: single-centroid profiles
+    share one set-based search, users with several taste clusters get the
+    per-cluster search. The collaborative and blended strategies
+    (``recommendation_strategy``) are not applied here.
+
+    Sync, like ``/for-user``: the cold-user backfill needs the psycopg2 engine.
+    """
+    with RECOMMENDATION_LATENCY.labels(endpoint="for_user_batch").time():
+        user_ids = list(dict.fromkeys(body.user_ids))
+        profiles = {profile.user_id: profile for profile in _profile_rows(db, user_ids)}
+        # Users without a profile: backfill those with history in one set-based pass
+        cold = [user_id for user_id in user_ids if user_id not in profiles]
+        with_history = set()
+        if cold:
+            with_history = {
+                user_id
+                for (user_id,) in db.query(UserInteraction.user_id)
+                .filter(UserInteraction.user_id.in_(cold))
+                .distinct()
+            }
+        # Profiles whose clusters miss part of the history, rebuilt as /for-user does
+        stats = _cluster_stats(db, list(profiles))
+        behind = {
+            user_id for user_id, profile in profiles.items()
+            if settings.profile_clusters > 1 and stats.get(user_id, (0, 0))[0] < profile.interaction_count
+        }
+        if with_history or behind:
+            cursor = db.connection().connection.cursor()
+            try:
+                rebuilt = rebuild_profiles(cursor, with_history | behind)
+            finally:
+                cursor.close()
+            db.commit()
+            for user_id in behind - rebuilt:
+                del profiles[user_id]
+            with_history |= behind - rebuilt
+            if rebuilt:
+                profiles.update((profile.user_id, profile) for profile in _profile_rows(db, sorted(rebuilt)))
+                stats.update(_cluster_stats(db, sorted(rebuilt)))
+        with_profile = [user_id for user_id in user_ids if user_id in profiles]
+
+        # Several taste clusters: the per-centroid search of /for-user, interleaved by weight
+        clustered = [user_id for user_id in with_profile if stats.get(user_id, (0, 0))[1] > 1]
+        filters = SearchFilters(min_similarity=settings.similarity_threshold)
+        results_by_id: dict[int, list] = {
+            user_id: _content_results(db, user_id, body.limit, search, filters) for user_id in clustered
+        }
+        with_profile = [user_id for user_id in with_profile if user_id not in results_by_id]
+
+        results_by_id.update((user_id, []) for user_id in with_profile)
+        store = get_vector_store()
+        if with_profile and store is not None:
+            seen: dict[int, list[int]] = {user_id: [] for user_id in with_profile}
+            for user_id, book_id in (
+                db.query(UserInteraction.user_id, UserInteraction.book_id)
+                .filter(UserInteraction.user_id.in_(with_profile))
+                .distinct()
+            ):
+                seen[user_id].append(book_id)
+            tastes = dict(
+                db.query(UserProfile.user_id, UserProfile.embedding_sum)
+                .filter(UserProfile.user_id.in_(with_profile))
+            )
+            hits = store.search_many(
+                np.stack([np.asarray(tastes[user_id]) for user_id in with_profile]),
+                body.limit,
+                exclude=[seen[user_id] for user_id in with_profile],
+            )
+            results_by_id.update(zip(with_profile, hydrate_many(db, hits)))
+        elif with_profile:
+            apply_search_params(db, candidate_limit(body.limit), **search)
+            for row in db.execute(
+                text(f"""
+                    SELECT p.user_id, nn.id, nn.title, nn.author, nn.category, nn.similarity
+                    FROM user_profile p
+                    CROSS JOIN LATERAL (
+                        SELECT * FROM (
+                            SELECT be.id, be.title, be.author, be.category,
+                                   1 - (be.embedding <=> p.embedding_sum) AS similarity
+                            FROM book_embedding be
+                            WHERE be.embedding IS NOT NULL
+                              AND NOT EXISTS (
+                                  SELECT 1 FROM user_interaction ui
+                                  WHERE ui.user_id = p.user_id AND ui.book_id = be.id
+                              )
+                            ORDER BY {ann_distance("be.embedding", "p.embedding_sum")}
+                            LIMIT :candidates
+                        ) c
+                        ORDER BY c.similarity DESC
+                        LIMIT :limit
+                    ) nn
+                    WHERE p.user_id = ANY(:ids)
+                    ORDER BY p.user_id, nn.similarity DESC
+                """),
+                {"ids": with_profile, "limit": body.limit, "candidates": candidate_limit(body.limit)},
+            ):
+                results_by_id[row.user_id].append(row)
+
+        # Users without history get popular books; history without embeddings is not found
+        with_history -= profiles.keys()
+        without_history = set(cold) - profiles.keys() - with_history
+        popular = _popular_recommendations(top_books(db, body.limit)) if without_history else []
+
+        results = []
+        for user_id in user_ids:
+            if user_id in profiles:
+                results.append({
+                    "user_id": user_id,
+                    "strategy": "content_based",
+                    "books_used": profiles[user_id].interaction_count,
+                    "recommendations": _user_recommendations(
+                        [r for r in results_by_id[user_id] if r.similarity >= settings.similarity_threshold]
+                    ),
+                })
+            elif user_id not in with_history:
+                results.append({"user_id": user_id, "strategy": "popular", "recommendations": popular})
+        return {
+            "results": results,
+            "not_found": sorted(with_history),
+        }
+
+
+def _search_by_vector(db: Session, vector: list[float], limit: int, search: dict, filters: SearchFilters) -> list:
+    store = get_vector_store()
+    if store is not None:
+        return nearest_in_store(db, store, vector, limit, filters)
+    return nearest(db, vector, limit, search, filters)
+
+
 @router.get("/search")
-def semantic_search(
+async def semantic_search(
     q: str = Query(..., min_length=2, description="Search query"),
     limit: int = Query(10, le=50),
-    db: Session = Depends(get_db),
+    mode: Optional[str] = Query(None, pattern="^(semantic|hybrid|lexical)$"),
+    search: dict = Depends(search_params),
+    filters: SearchFilters = Depends(search_filters),
+    run: QueryRunner = Depends(query_runner),
 ):
-    """Semantic search — find books by meaning, not just keywords."""
+    """Semantic search — find books by meaning, not just keywords.
+
+    ``mode=hybrid`` also matches title/author/description lexically and fuses
+    both rankings; ``mode=lexical`` never calls the embedding API. Repeated
+    queries are answered from the query cache (see app.search_cache).
+    """
+    mode = mode or settings.search_default_mode
     with RECOMMENDATION_LATENCY.labels(endpoint="semantic_search").time():
-        vector = get_embedding(q)
-        if vector is None:
-            raise HTTPException(503, "Embedding service unavailable")
-
-        results = db.execute(
-            text("""
-                SELECT id, title, author, category, description,
-                       1 - (embedding <=> :query_vec) AS similarity
-                FROM book_embedding
-                WHERE embedding IS NOT NULL
-                ORDER BY embedding <=> :query_vec
-                LIMIT :limit
-            """),
-            {"query_vec": str(vector), "limit": limit},
-        ).fetchall()
+        key = generation = None
+        if search_cache is not None:
+            key = SearchCache.key(q, limit, mode, _cache_knobs(search, filters))
+            generation = await run_in_threadpool(search_cache.current_generation)
+            cached = search_cache.get(key, generation)
+            if cached is not None:
+                return {"query": q, **cached}
 
-        return {
-            "query": q,
-            "results": [
-                {
-                    "book_id": row.id,
-                    "title": row.title,
-                    "author": row.author,
-                    "category": row.category,
-                    "similarity": round(float(row.similarity), 4),
-                }
-                for row in results
-                if float(row.similarity) >= settings.similarity_threshold
-            ],
+        response, cacheable = await _run_search(run, normalize_query(q), limit, mode, search, filters)
+        if search_cache is not None and cacheable:
+            search_cache.put(key, response, generation)
+        return {"query": q, **response}
+
+
+async def _run_search(
+    run: QueryRunner, query: str, limit: int, mode: str, search: dict, filters: SearchFilters
+) -> tuple[dict, bool]:
+    """Response body without the echoed query, and whether it may be cached."""
+    lexical = []
+    if mode in ("hybrid", "lexical"):
+        candidates = max(limit, settings.hybrid_candidates)
+        lexical = await run(lexical_search, query, candidates, filters)
+        if mode == "lexical" or is_confident(lexical):
+            # Exact title/author match: skip the embedding round trip entirely
+            SEARCH_REQUESTS.labels(path="lexical").inc()
+            fused = reciprocal_rank_fusion(lexical, [], limit)
+            return {"mode": mode, "path": "lexical", "results": _search_results(fused)}, True
+
+    # Awaited on the shared keep-alive client: no threadpool slot is held during the API call
+    try:
+        vector = await aget_embedding(query)
+    except (RetryError, httpx.HTTPError) as exc:
+        if not lexical:
+            raise
+        logger.warning("Query embedding failed, answering lexically: %s", exc)
+        vector = None
+    if vector is None:
+        if lexical:
+            SEARCH_REQUESTS.labels(path="lexical_fallback").inc()
+            fused = reciprocal_rank_fusion(lexical, [], limit)
+            return {"mode": mode, "path": "lexical", "results": _search_results(fused)}, False
+        raise HTTPException(503, "Embedding service unavailable")
+
+    fetch = max(limit, settings.hybrid_candidates) if mode == "hybrid" else limit
+    results = await run(_search_by_vector, vector, fetch, search, filters, threaded=_store_bound())
+
+    if mode == "hybrid":
+        SEARCH_REQUESTS.labels(path="hybrid").inc()
+        fused = reciprocal_rank_fusion(lexical, results, limit)
+        return {"mode": mode, "path": "hybrid", "results": _search_results(fused)}, True
+
+    SEARCH_REQUESTS.labels(path="semantic").inc()
+    return {
+        "results": [
+            {
+                "book_id": row.id,
+                "title": row.title,
+                "author": row.author,
+                "category": row.category,
+                "similarity": round(float(row.similarity), 4),
+            }
+            for row in results
+        ],
+    }, True
+
+
+def _search_results(fused: list[FusedHit]) -> list[dict]:
+    return [
+        {
+            "book_id": hit.id,
+            "title": hit.title,
+            "author": hit.author,
+            "category": hit.category,
+            "similarity": None if hit.similarity is None else round(hit.similarity, 4),
+            "score": round(hit.score, 6),
         }
+        for hit in fused
+    ]
@@ -0,0 +1,137 @@
+"""Schema upgrades that ``Base.metadata.create_all`` cannot perform.
+
+create_all only creates missing tables; columns and extensions added to
+existing tables are applied here with idempotent DDL on every startup. Only
+catalog-only changes run there (nullable columns, constant defaults), so they
+never rewrite a table. A session-level advisory lock serialises workers
+starting at the same time.
+
+Secondary indexes are built separately with CREATE INDEX CONCURRENTLY in a
+background thread, like the ANN index (app.vector_index): readers and writers
+keep working while they build, and one worker builds them at a time. The
+full-text index is an expression index over ``search_document`` rather than a
+stored generated column, whose ADD COLUMN would rewrite the whole table.
+"""
+
+import logging
+import re
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.background import SCHEMA_LOCK_KEY, SEARCH_INDEX_BUILD_LOCK_KEY
+from app.config import settings
+from app.vector_index import _index_valid
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_PREFIX = "ix_book_embedding_search_document_"
+
+
+def search_document() -> str:
+    """Full-text document of a book (titles/authors weigh more than descriptions).
+
+    Queries must use this exact expression for the GIN index to serve them.
+    """
+    config = settings.search_text_config.replace("'", "")
+    return (
+        f"(setweight(to_tsvector('{config}'::regconfig, coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{config}'::regconfig, coalesce(author, '')), 'A') || "
+        f"setweight(to_tsvector('{config}'::regconfig, coalesce(description, '')), 'B'))"
+    )
+
+
+def search_index_name() -> str:
+    return SEARCH_INDEX_PREFIX + re.sub(r"\W", "_", settings.search_text_config.lower())
+
+
+def _statements() -> list[str]:
+    return [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        # Superseded by the search_document expression index; dropping a column is catalog-only
+        "ALTER TABLE book_embedding DROP COLUMN IF EXISTS search_vector",
+        # Set while an embedding_job is pending for the book (see app.embedding_worker)
+        "ALTER TABLE book_embedding ADD COLUMN IF NOT EXISTS embedding_stale boolean NOT NULL DEFAULT false",
+        # Fingerprint of the embedded text: unchanged title/description skip the embedding API
+        "ALTER TABLE book_embedding ADD COLUMN IF NOT EXISTS text_hash varchar(64)",
+    ]
+
+
+def _indexes() -> dict[str, str]:
+    """Index name -> CREATE INDEX CONCURRENTLY statement."""
+    return {
+        search_index_name(): f"ON book_embedding USING gin ({search_document()})",
+        "ix_book_embedding_title_trgm": "ON book_embedding USING gin (title gin_trgm_ops)",
+        "ix_book_embedding_author_trgm": "ON book_embedding USING gin (author gin_trgm_ops)",
+        # Filtered vector search: candidate sets for selective category/author filters
+        "ix_book_embedding_category": "ON book_embedding (category) WHERE embedding IS NOT NULL",
+        "ix_book_embedding_author": "ON book_embedding (author) WHERE embedding IS NOT NULL",
+        # NOT EXISTS probe that hides already-seen books from /for-user
+        "ix_user_interaction_user_book": "ON user_interaction (user_id, book_id)",
+    }
+
+
+def ensure_schema(bind: Engine) -> None:
+    """Apply every idempotent upgrade statement (run after create_all)."""
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        try:
+            for statement in _statements():
+                conn.execute(text(statement))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+    logger.info("Schema upgrades applied.")
+
+
+def ensure_indexes(bind: Engine) -> None:
+    """Create (or repair) the secondary indexes concurrently, outside any transaction."""
+    indexes = _indexes()
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        locked = conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": SEARCH_INDEX_BUILD_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            logger.info("Index build already running in another process.")
+            return
+
+        try:
+            # Full-text indexes built for another search_text_config
+            others = conn.execute(
+                text("""
+                    SELECT relname FROM pg_class
+                    WHERE relkind = 'i' AND relname LIKE :prefix AND relname != :name
+                """),
+                {"prefix": SEARCH_INDEX_PREFIX + "%", "name": search_index_name()},
+            ).scalars().all()
+            for other_name in others:
+                logger.info("Dropping superseded search index %s.", other_name)
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {other_name}"))
+
+            for name, definition in indexes.items():
+                valid = _index_valid(conn, name)
+                if valid:
+                    continue
+                if valid is False:
+                    # Left behind by an interrupted concurrent build
+                    logger.warning("Dropping invalid index %s before rebuild.", name)
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                logger.info("Building index %s ...", name)
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SEARCH_INDEX_BUILD_LOCK_KEY})
+    logger.info("Secondary indexes ready.")
+
+
+def _build_safely(bind: Engine) -> None:
+    try:
+        ensure_indexes(bind)
+    except Exception as exc:
+        logger.exception("Index build failed: %s", exc)
+
+
+def start_schema_index_build(bind: Engine) -> threading.Thread:
+    """Run ensure_indexes in a daemon thread."""
+    thread = threading.Thread(target=_build_safely, args=(bind,), daemon=True)
+    thread.start()
+    return thread
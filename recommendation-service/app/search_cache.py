@@ -0,0 +1,156 @@
+"""Query cache for /search — popular queries are answered from memory.
+
+Two levels share one normalisation (Unicode NFC, collapsed whitespace, case
+folded), so "Harry Potter " and "harry potter" are the same query:
+
+1. normalised query text → embedding: the embedding cache
+   (app.embedding_cache), so a repeated query never calls the embedding API;
+2. (query fingerprint, limit, mode, recall knobs, filters) → response rows:
+   this module, a per-process LRU bounded by entry count and TTL.
+
+Any catalog change can change any search result, so entries are tagged with
+the *catalog generation* they were computed under. The consumer and the
+embedding workers bump ``catalog_generation`` in the same transaction as the
+change (one row per shard of book ids, so concurrent writers do not contend);
+each process reads the sum at most once per
+``search_cache_generation_check_seconds`` and entries of an older generation
+are misses.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from prometheus_client import Counter
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_REQUESTS = Counter(
+    "recommendation_search_cache_requests_total", "/search query cache lookups", ["result"]
+)
+
+GENERATION_SHARDS = 16
+
+BUMP_GENERATION_SQL = """
+    INSERT INTO catalog_generation (shard, generation)
+    SELECT shard, 1 FROM unnest(CAST(:shards AS integer[])) AS shard
+    ON CONFLICT (shard) DO UPDATE SET generation = catalog_generation.generation + 1
+"""
+
+
+def normalize_query(query: str) -> str:
+    """Query text as embedded and matched: NFC, collapsed whitespace, case folded."""
+    return normalize_text(query).casefold()
+
+
+def bump_generation(db: Session, book_ids: Iterable[int]) -> None:
+    """Mark the catalog changed (call inside the change's transaction)."""
+    shards = sorted({book_id % GENERATION_SHARDS for book_id in book_ids})
+    if shards:
+        db.execute(text(BUMP_GENERATION_SQL), {"shards": shards})
+
+
+def catalog_generation(db: Session) -> int:
+    return int(db.execute(text("SELECT COALESCE(SUM(generation), 0) FROM catalog_generation")).scalar())
+
+
+def read_catalog_generation() -> int:
+    with SessionLocal() as db:
+        return catalog_generation(db)
+
+
+class CachedSearch(NamedTuple):
+    response: dict
+    generation: int
+    expires_at: float
+
+
+class SearchCache:
+    """Bounded LRU of /search responses, checked against the catalog generation."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        check_seconds: float,
+        clock=time.monotonic,
+        read_generation: Callable[[], int] = read_catalog_generation,
+    ):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._check_seconds = check_seconds
+        self._clock = clock
+        self._read_generation = read_generation
+        self._entries: OrderedDict[str, CachedSearch] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self._checked_at = float("-inf")
+
+    @staticmethod
+    def key(query: str, limit: int, mode: str, knobs: dict) -> str:
+        fingerprint = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        options = ":".join(f"{name}={knobs[name]}" for name in sorted(knobs))
+        return f"{fingerprint}:{limit}:{mode}:{options}"
+
+    def current_generation(self) -> Optional[int]:
+        """Catalog generation, re-read when older than the check interval (None if unreadable)."""
+        now = self._clock()
+        if now - self._checked_at >= self._check_seconds:
+            try:
+                generation = self._read_generation()
+            except Exception as exc:
+                logger.warning("Catalog generation check failed: %s", exc)
+                generation = None
+            with self._lock:
+                if generation != self._generation:
+                    self._entries.clear()
+                self._generation, self._checked_at = generation, now
+        return self._generation
+
+    def get(self, key: str, generation: Optional[int]) -> Optional[dict]:
+        entry = None
+        if generation is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and (entry.generation != generation or entry.expires_at <= self._clock()):
+                    del self._entries[key]
+                    entry = None
+                elif entry is not None:
+                    self._entries.move_to_end(key)
+        SEARCH_CACHE_REQUESTS.labels(result="hit" if entry else "miss").inc()
+        return None if entry is None else entry.response
+
+    def put(self, key: str, response: dict, generation: Optional[int]):
+        """Store a response computed while ``generation`` was current."""
+        if generation is None or generation != self._generation:
+            return
+        with self._lock:
+            self._entries[key] = CachedSearch(response, generation, self._clock() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation, self._checked_at = None, float("-inf")
+
+
+search_cache = (
+    SearchCache(
+        settings.search_cache_max_entries,
+        settings.search_cache_ttl_seconds,
+        settings.search_cache_generation_check_seconds,
+    )
+    if settings.search_cache_enabled
+    else None
+)
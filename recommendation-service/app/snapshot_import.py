@@ -0,0 +1,234 @@
+"""Bulk snapshot import — bootstraps an empty replica without embedding API calls.
+
+Loads the files written by ``python -m app.export snapshot DIRECTORY``::
+
+    python -m app.snapshot_import DIRECTORY [--vectors books.npy] [--replace]
+
+book_embedding and user_interaction are filled with COPY in chunks (constant
+memory). Vectors come from the NDJSON lines or, with ``--vectors`` (or a
+``book_embedding.npy`` in the directory), from an .npy export matched by id.
+The ANN index is dropped before the load and built once afterwards, and
+popularity is recomputed; profiles, the collaborative model and neighbour
+lists rebuild on their own. Books exported without a vector (never embedded,
+or still pending) get an ``embedding_job`` in the import transaction.
+
+With ``bootstrap_snapshot_dir`` set, the service imports at startup when
+book_embedding is empty, before its consumer starts. Events queued meanwhile
+are consumed afterwards; replayed book events with unchanged text cost no
+embedding call (``text_hash``).
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import time
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.background import SNAPSHOT_IMPORT_LOCK_KEY
+from app.export import SNAPSHOT_FILES
+from app.popularity import refresh_popularity
+from app.vector_index import INDEX_NAME_PREFIX, ensure_vector_index
+from app.vector_search import vector_literal
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_ROWS = 5000
+VECTORS_FILE = "book_embedding.npy"
+
+BOOK_COLUMNS = ("id", "title", "author", "category", "description", "text_hash", "embedding")
+INTERACTION_COLUMNS = ("id", "user_id", "book_id", "interaction_type", "rating", "created_at")
+
+# Imported books without a vector but with text to embed (see app.embedding.book_text)
+ENQUEUE_MISSING_SQL = """
+    WITH missing AS (
+        UPDATE book_embedding SET embedding_stale = true
+        WHERE embedding IS NULL AND btrim(coalesce(title, '') || coalesce(description, '')) <> ''
+        RETURNING id
+    )
+    INSERT INTO embedding_job (book_id, enqueued_at, attempts, next_attempt_at)
+    SELECT id, clock_timestamp(), 0, clock_timestamp() FROM missing
+    ON CONFLICT (book_id) DO NOTHING
+"""
+
+# Tables derived from the imported ones; emptied by --replace
+DERIVED_TABLES = (
+    "user_profile", "user_taste_cluster", "book_popularity", "embedding_job", "collaborative_model",
+    "book_neighbors", "book_neighbors_dirty", "book_neighbors_state", "catalog_generation",
+)
+
+
+def _ndjson(path: str) -> Iterator[dict]:
+    with open(path, "rb") as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+class SnapshotVectors:
+    """Vectors of an .npy export (structured id/embedding array), memory-mapped."""
+
+    def __init__(self, path: str):
+        array = np.load(path, mmap_mode="r")
+        self._ids = np.asarray(array["id"])
+        self._vectors = array["embedding"]
+        if not np.all(self._ids[1:] > self._ids[:-1]):
+            order = np.argsort(self._ids, kind="stable")
+            self._ids, self._vectors = self._ids[order], np.asarray(self._vectors)[order]
+
+    def get(self, book_id: int) -> Optional[np.ndarray]:
+        position = int(np.searchsorted(self._ids, book_id))
+        if position < len(self._ids) and self._ids[position] == book_id:
+            return self._vectors[position]
+        return None
+
+
+def book_row(record: dict, vectors: Optional[SnapshotVectors] = None) -> list:
+    vector = vectors.get(record["id"]) if vectors is not None else None
+    if vector is None:
+        vector = record.get("embedding")
+    return [
+        record["id"],
+        record.get("title") or "",
+        record.get("author"),
+        record.get("category"),
+        record.get("description"),
+        record.get("text_hash"),
+        None if vector is None else vector_literal(vector),
+    ]
+
+
+def interaction_row(record: dict) -> list:
+    return [record[column] for column in INTERACTION_COLUMNS]
+
+
+def _csv_field(value) -> str:
+    """COPY csv field: NULL is unquoted empty, so every string is quoted (keeps '' apart)."""
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _chunks(rows: Iterable[list]) -> Iterator[io.StringIO]:
+    data, count = io.StringIO(), 0
+    for row in rows:
+        data.write(",".join(map(_csv_field, row)) + "\n")
+        count += 1
+        if count == IMPORT_CHUNK_ROWS:
+            data.seek(0)
+            yield data
+            data, count = io.StringIO(), 0
+    if count:
+        data.seek(0)
+        yield data
+
+
+def _copy(cursor, table: str, columns: tuple, rows: Iterable[list]) -> int:
+    copied = 0
+    for chunk in _chunks(rows):
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", chunk)
+        copied += cursor.rowcount
+    return copied
+
+
+def import_snapshot(
+    bind: Engine,
+    directory: str,
+    vectors_path: Optional[str] = None,
+    replace: bool = False,
+    if_empty: bool = False,
+) -> Optional[dict]:
+    """Load a snapshot directory. Returns row counts, or None if ``if_empty`` and data exists."""
+    if vectors_path is None and os.path.exists(os.path.join(directory, VECTORS_FILE)):
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+    vectors = SnapshotVectors(vectors_path) if vectors_path else None
+    started = time.perf_counter()
+
+    connection = bind.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SNAPSHOT_IMPORT_LOCK_KEY,))
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM book_embedding)")
+            if cursor.fetchone()[0] and not replace:
+                connection.rollback()
+                if if_empty:
+                    return None
+                raise RuntimeError("book_embedding is not empty; pass --replace to overwrite it")
+            if replace:
+                cursor.execute(
+                    f"TRUNCATE book_embedding, user_interaction, {', '.join(DERIVED_TABLES)} RESTART IDENTITY"
+                )
+
+            # One index build after the load beats maintaining the ANN index per row
+            cursor.execute(
+                "SELECT relname FROM pg_class WHERE relkind = 'i' AND relname LIKE %s",
+                (INDEX_NAME_PREFIX + "%",),
+            )
+            for (index,) in cursor.fetchall():
+                cursor.execute(f"DROP INDEX IF EXISTS {index}")
+
+            books = _ndjson(os.path.join(directory, SNAPSHOT_FILES["embeddings"]))
+            counts = {
+                "books": _copy(cursor, "book_embedding", BOOK_COLUMNS, (book_row(b, vectors) for b in books)),
+                "interactions": 0,
+            }
+            cursor.execute(ENQUEUE_MISSING_SQL)
+            counts["embedding_jobs"] = cursor.rowcount
+            interactions = os.path.join(directory, SNAPSHOT_FILES["interactions"])
+            if os.path.exists(interactions):
+                counts["interactions"] = _copy(
+                    cursor, "user_interaction", INTERACTION_COLUMNS, map(interaction_row, _ndjson(interactions))
+                )
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence('user_interaction', 'id'), "
+                    "COALESCE((SELECT MAX(id) FROM user_interaction), 0) + 1, false)"
+                )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    logger.info(
+        "Snapshot loaded: %d books (%d queued for embedding), %d interactions in %.1fs.",
+        counts["books"], counts["embedding_jobs"], counts["interactions"], time.perf_counter() - started,
+    )
+
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE book_embedding"))
+        conn.execute(text("ANALYZE user_interaction"))
+    ensure_vector_index(bind)
+    refresh_popularity(bind)
+    logger.info("Snapshot import finished in %.1fs.", time.perf_counter() - started)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load an app.export snapshot into an empty database.")
+    parser.add_argument("directory")
+    parser.add_argument("--vectors", help=f".npy export to take vectors from (default: {VECTORS_FILE} if present)")
+    parser.add_argument("--replace", action="store_true", help="truncate existing data first")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    import app.models  # noqa: F401 — registers the tables for create_all
+    from app.database import Base, engine
+    from app.schema import ensure_schema
+
+    with engine.connect() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.commit()
+    Base.metadata.create_all(bind=engine)
+    ensure_schema(engine)
+    import_snapshot(engine, args.directory, args.vectors, args.replace)
+
+
+if __name__ == "__main__":
+    main()
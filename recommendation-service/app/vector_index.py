@@ -0,0 +1,334 @@
+"""Vector index management — ANN index on book_embedding.embedding.
+
+The index is built with CREATE INDEX CONCURRENTLY in a background thread so
+startup is never blocked on a large catalog, and a Postgres advisory lock
+makes sure only one worker process builds it at a time.
+
+With ``vector_storage`` = halfvec or binary (and/or ``vector_search_dimensions``
+for Matryoshka-style truncation) the index is built on a reduced-precision
+expression of the column — half or 1/32 of the size — while the column keeps
+full precision. Queries walk the small index for ``vector_rerank_factor`` x
+``limit`` candidates and re-rank those exactly (see ``ann_distance``).
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.background import INDEX_BUILD_LOCK_KEY
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAMES = {
+    "hnsw": "ix_book_embedding_embedding_hnsw",
+    "ivfflat": "ix_book_embedding_embedding_ivfflat",
+}
+INDEX_NAME_PREFIX = "ix_book_embedding_embedding_"
+
+# vector_storage -> (operator class, distance operator); halfvec/bit need pgvector >= 0.7
+STORAGE_OPS = {
+    "full": ("vector_cosine_ops", "<=>"),
+    "halfvec": ("halfvec_cosine_ops", "<=>"),
+    "binary": ("bit_hamming_ops", "<~>"),
+}
+
+# Recall/latency trade-offs selectable per request
+SEARCH_PROFILES = {
+    "fast": {"ef_search": 20, "probes": 1},
+    "balanced": {"ef_search": settings.hnsw_ef_search, "probes": settings.ivfflat_probes},
+    "accurate": {"ef_search": 200, "probes": 40},
+}
+
+# pgvector rejects larger hnsw.ef_search values
+HNSW_MAX_EF_SEARCH = 1000
+
+_pgvector_version: Optional[tuple[int, ...]] = None
+
+_state_lock = threading.Lock()
+_build_state = {
+    "status": "unknown",  # unknown, disabled, building, ready, deferred, locked, failed
+    "index_type": settings.vector_index_type,
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+
+
+def _set_state(**values):
+    with _state_lock:
+        _build_state.update(values)
+
+
+def _index_valid(conn, name: str) -> Optional[bool]:
+    """Return None if the index does not exist, else its pg_index.indisvalid flag."""
+    row = conn.execute(
+        text("""
+            SELECT i.indisvalid
+            FROM pg_class c
+            JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = :name
+        """),
+        {"name": name},
+    ).first()
+    return None if row is None else bool(row[0])
+
+
+def ann_dimensions() -> int:
+    """Leading dimensions the ANN index covers (Matryoshka truncation)."""
+    return int(settings.vector_search_dimensions or settings.embedding_dimensions)
+
+
+def exact_index() -> bool:
+    """True when the index ranks by full-precision cosine distance (no re-ranking)."""
+    return settings.vector_storage == "full" and ann_dimensions() == settings.embedding_dimensions
+
+
+def ann_expression(vector_sql: str) -> str:
+    """The indexed form of a vector-typed SQL expression."""
+    dims = ann_dimensions()
+    source = vector_sql if dims == settings.embedding_dimensions else f"subvector({vector_sql}, 1, {dims})"
+    if settings.vector_storage == "halfvec":
+        return f"({source})::halfvec({dims})"
+    if settings.vector_storage == "binary":
+        return f"binary_quantize({source})::bit({dims})"
+    return source
+
+
+def ann_distance(column_sql: str, query_sql: str) -> str:
+    """ORDER BY expression that the ANN index serves (identical to the indexed expression)."""
+    operator = STORAGE_OPS[settings.vector_storage][1]
+    return f"{ann_expression(column_sql)} {operator} {ann_expression(query_sql)}"
+
+
+def candidate_limit(limit: int) -> int:
+    """Rows to pull from the index before the exact re-rank.
+
+    With HNSW the re-rank window stays within what ef_search can serve.
+    """
+    if exact_index():
+        return limit
+    candidates = limit * settings.vector_rerank_factor
+    if settings.vector_index_type == "hnsw":
+        candidates = max(limit, min(candidates, HNSW_MAX_EF_SEARCH))
+    return candidates
+
+
+def index_name(index_type: str) -> str:
+    if exact_index():
+        return INDEX_NAMES[index_type]
+    return f"{INDEX_NAMES[index_type]}_{settings.vector_storage}{ann_dimensions()}"
+
+
+def _index_ddl(index_type: str) -> str:
+    name = index_name(index_type)
+    if index_type == "hnsw":
+        options = f"m = {int(settings.hnsw_m)}, ef_construction = {int(settings.hnsw_ef_construction)}"
+    else:
+        options = f"lists = {int(settings.ivfflat_lists)}"
+    opclass = STORAGE_OPS[settings.vector_storage][0]
+    expression = ann_expression("embedding")
+    key = f"embedding {opclass}" if expression == "embedding" else f"({expression}) {opclass}"
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+        f"ON book_embedding USING {index_type} ({key}) "
+        f"WITH ({options})"
+    )
+
+
+def ensure_vector_index(bind: Engine) -> None:
+    """Create (or repair) the configured ANN index and drop indexes of other types."""
+    index_type = settings.vector_index_type
+    if index_type not in INDEX_NAMES:
+        _set_state(status="disabled", index_type=index_type)
+        logger.info("Vector index disabled (vector_index_type=%s).", index_type)
+        return
+
+    name = index_name(index_type)
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        locked = conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": INDEX_BUILD_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            _set_state(status="locked", index_type=index_type)
+            logger.info("Vector index build already running in another process.")
+            return
+
+        try:
+            if not exact_index() and pgvector_version(conn) < (0, 7):
+                # halfvec, bit and subvector arrived in pgvector 0.7
+                _set_state(
+                    status="failed",
+                    index_type=index_type,
+                    error=f"vector_storage={settings.vector_storage} needs pgvector >= 0.7",
+                )
+                logger.error("Reduced-precision vector index needs pgvector >= 0.7.")
+                return
+
+            # Indexes of another type, storage mode or dimension count
+            others = conn.execute(
+                text("""
+                    SELECT relname FROM pg_class
+                    WHERE relkind = 'i' AND relname LIKE :prefix AND relname != :name
+                """),
+                {"prefix": INDEX_NAME_PREFIX + "%", "name": name},
+            ).scalars().all()
+            for other_name in others:
+                logger.info("Dropping superseded vector index %s.", other_name)
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {other_name}"))
+
+            valid = _index_valid(conn, name)
+            if valid:
+                _set_state(status="ready", index_type=index_type, error=None)
+                return
+            if valid is False:
+                # Left behind by an interrupted concurrent build
+                logger.warning("Dropping invalid vector index %s before rebuild.", name)
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+            if index_type == "ivfflat":
+                # IVFFlat centroids are trained on existing rows; an index on an
+                # (almost) empty table would have terrible recall.
+                rows = conn.execute(
+                    text("SELECT COUNT(*) FROM book_embedding WHERE embedding IS NOT NULL")
+                ).scalar()
+                if rows < settings.ivfflat_lists:
+                    _set_state(status="deferred", index_type=index_type)
+                    logger.info("IVFFlat build deferred: %d rows < %d lists.", rows, settings.ivfflat_lists)
+                    return
+
+            _set_state(
+                status="building",
+                index_type=index_type,
+                started_at=datetime.utcnow().isoformat(),
+                finished_at=None,
+                error=None,
+            )
+            logger.info("Building vector index %s ...", name)
+            conn.execute(
+                text("SELECT set_config('maintenance_work_mem', :mem, false)"),
+                {"mem": settings.vector_index_maintenance_work_mem},
+            )
+            conn.execute(text(_index_ddl(index_type)))
+            _set_state(status="ready", finished_at=datetime.utcnow().isoformat())
+            logger.info("Vector index %s ready.", name)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INDEX_BUILD_LOCK_KEY})
+
+
+def _build_safely(bind: Engine) -> None:
+    try:
+        ensure_vector_index(bind)
+    except Exception as exc:
+        _set_state(status="failed", error=str(exc), finished_at=datetime.utcnow().isoformat())
+        logger.exception("Vector index build failed: %s", exc)
+
+
+def start_index_build(bind: Engine) -> threading.Thread:
+    """Run ensure_vector_index in a daemon thread."""
+    thread = threading.Thread(target=_build_safely, args=(bind,), daemon=True)
+    thread.start()
+    return thread
+
+
+def get_index_status(bind: Engine) -> dict:
+    """Combine the local build state with what the database reports."""
+    with _state_lock:
+        status = dict(_build_state)
+
+    if status["index_type"] not in INDEX_NAMES:
+        return status
+    name = index_name(status["index_type"])
+    status["storage"] = settings.vector_storage
+    status["dimensions"] = ann_dimensions()
+
+    with bind.connect() as conn:
+        status["valid"] = _index_valid(conn, name)
+        status["exists"] = status["valid"] is not None
+        if status["exists"]:
+            status["size_bytes"] = conn.execute(
+                text("SELECT pg_relation_size(CAST(:name AS regclass))"), {"name": name}
+            ).scalar()
+        progress = conn.execute(
+            text("""
+                SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+                FROM pg_stat_progress_create_index
+                WHERE relid = CAST('book_embedding' AS regclass)
+            """)
+        ).first()
+        if progress is not None:
+            status["progress"] = dict(progress._mapping)
+            if status["status"] in ("unknown", "locked"):
+                status["status"] = "building"
+        elif status["valid"] and status["status"] in ("unknown", "locked"):
+            status["status"] = "ready"
+
+    return status
+
+
+def resolve_search_params(
+    profile: Optional[str] = None,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+) -> dict:
+    """Merge a named search profile with explicit per-request overrides."""
+    params = dict(SEARCH_PROFILES[profile or settings.search_profile])
+    if ef_search is not None:
+        params["ef_search"] = ef_search
+    if probes is not None:
+        params["probes"] = probes
+    return params
+
+
+def apply_search_params(db: Session, limit: int, **overrides) -> dict:
+    """Set hnsw.ef_search / ivfflat.probes for the current transaction only."""
+    params = resolve_search_params(**overrides)
+    if settings.vector_index_type == "hnsw":
+        # HNSW never returns more than ef_search candidates
+        params["ef_search"] = min(max(params["ef_search"], limit), HNSW_MAX_EF_SEARCH)
+        db.execute(
+            text("SELECT set_config('hnsw.ef_search', :value, true)"),
+            {"value": str(params["ef_search"])},
+        )
+    elif settings.vector_index_type == "ivfflat":
+        db.execute(
+            text("SELECT set_config('ivfflat.probes', :value, true)"),
+            {"value": str(params["probes"])},
+        )
+    return params
+
+
+def pgvector_version(db) -> tuple[int, ...]:
+    """Installed pgvector extension version (queried once per process)."""
+    global _pgvector_version
+    if _pgvector_version is None:
+        raw = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        _pgvector_version = tuple(int(part) for part in (raw or "0").split(".") if part.isdigit())
+    return _pgvector_version
+
+
+def enable_iterative_scan(db: Session) -> bool:
+    """Let the ANN index keep scanning until enough rows pass the filters.
+
+    Needs pgvector >= 0.8; applies to the current transaction only. Returns
+    False when unavailable so callers fall back to over-fetching.
+    """
+    index_type = settings.vector_index_type
+    if not settings.vector_iterative_scan or index_type not in INDEX_NAMES:
+        return False
+    if pgvector_version(db) < (0, 8):
+        return False
+    db.execute(
+        text(f"SELECT set_config('{index_type}.iterative_scan', 'relaxed_order', true)")
+    )
+    if index_type == "hnsw":
+        db.execute(
+            text("SELECT set_config('hnsw.max_scan_tuples', :value, true)"),
+            {"value": str(settings.hnsw_max_scan_tuples)},
+        )
+    return True
@@ -0,0 +1,315 @@
+"""Filtered nearest-neighbour search shared by the recommendation routes.
+
+Category, author and exclusion filters are part of the ANN query itself. An
+HNSW/IVFFlat scan only yields ``ef_search``/``probes`` worth of candidates,
+so a selective filter applied to them would return fewer than ``limit`` rows.
+Two remedies, in order of preference:
+
+* pgvector >= 0.8 iterative index scans keep walking the index until enough
+  rows pass the filters (``relaxed_order``; the outer query re-sorts);
+* otherwise the candidate list is widened 4x per round up to
+  ``vector_overfetch_max``, then one exact scan (index scans off) settles it.
+
+``min_similarity`` is applied to the ordered result instead: rows arrive best
+first, so nothing is lost, while pushing a distance bound into the scan would
+make an iterative scan run all the way to ``hnsw_max_scan_tuples``.
+
+Query vectors that are already stored (a book's embedding, a user's profile)
+are referenced by id inside the statement (``book_vector``/``profile_vector``)
+instead of being fetched and sent back; only vectors that originate in Python
+are bound, as compact float32 text (``vector_literal``).
+"""
+
+from typing import NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.vector_index import ann_distance, apply_search_params, candidate_limit, enable_iterative_scan
+
+OVERFETCH_FACTOR = 4
+
+
+class VectorRef(NamedTuple):
+    """A query vector that lives in the database, as an SQL scalar subquery."""
+    sql: str
+    params: dict
+
+
+def book_vector(book_id: int) -> VectorRef:
+    return VectorRef(
+        "(SELECT embedding FROM book_embedding WHERE id = :ref_book_id)", {"ref_book_id": book_id}
+    )
+
+
+def profile_vector(user_id: int) -> VectorRef:
+    return VectorRef(
+        "(SELECT embedding_sum FROM user_profile WHERE user_id = :ref_user_id)", {"ref_user_id": user_id}
+    )
+
+
+def cluster_vector(user_id: int, cluster: int) -> VectorRef:
+    return VectorRef(
+        "(SELECT centroid FROM user_taste_cluster "
+        f"WHERE user_id = :ref_user_id AND cluster = {int(cluster)})",
+        {"ref_user_id": user_id},
+    )
+
+
+def vector_literal(vector) -> str:
+    """pgvector text input with float32 precision ('%.9g' round-trips exactly).
+
+    About 40% shorter than ``pgvector.utils.to_db`` (which prints float64
+    reprs) and cheaper to produce; psycopg2 has no binary parameter format.
+    """
+    values = np.asarray(vector, dtype=np.float32).tolist()
+    return "[" + ",".join(map("{:.9g}".format, values)) + "]"
+
+
+def query_vector(query: Union[VectorRef, Sequence[float], np.ndarray]) -> tuple[str, dict]:
+    """SQL expression and bind values for a stored or client-side query vector."""
+    if isinstance(query, VectorRef):
+        return query.sql, dict(query.params)
+    return "CAST(:vec AS vector)", {"vec": vector_literal(query)}
+
+
+def query_predicates(query) -> list[str]:
+    """A reference to a missing row must match nothing (``x <=> NULL`` is NULL, not absent)."""
+    return [f"{query.sql} IS NOT NULL"] if isinstance(query, VectorRef) else []
+
+
+class ScoredBook(NamedTuple):
+    """Row shape shared by SQL results and vector-store hits."""
+    id: int
+    title: str
+    author: Optional[str]
+    category: Optional[str]
+    description: Optional[str]
+    similarity: float
+
+
+class SearchFilters(NamedTuple):
+    category: Optional[str] = None
+    author: Optional[str] = None
+    exclude: tuple[int, ...] = ()
+    min_similarity: Optional[float] = None
+
+    @property
+    def selective(self) -> bool:
+        """Filters that remove rows before the LIMIT (min_similarity does not)."""
+        return bool(self.category or self.author or self.exclude)
+
+    def conditions(self, alias: str = "be") -> tuple[list[str], dict]:
+        """SQL predicates and bind parameters for the selective filters."""
+        clauses, params = [], {}
+        if self.category:
+            clauses.append(f"{alias}.category = :filter_category")
+            params["filter_category"] = self.category
+        if self.author:
+            clauses.append(f"{alias}.author = :filter_author")
+            params["filter_author"] = self.author
+        if self.exclude:
+            clauses.append(f"{alias}.id != ALL(:filter_exclude)")
+            params["filter_exclude"] = list(self.exclude)
+        return clauses, params
+
+    def accepts(self, row) -> bool:
+        return (
+            (not self.category or row.category == self.category)
+            and (not self.author or row.author == self.author)
+            and row.id not in self.exclude
+        )
+
+    def above_minimum(self, rows: list) -> list:
+        if self.min_similarity is None:
+            return list(rows)
+        return [row for row in rows if float(row.similarity) >= self.min_similarity]
+
+
+def hydrate_many(db: Session, scored_lists: list[list[tuple[int, float]]]) -> list[list[ScoredBook]]:
+    """Attach catalog metadata to several hit lists with one primary-key lookup."""
+    ids = {book_id for scored in scored_lists for book_id, _ in scored}
+    if not ids:
+        return [[] for _ in scored_lists]
+    rows = db.execute(
+        text("""
+            SELECT id, title, author, category, description
+            FROM book_embedding
+            WHERE id = ANY(:ids)
+        """),
+        {"ids": list(ids)},
+    ).fetchall()
+    by_id = {row.id: row for row in rows}
+    return [
+        [
+            ScoredBook(row.id, row.title, row.author, row.category, row.description, similarity)
+            for book_id, similarity in scored
+            if (row := by_id.get(book_id)) is not None
+        ]
+        for scored in scored_lists
+    ]
+
+
+def hydrate(db: Session, scored: list[tuple[int, float]]) -> list[ScoredBook]:
+    """Attach catalog metadata (primary-key lookup) to vector-store hits, keeping their order."""
+    return hydrate_many(db, [scored])[0]
+
+
+def _candidates_sql(query_sql: str, predicates: list[str]) -> str:
+    # Candidates come from the ANN index (possibly quantized), the final order is exact
+    return f"""
+        SELECT be.id, be.title, be.author, be.category, be.description,
+               1 - (be.embedding <=> {query_sql}) AS similarity
+        FROM book_embedding be
+        WHERE {" AND ".join(predicates)}
+        ORDER BY {ann_distance("be.embedding", query_sql)}
+        LIMIT :candidates
+    """
+
+
+def _search(db: Session, sql, values: dict, limit: int, search: dict, filters: SearchFilters, short) -> list:
+    """Run ``sql``, widening the candidate list while ``short(rows)`` under selective filters."""
+    iterative = filters.selective and enable_iterative_scan(db)
+    fetch = limit
+    while True:
+        apply_search_params(db, candidate_limit(fetch), **search)
+        rows = db.execute(sql, {**values, "candidates": candidate_limit(fetch)}).fetchall()
+        if not short(rows) or not filters.selective or iterative:
+            return rows
+        if fetch >= settings.vector_overfetch_max:
+            # Filter too selective for the index: one exact scan returns every match
+            db.execute(text("SELECT set_config('enable_indexscan', 'off', true)"))
+            rows = db.execute(sql, {**values, "candidates": candidate_limit(fetch)}).fetchall()
+            db.execute(text("SELECT set_config('enable_indexscan', 'on', true)"))
+            return rows
+        fetch = min(fetch * OVERFETCH_FACTOR, settings.vector_overfetch_max)
+
+
+def nearest(
+    db: Session,
+    query,
+    limit: int,
+    search: dict,
+    filters: SearchFilters = SearchFilters(),
+    where: Sequence[str] = (),
+    params: Optional[dict] = None,
+) -> list:
+    """Top ``limit`` books by cosine similarity that pass ``filters`` and ``where``.
+
+    ``query`` is a vector or a ``VectorRef`` (a missing row or NULL vector
+    yields no rows). ``where`` holds extra predicates on ``be``
+    (book_embedding) with their bind values in ``params`` — e.g. excluding
+    the source book.
+    """
+    clauses, values = filters.conditions()
+    predicates = ["be.embedding IS NOT NULL", *query_predicates(query), *where, *clauses]
+    values.update(params or {})
+    query_sql, query_params = query_vector(query)
+    values.update(query_params, limit=limit)
+    sql = text(f"""
+        WITH candidates AS MATERIALIZED ({_candidates_sql(query_sql, predicates)})
+        SELECT * FROM candidates ORDER BY similarity DESC LIMIT :limit
+    """)
+    rows = _search(db, sql, values, limit, search, filters, short=lambda rows: len(rows) < limit)
+    return filters.above_minimum(rows)
+
+
+def nearest_many(
+    db: Session,
+    queries: Sequence[VectorRef],
+    limit: int,
+    search: dict,
+    filters: SearchFilters = SearchFilters(),
+    where: Sequence[str] = (),
+    params: Optional[dict] = None,
+) -> list[list]:
+    """``nearest`` for several stored query vectors in one statement (one ANN scan each).
+
+    Returns one best-first list per query; bind names of the references may
+    be shared (e.g. ``:ref_user_id``) but must not conflict.
+    """
+    clauses, values = filters.conditions()
+    values.update(params or {}, limit=limit)
+    branches = []
+    for position, query in enumerate(queries):
+        predicates = ["be.embedding IS NOT NULL", *query_predicates(query), *where, *clauses]
+        query_sql, query_params = query_vector(query)
+        values.update(query_params)
+        branches.append(f"""
+            (SELECT {position} AS query, c.* FROM ({_candidates_sql(query_sql, predicates)}) c
+             ORDER BY c.similarity DESC LIMIT :limit)
+        """)
+    if not branches:
+        return []
+    sql = text(" UNION ALL ".join(branches))
+
+    def short(rows) -> bool:
+        counts = [0] * len(queries)
+        for row in rows:
+            counts[row.query] += 1
+        return min(counts) < limit
+
+    grouped = [[] for _ in queries]
+    for row in _search(db, sql, values, limit, search, filters, short):
+        grouped[row.query].append(row)
+    return [filters.above_minimum(sorted(rows, key=lambda row: -row.similarity)) for rows in grouped]
+
+
+def interleave(ranked: Sequence[Sequence], weights: Sequence[float], limit: int) -> list:
+    """Merge ranked lists by smooth weighted round robin, skipping repeated ids.
+
+    Each turn goes to the list that has contributed least relative to its
+    weight, so a cluster holding 60% of a user's history fills about 60% of
+    the slots while every taste still shows up near the top.
+    """
+    positions = [0] * len(ranked)
+    taken = [0] * len(ranked)
+    seen, merged = set(), []
+    while len(merged) < limit:
+        open_lists = [i for i, rows in enumerate(ranked) if positions[i] < len(rows)]
+        if not open_lists:
+            break
+        turn = min(open_lists, key=lambda i: ((taken[i] + 1) / max(weights[i], 1e-9), i))
+        row = ranked[turn][positions[turn]]
+        positions[turn] += 1
+        if row.id in seen:
+            continue
+        seen.add(row.id)
+        taken[turn] += 1
+        merged.append(row)
+    return merged
+
+
+def nearest_in_store(
+    db: Session,
+    store,
+    vector,
+    limit: int,
+    filters: SearchFilters = SearchFilters(),
+    exclude: Sequence[int] = (),
+) -> list[ScoredBook]:
+    """Vector-store counterpart of ``nearest``: widens k until the filters are satisfied.
+
+    Past ``vector_overfetch_max`` the matching ids are read from Postgres
+    (category/author indexes) and the store searches only those.
+    """
+    excluded = [*exclude, *filters.exclude]
+    k = limit
+    while True:
+        hits = store.search(vector, k, exclude=excluded)
+        rows = [row for row in hydrate(db, hits) if filters.accepts(row)]
+        if len(rows) >= limit or len(hits) < k:
+            break
+        if k >= settings.vector_overfetch_max:
+            clauses, params = filters.conditions()
+            predicates = ["be.embedding IS NOT NULL", *clauses]
+            matching = db.execute(
+                text(f"SELECT be.id FROM book_embedding be WHERE {' AND '.join(predicates)}"), params
+            ).scalars().all()
+            hits = store.search(vector, limit, exclude=excluded, include=matching)
+            rows = [row for row in hydrate(db, hits) if filters.accepts(row)]
+            break
+        k = min(k * OVERFETCH_FACTOR, settings.vector_overfetch_max)
+    return filters.above_minimum(rows[:limit])
@@ -0,0 +1,308 @@
+"""Memory-mapped vector store — in-process replica of book_embedding vectors.
+
+Enabled with ``vector_engine = "mmap"``. All uvicorn workers map the same files
+(MAP_SHARED), so the OS page cache holds a single copy of the matrix no matter
+how many workers run, and writes made by one worker's consumer are visible to
+the others immediately.
+
+Changes made while no worker was running are not in the files, so at startup
+the replica is reused only if it was loaded for the same embedding model and
+dimensions at the current catalog generation (app.search_cache); otherwise it
+is reloaded from Postgres. Deleted slots are reused by later inserts.
+
+Layout under ``settings.vector_store_path``::
+
+    state.npy          int64[3]: slot high-water mark, layout generation, data version
+    vectors.<gen>.npy  float32[capacity, dim], L2-normalised rows
+    ids.<gen>.npy      int64[capacity], 0 marks an empty / deleted slot
+    source.json        model, dimensions and catalog generation of the last full load
+    .lock              flock() target serialising writers across processes
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Integer, text
+
+from app.config import settings
+from app.embedding import embedding_model_id
+from app.search_cache import catalog_generation
+
+logger = logging.getLogger(__name__)
+
+_COUNT, _GENERATION, _VERSION = 0, 1, 2
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class MmapVectorStore:
+    """Shared float32 matrix + id array with vectorised top-k cosine search."""
+
+    def __init__(self, path: str, dim: int, initial_capacity: int = 4096):
+        self._path = path
+        self._dim = dim
+        self._initial_capacity = initial_capacity
+        self._thread_lock = threading.Lock()
+        self._generation = None
+        os.makedirs(path, exist_ok=True)
+
+        state_path = os.path.join(path, "state.npy")
+        with self._write_lock():
+            if not os.path.exists(state_path):
+                self._create_layout(0, initial_capacity)
+                state = open_memmap(state_path, mode="w+", dtype=np.int64, shape=(3,))
+                state.flush()
+                del state
+        self._state = np.load(state_path, mmap_mode="r+")
+        self._remap()
+
+    # ─── Files & locking ───────────────────────────────────────────
+
+    def _files(self, generation: int) -> tuple[str, str]:
+        return (
+            os.path.join(self._path, f"vectors.{generation}.npy"),
+            os.path.join(self._path, f"ids.{generation}.npy"),
+        )
+
+    @contextmanager
+    def _write_lock(self):
+        with self._thread_lock:
+            with open(os.path.join(self._path, ".lock"), "a") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _create_layout(self, generation: int, capacity: int):
+        vectors_path, ids_path = self._files(generation)
+        vectors = open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(capacity, self._dim))
+        ids = open_memmap(ids_path, mode="w+", dtype=np.int64, shape=(capacity,))
+        return vectors, ids
+
+    def _remap(self):
+        generation = int(self._state[_GENERATION])
+        if generation != self._generation:
+            vectors_path, ids_path = self._files(generation)
+            self._vectors = np.load(vectors_path, mmap_mode="r+")
+            self._ids = np.load(ids_path, mmap_mode="r+")
+            self._generation = generation
+
+    def _grow(self, min_capacity: int):
+        """Copy into larger files under a new generation (caller holds the write lock)."""
+        count = int(self._state[_COUNT])
+        generation = self._generation + 1
+        vectors, ids = self._create_layout(generation, max(min_capacity, 2 * len(self._ids)))
+        vectors[:count] = self._vectors[:count]
+        ids[:count] = self._ids[:count]
+        # Readers still holding the old mapping keep working after the unlink
+        self._activate(generation, vectors, ids, count)
+
+    def _view(self) -> tuple[np.ndarray, np.ndarray]:
+        self._remap()
+        count = min(int(self._state[_COUNT]), len(self._ids))
+        return self._ids[:count], self._vectors[:count]
+
+    # ─── Writes ────────────────────────────────────────────────────
+
+    def upsert(self, book_id: int, vector: Sequence[float]):
+        row = _normalize(np.asarray(vector, dtype=np.float32))
+        with self._write_lock():
+            self._remap()
+            count = int(self._state[_COUNT])
+            slots = np.flatnonzero(self._ids[:count] == book_id)
+            if not len(slots):
+                # Reclaim a removed book's slot before appending
+                slots = np.flatnonzero(self._ids[:count] == 0)
+            if len(slots):
+                slot = int(slots[0])
+            else:
+                if count >= len(self._ids):
+                    self._grow(count + 1)
+                slot = count
+            self._vectors[slot] = row
+            self._ids[slot] = book_id
+            if slot == count:
+                self._state[_COUNT] = count + 1
+            self._state[_VERSION] += 1
+
+    def remove(self, book_id: int):
+        with self._write_lock():
+            self._remap()
+            count = int(self._state[_COUNT])
+            self._ids[:count][self._ids[:count] == book_id] = 0
+            self._state[_VERSION] += 1
+
+    def replace_all(self, book_ids: np.ndarray, vectors: np.ndarray):
+        """Swap in a complete new matrix (used when (re)loading from the database)."""
+        with self._write_lock():
+            self._load_locked(book_ids, vectors)
+
+    def _load_locked(self, book_ids: np.ndarray, vectors: np.ndarray):
+        count = len(book_ids)
+        generation = int(self._state[_GENERATION]) + 1
+        new_vectors, new_ids = self._create_layout(generation, max(self._initial_capacity, 2 * count))
+        new_vectors[:count] = _normalize(np.asarray(vectors, dtype=np.float32).reshape(count, self._dim))
+        new_ids[:count] = book_ids
+        self._activate(generation, new_vectors, new_ids, count)
+
+    def _activate(self, generation: int, vectors: np.ndarray, ids: np.ndarray, count: int):
+        """Publish a freshly written layout and drop the previous one."""
+        vectors.flush()
+        ids.flush()
+        old_generation = int(self._state[_GENERATION])
+        self._state[_COUNT] = count
+        self._state[_GENERATION] = generation
+        self._state[_VERSION] += 1
+        self._remap()
+        for old_path in self._files(old_generation):
+            if os.path.exists(old_path):
+                os.unlink(old_path)
+
+    def _source_path(self) -> str:
+        return os.path.join(self._path, "source.json")
+
+    def _read_source(self) -> Optional[dict]:
+        try:
+            with open(self._source_path()) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _write_source(self, source: dict):
+        partial = self._source_path() + ".tmp"
+        with open(partial, "w") as handle:
+            json.dump(source, handle)
+        os.replace(partial, self._source_path())
+
+    def sync_from_db(self, session_factory):
+        """Load every embedding from Postgres unless the replica was loaded from the same catalog."""
+        db = session_factory()
+        try:
+            with self._write_lock():
+                self._remap()
+                # Read before the rows: changes committed meanwhile make the next start reload
+                source = {
+                    "model": embedding_model_id(),
+                    "dimensions": self._dim,
+                    "catalog_generation": catalog_generation(db),
+                }
+                if self._read_source() == source and self._vectors.shape[1] == self._dim:
+                    logger.info("Vector store up to date (%d vectors).", len(self))
+                    return
+
+                expected = db.execute(
+                    text("SELECT COUNT(*) FROM book_embedding WHERE embedding IS NOT NULL")
+                ).scalar()
+                # Stream straight into the new files — never materialise the matrix twice
+                generation = int(self._state[_GENERATION]) + 1
+                vectors, ids = self._create_layout(
+                    generation, max(self._initial_capacity, 2 * expected)
+                )
+                rows = db.execute(
+                    text("SELECT id, embedding FROM book_embedding WHERE embedding IS NOT NULL ORDER BY id")
+                    .columns(id=Integer, embedding=Vector(self._dim)),
+                    execution_options={"stream_results": True, "yield_per": 1000},
+                )
+                loaded = 0
+                for book_id, embedding in rows:
+                    if loaded == len(ids):
+                        break
+                    ids[loaded] = book_id
+                    vectors[loaded] = _normalize(np.asarray(embedding, dtype=np.float32))
+                    loaded += 1
+                self._activate(generation, vectors, ids, loaded)
+                self._write_source(source)
+                logger.info("Vector store loaded %d vectors from the database.", loaded)
+        finally:
+            db.close()
+
+    # ─── Reads ─────────────────────────────────────────────────────
+
+    def __len__(self) -> int:
+        ids, _ = self._view()
+        return int(np.count_nonzero(ids))
+
+    def get(self, book_ids: Iterable[int]) -> dict[int, np.ndarray]:
+        ids, vectors = self._view()
+        wanted = np.fromiter(book_ids, dtype=np.int64)
+        slots = np.flatnonzero(np.isin(ids, wanted) & (ids > 0))
+        return {int(ids[slot]): np.array(vectors[slot]) for slot in slots}
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int,
+        exclude: Iterable[int] = (),
+        include: Optional[Iterable[int]] = None,
+    ) -> list[tuple[int, float]]:
+        return self.search_many(np.asarray([query], dtype=np.float32), k, [exclude], include)[0]
+
+    def search_many(
+        self,
+        queries: np.ndarray,
+        k: int,
+        exclude: Optional[Sequence[Iterable[int]]] = None,
+        include: Optional[Iterable[int]] = None,
+    ) -> list[list[tuple[int, float]]]:
+        """Top-k cosine neighbours for each query row (argpartition, no full sort).
+
+        ``include`` restricts every query to those book ids.
+        """
+        ids, vectors = self._view()
+        queries = _normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self._dim))
+        if len(ids) == 0 or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        scores = queries @ vectors.T
+        scores[:, ids <= 0] = -np.inf
+        if include is not None:
+            scores[:, ~np.isin(ids, np.fromiter(include, dtype=np.int64))] = -np.inf
+        for row, excluded in enumerate(exclude or ()):
+            excluded = np.fromiter(excluded, dtype=np.int64)
+            if len(excluded):
+                scores[row, np.isin(ids, excluded)] = -np.inf
+
+        top_k = min(k, len(ids))
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for row, slots in enumerate(candidates):
+            slots = slots[np.argsort(-scores[row, slots])]
+            results.append([
+                (int(ids[slot]), float(scores[row, slot]))
+                for slot in slots
+                if np.isfinite(scores[row, slot])
+            ])
+        return results
+
+
+_store: Optional[MmapVectorStore] = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> Optional[MmapVectorStore]:
+    """Return the process-wide store, or None when vector_engine is not "mmap"."""
+    global _store
+    if settings.vector_engine != "mmap":
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MmapVectorStore(
+                    settings.vector_store_path,
+                    settings.embedding_dimensions,
+                    settings.vector_store_initial_capacity,
+                )
+    return _store
@@ -31,8 +31,49 @@ def mock_rabbitmq():
 @pytest.fixture
 def client(mock_engine, mock_rabbitmq):
     """Create a test client with mocked dependencies."""
-    with patch("app.main.EmbeddingConsumer"):
+    with patch("app.main.EmbeddingConsumer"), patch("app.main.start_index_build"), \
+            patch("app.main.start_schema_index_build"), \
+            patch("app.main.start_popularity_refresher"), patch("app.main.start_collaborative_builder"), \
+            patch("app.main.start_neighbor_builder"), patch("app.main.start_embedding_workers"):
         with patch("app.database.Base.metadata.create_all"):
             from app.main import app
             with TestClient(app) as c:
                 yield c
+
+
+@pytest.fixture(autouse=True)
+def isolated_embedding_cache():
+    """Keep cached embeddings from leaking between tests; no database tier."""
+    from app.config import settings
+    from app.embedding_cache import embedding_cache
+
+    embedding_cache.clear()
+    with patch.object(settings, "embedding_cache_persist", False):
+        yield
+    embedding_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_result_cache():
+    """Start every test with an empty /similar result cache."""
+    from app.result_cache import result_cache
+
+    if result_cache is not None:
+        result_cache.clear()
+    yield
+    if result_cache is not None:
+        result_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_search_cache():
+    """Empty /search query cache at a fixed catalog generation (no database read)."""
+    from app.search_cache import search_cache
+
+    if search_cache is None:
+        yield
+        return
+    search_cache.clear()
+    with patch.object(search_cache, "_read_generation", return_value=0):
+        yield
+    search_cache.clear()
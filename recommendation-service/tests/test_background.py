@@ -0,0 +1,23 @@
+"""Tests for the shared periodic job runner."""
+
+from unittest.mock import MagicMock
+
+from app.background import start_periodic
+
+
+class TestStartPeriodic:
+    def test_runs_once_without_interval(self):
+        job = MagicMock()
+
+        start_periodic("test-job", job, 0, "Test job").join(timeout=5)
+
+        job.assert_called_once_with()
+
+    def test_failure_is_logged_not_raised(self, caplog):
+        job = MagicMock(side_effect=RuntimeError("boom"))
+
+        thread = start_periodic("test-job", job, 0, "Test job")
+        thread.join(timeout=5)
+
+        assert not thread.is_alive()
+        assert "Test job failed: boom" in caplog.text
@@ -0,0 +1,119 @@
+"""Tests for the item-item collaborative filtering model and /for-user strategies."""
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from app.collaborative import ItemItemModel, count_cooccurrences, dump_model, load_model
+from app.database import get_db
+from app.vector_search import ScoredBook
+
+# (user, book): users 1 and 2 read 10 and 11, user 3 read 10 and 12
+INTERACTIONS = [(1, 10), (1, 11), (2, 10), (2, 11), (3, 10), (3, 12)]
+
+
+def _full_counts(pairs=INTERACTIONS):
+    users, books = zip(*pairs)
+    return count_cooccurrences(users, books, [True] * len(pairs))
+
+
+class TestCooccurrence:
+    def test_counts_users_per_book_and_pair(self):
+        counts = _full_counts()
+
+        assert counts.item_ids.tolist() == [10, 11, 12]
+        assert counts.item_users.tolist() == [3, 2, 1]
+        assert counts.pair_users.tolist() == [2, 1]  # (10, 11), (10, 12)
+
+    def test_incremental_fold_equals_full_build(self):
+        first = _full_counts(INTERACTIONS[:3])
+        # New pairs of users 2 and 3 plus the earlier books of those users (user 2: book 10)
+        delta = count_cooccurrences([2, 3, 3, 2], [11, 10, 12, 10], [True, True, True, False])
+
+        merged = first.merge(delta)
+
+        for got, expected in zip(merged, _full_counts()):
+            assert np.array_equal(got, expected)
+
+
+class TestItemItemModel:
+    def test_keeps_top_neighbours_with_normalised_scores(self):
+        model = ItemItemModel.build(_full_counts(), neighbours=1)
+
+        assert model.items.tolist() == [10, 11, 12]
+        assert model.indptr.tolist() == [0, 1, 2, 3]
+        assert model.neighbours.tolist() == [11, 10, 10]
+        assert np.isclose(model.scores[0], 2 / np.sqrt(3 * 2))
+
+    def test_recommend_sums_weighted_scores_and_excludes_history(self):
+        model = ItemItemModel.build(_full_counts(), neighbours=10)
+
+        hits = model.recommend([11], [2.0], limit=5, exclude=[11])
+
+        assert [book_id for book_id, _ in hits] == [10]
+        assert np.isclose(hits[0][1], 2.0 * 2 / np.sqrt(6))
+        assert model.recommend([99], [1.0], limit=5) == []
+
+    def test_serialised_model_round_trips(self):
+        model = ItemItemModel.build(_full_counts(), neighbours=10)
+
+        loaded = load_model(dump_model(model), version=7)
+
+        assert loaded.version == 7
+        assert np.array_equal(loaded.neighbours, model.neighbours)
+        assert np.array_equal(loaded.scores, model.scores)
+
+
+class TestStrategies:
+    def _request(self, client, url, model, profile=None, content=()):
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.first.return_value = profile
+        if profile is not None:
+            mock_session.query.return_value.filter.return_value.scalar.return_value = profile.interaction_count
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+        hydrated = {
+            10: ScoredBook(10, "Dune", "Herbert", "SF", None, 0.0),
+            12: ScoredBook(12, "Hyperion", "Simmons", "SF", None, 0.0),
+        }
+        try:
+            with patch("app.routes.recommendations.get_collaborative_model", return_value=model), \
+                    patch("app.routes.recommendations.user_history", return_value=([11], [1.0])), \
+                    patch("app.routes.recommendations.hydrate",
+                          side_effect=lambda db, hits: [hydrated[i]._replace(similarity=s) for i, s in hits]), \
+                    patch("app.routes.recommendations._content_results", return_value=list(content)):
+                return client.get(url).json()
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+    def test_collaborative_strategy_ranks_by_cooccurrence(self, client):
+        model = ItemItemModel.build(_full_counts(), neighbours=10)
+
+        body = self._request(client, "/api/recommendations/for-user/2?strategy=collaborative", model)
+
+        assert body["strategy"] == "collaborative"
+        assert body["books_used"] == 1
+        assert [r["book_id"] for r in body["recommendations"]] == [10]
+
+    def test_blended_strategy_fuses_both_rankings(self, client):
+        model = ItemItemModel.build(_full_counts(), neighbours=10)
+        content = [ScoredBook(12, "Hyperion", "Simmons", "SF", None, 0.8)]
+
+        body = self._request(
+            client, "/api/recommendations/for-user/2?strategy=blended", model,
+            profile=MagicMock(user_id=2, interaction_count=2), content=content,
+        )
+
+        assert body["strategy"] == "blended"
+        assert {r["book_id"] for r in body["recommendations"]} == {10, 12}
+        assert next(r for r in body["recommendations"] if r["book_id"] == 12)["similarity"] == 0.8
+
+    def test_falls_back_to_content_based_without_a_model(self, client):
+        content = [ScoredBook(12, "Hyperion", "Simmons", "SF", None, 0.8)]
+
+        body = self._request(
+            client, "/api/recommendations/for-user/2?strategy=collaborative", None,
+            profile=MagicMock(user_id=2, interaction_count=2), content=content,
+        )
+
+        assert body["strategy"] == "content_based"
+        assert body["recommendations"][0]["book_id"] == 12
@@ -57,6 +57,16 @@ class TestEmbeddingConsumerPersistence:
         db.commit.assert_called_once()
         db.close.assert_called_once()
 
+    def test_book_created_is_flushed_for_later_events_in_the_batch(self):
+        db = MagicMock()
+        db.query.return_value.filter_by.return_value.first.return_value = None
+
+        with patch("app.consumer.SessionLocal", return_value=db):
+            EmbeddingConsumer()._handle_book_upsert({"book_id": 42, "title": "Dune"})
+
+        calls = [name for name, _, _ in db.mock_calls if name in ("add", "flush", "commit")]
+        assert calls == ["add", "flush", "commit"]
+
     def test_user_interaction_maps_rating_event(self):
         db = MagicMock()
 
@@ -73,3 +83,81 @@ class TestEmbeddingConsumerPersistence:
         assert interaction.rating == 5
         db.commit.assert_called_once()
         db.close.assert_called_once()
+
+
+class TestEmbeddingConsumerConcurrency:
+    """Test batched, concurrent processing and cumulative acknowledgements."""
+
+    def test_ack_tracker_waits_for_contiguous_tags(self):
+        from app.consumer import _AckTracker
+
+        tracker = _AckTracker()
+        for tag in (1, 2, 3, 4):
+            tracker.delivered(tag)
+
+        assert tracker.settle([2, 3], []) is None
+        assert tracker.settle([1], []) == 3
+        # A nacked tag is settled but never acked itself
+        assert tracker.settle([], [4]) is None
+
+    def test_dispatch_keeps_same_book_on_same_worker(self):
+        import queue
+
+        consumer = EmbeddingConsumer()
+        consumer._worker_queues = [queue.Queue() for _ in range(4)]
+        consumer._tracker = MagicMock()
+        channel = MagicMock()
+
+        for tag, body in enumerate([b'{"book_id": 7}', b'{"book_id": 9}', b'{"book_id": 7}'], start=1):
+            method = MagicMock(routing_key="book.updated", delivery_tag=tag)
+            consumer._dispatch(channel, method, MagicMock(timestamp=None), body)
+
+        book_7 = consumer._worker_queues[hash(7) % 4]
+        tags = [book_7.get_nowait()[2].delivery_tag for _ in range(book_7.qsize())]
+        assert tags[0] == 1 and tags[-1] == 3
+
+    def test_process_batch_commits_once_for_whole_batch(self):
+        from app.consumer import _Delivery
+
+        db = MagicMock()
+        consumer = EmbeddingConsumer()
+        deliveries = [
+            _Delivery(1, "rating.created", {"user_id": 1, "book_id": 2, "rating": 4}, None),
+            _Delivery(2, "favorite.added", {"user_id": 1, "book_id": 3}, None),
+        ]
+
+        with patch("app.consumer.SessionLocal", return_value=db):
+            succeeded, failed = consumer._process_batch(deliveries)
+
+        assert (succeeded, failed) == ([1, 2], [])
+        assert db.add.call_count == 2
+        db.commit.assert_called_once()
+
+    def test_process_batch_isolates_poison_message(self):
+        from app.consumer import _Delivery
+
+        consumer = EmbeddingConsumer()
+        deliveries = [
+            _Delivery(1, "favorite.added", {"user_id": 1, "book_id": 3}, None),
+            _Delivery(2, "favorite.added", {"book_id": 3}, None),  # missing user_id
+        ]
+
+        with patch("app.consumer.SessionLocal", return_value=MagicMock()):
+            succeeded, failed = consumer._process_batch(deliveries)
+
+        assert succeeded == [1]
+        assert failed == [2]
+
+    def test_settle_nacks_failures_then_acks_multiple(self):
+        from app.consumer import _AckTracker
+
+        tracker = _AckTracker()
+        for tag in (1, 2, 3):
+            tracker.delivered(tag)
+        channel = MagicMock()
+        channel.is_open = True
+
+        EmbeddingConsumer._settle(channel, tracker, [1, 3], [2])
+
+        channel.basic_nack.assert_called_once_with(delivery_tag=2, requeue=False)
+        channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
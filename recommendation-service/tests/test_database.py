@@ -0,0 +1,70 @@
+"""Tests for connection pool sizing and the async query runner."""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.config import settings
+from app.database import QueryRunner, async_database_url, get_async_db, pool_limits
+
+
+class TestPoolLimits:
+    def test_budget_is_split_across_workers(self):
+        with patch.object(settings, "db_max_connections", 80), patch.object(settings, "web_workers", 4):
+            limits = pool_limits()
+        assert (limits["pool_size"], limits["max_overflow"]) == (10, 10)
+
+    def test_budget_is_split_across_engines(self):
+        with patch.object(settings, "db_max_connections", 80), patch.object(settings, "web_workers", 2):
+            limits = pool_limits(engines=2)
+        assert limits["pool_size"] + limits["max_overflow"] == 20
+
+    def test_explicit_sizes_win(self):
+        with patch.object(settings, "db_pool_size", 3), patch.object(settings, "db_max_overflow", 0):
+            limits = pool_limits()
+        assert (limits["pool_size"], limits["max_overflow"]) == (3, 0)
+
+
+class TestAsyncDatabaseUrl:
+    def test_derived_from_database_url(self):
+        with patch.object(settings, "database_url", "postgresql://u:secret@db:5432/rec"), \
+                patch.object(settings, "async_database_url", ""):
+            assert async_database_url() == "postgresql+asyncpg://u:secret@db:5432/rec"
+
+    def test_explicit_url(self):
+        with patch.object(settings, "async_database_url", "postgresql+asyncpg://other/rec"):
+            assert async_database_url() == "postgresql+asyncpg://other/rec"
+
+
+class TestQueryRunner:
+    def test_runs_on_async_session(self):
+        async_db = MagicMock()
+        async_db.run_sync = AsyncMock(return_value=["row"])
+        fn = MagicMock()
+
+        result = asyncio.run(QueryRunner(MagicMock(), async_db)(fn, 1, 2))
+
+        assert result == ["row"]
+        async_db.run_sync.assert_awaited_once_with(fn, 1, 2)
+        fn.assert_not_called()
+
+    def test_falls_back_to_sync_session(self):
+        db = MagicMock()
+        fn = MagicMock(return_value=["row"])
+
+        assert asyncio.run(QueryRunner(db)(fn, 1)) == ["row"]
+        fn.assert_called_once_with(db, 1)
+
+    def test_threaded_calls_skip_the_async_session(self):
+        db, async_db = MagicMock(), MagicMock()
+        async_db.run_sync = AsyncMock()
+        fn = MagicMock(return_value=["row"])
+
+        assert asyncio.run(QueryRunner(db, async_db)(fn, 1, threaded=True)) == ["row"]
+        fn.assert_called_once_with(db, 1)
+        async_db.run_sync.assert_not_awaited()
+
+    def test_no_async_session_without_database_async(self):
+        async def first():
+            return await get_async_db().__anext__()
+
+        assert asyncio.run(first()) is None
@@ -0,0 +1,146 @@
+"""Tests for the embedding work queue (app.embedding_worker) and its consumer side."""
+
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+from app.consumer import EmbeddingConsumer
+from app.embedding import text_fingerprint
+from app.embedding_worker import COMPLETE_SQL, FAIL_SQL, process_jobs
+
+ENQUEUED = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _future(result=None, error=None) -> Future:
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def _run(claimed, books, written, submit):
+    db = MagicMock()
+    db.execute.return_value.fetchall.side_effect = [claimed, books, written]
+    with patch("app.embedding_worker.SessionLocal", return_value=db), \
+            patch("app.embedding_worker.embedding_batcher") as batcher, \
+            patch("app.embedding_worker.result_cache") as cache, \
+            patch("app.embedding_worker.get_vector_store", return_value=None), \
+            patch("app.embedding_worker.reweigh_readers") as rebuild:
+        batcher.submit.side_effect = submit
+        count = process_jobs()
+    statements = {call.args[0].text: call.args[1] for call in db.execute.call_args_list if len(call.args) > 1}
+    statements["rebuilt"] = [call.args[1:] for call in rebuild.call_args_list]
+    return count, statements, cache
+
+
+class TestConsumerEnqueues:
+    def test_upsert_commits_metadata_and_enqueues_without_embedding(self):
+        db = MagicMock()
+        db.query.return_value.filter_by.return_value.first.return_value = None
+
+        with patch("app.consumer.SessionLocal", return_value=db), \
+                patch("app.consumer.enqueue_embedding") as enqueue, \
+                patch("app.embedding_worker.embedding_batcher") as batcher:
+            EmbeddingConsumer()._handle_book_upsert({"book_id": 10, "title": "Dune", "description": "Spice"})
+
+        book = db.add.call_args.args[0]
+        assert book.title == "Dune" and book.embedding_stale is True
+        enqueue.assert_called_once_with(db, 10)
+        batcher.submit.assert_not_called()
+        db.commit.assert_called_once()
+
+    def test_metadata_only_change_keeps_the_vector(self):
+        db = MagicMock()
+        db.query.return_value.filter_by.return_value.first.return_value = MagicMock(
+            title="Dune", description="Spice", embedding=[0.1], text_hash=text_fingerprint("Dune\n\nSpice")
+        )
+
+        with patch("app.consumer.SessionLocal", return_value=db), \
+                patch("app.consumer.enqueue_embedding") as enqueue:
+            EmbeddingConsumer()._handle_book_upsert(
+                {"book_id": 10, "title": "Dune", "description": "Spice", "category": "SF"}
+            )
+
+        enqueue.assert_not_called()
+
+    def test_reverted_text_drops_the_pending_job(self):
+        db = MagicMock()
+        book = MagicMock(title="Dune (draft)", description="Spice", embedding=[0.1], embedding_stale=True,
+                         text_hash=text_fingerprint("Dune\n\nSpice"))
+        db.query.return_value.filter_by.return_value.first.return_value = book
+
+        with patch("app.consumer.SessionLocal", return_value=db), \
+                patch("app.consumer.enqueue_embedding") as enqueue:
+            EmbeddingConsumer()._handle_book_upsert({"book_id": 10, "title": "Dune", "description": "Spice"})
+
+        enqueue.assert_not_called()
+        assert book.embedding_stale is False
+        assert any("embedding_job" in str(call.args[0]) for call in db.execute.call_args_list)
+
+
+class TestProcessJobs:
+    def test_writes_vectors_of_jobs_still_current(self):
+        claimed = [MagicMock(book_id=1, enqueued_at=ENQUEUED, attempts=1),
+                   MagicMock(book_id=2, enqueued_at=ENQUEUED, attempts=1)]
+        books = [MagicMock(id=1, title="Dune", description=""), MagicMock(id=2, title="", description="")]
+
+        count, statements, cache = _run(
+            claimed, books, [MagicMock(id=1, previous=None), MagicMock(id=2, previous=None)],
+            lambda body: _future([1.0, 0.0]),
+        )
+
+        assert count == 2
+        values = statements[COMPLETE_SQL]
+        assert values["ids"] == [1, 2]
+        # Book 2 has no text: completed without a vector
+        assert values["vecs"][0] is not None and values["vecs"][1] is None
+        assert FAIL_SQL not in statements
+        # Only the book that got a vector moves its readers' profiles
+        ((changes,),) = statements["rebuilt"]
+        assert list(changes) == [1] and changes[1][0] is None
+        cache.invalidate.assert_called_once_with(1, reembedded=True)
+
+    def test_api_errors_reschedule_with_backoff(self):
+        claimed = [MagicMock(book_id=1, enqueued_at=ENQUEUED, attempts=3)]
+        books = [MagicMock(id=1, title="Dune", description="Spice")]
+
+        count, statements, cache = _run(claimed, books, [], lambda body: _future(error=TimeoutError("slow")))
+
+        assert count == 1
+        assert COMPLETE_SQL not in statements
+        assert statements[FAIL_SQL]["ids"] == [1] and statements[FAIL_SQL]["error"] == "slow"
+        cache.invalidate.assert_not_called()
+
+    def test_exhausted_jobs_are_parked(self):
+        claimed = [MagicMock(book_id=1, enqueued_at=ENQUEUED, attempts=20)]
+        books = [MagicMock(id=1, title="Dune", description="Spice" * 10000)]
+
+        with patch("app.embedding_worker.EMBEDDING_JOBS") as jobs:
+            _, statements, _ = _run(claimed, books, [], lambda body: _future(error=ValueError("too long")))
+
+        assert statements[FAIL_SQL]["max_attempts"] == 20
+        assert "'infinity'" in FAIL_SQL and "LEAST(j.attempts, 20)" in FAIL_SQL
+        jobs.labels.assert_any_call(outcome="parked")
+        jobs.labels.return_value.inc.assert_any_call(1)
+
+    def test_text_matching_the_stored_fingerprint_skips_the_api(self):
+        claimed = [MagicMock(book_id=1, enqueued_at=ENQUEUED, attempts=1)]
+        books = [MagicMock(id=1, title="Dune", description="Spice", embedded=True,
+                           text_hash=text_fingerprint("Dune  \n\n Spice"))]
+        submit = MagicMock()
+
+        count, statements, cache = _run(claimed, books, [MagicMock(id=1)], submit)
+
+        submit.assert_not_called()
+        assert statements[COMPLETE_SQL]["vecs"] == [None]
+        cache.invalidate.assert_not_called()
+
+    def test_nothing_due_claims_nothing(self):
+        db = MagicMock()
+        db.execute.return_value.fetchall.return_value = []
+
+        with patch("app.embedding_worker.SessionLocal", return_value=db):
+            assert process_jobs() == 0
+        assert db.execute.call_count == 1
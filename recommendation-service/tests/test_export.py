@@ -0,0 +1,85 @@
+"""Tests for the streaming export (app.export)."""
+
+import io
+import json
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from app.config import settings
+from app.export import embeddings_ndjson, embeddings_npy, interactions_ndjson
+
+
+def _row(**fields):
+    row = MagicMock(**fields)
+    row._mapping = fields
+    return row
+
+
+def _engine(rows, count=None):
+    """Engine whose server-side result yields ``rows`` in partitions of two."""
+    conn = MagicMock()
+    conn.execute.return_value.scalar.return_value = count
+    streamed = conn.execution_options.return_value.execute.return_value
+    streamed.partitions.side_effect = lambda: iter([rows[i:i + 2] for i in range(0, len(rows), 2)])
+    bind = MagicMock()
+    bind.connect.return_value.execution_options.return_value.__enter__.return_value = conn
+    return bind, conn
+
+
+class TestNdjson:
+    def test_vectors_are_spliced_in_verbatim(self):
+        bind, conn = _engine([
+            _row(id=1, title="Dune", author=None, category="SF", description=None, text_hash=None, embedding="[0.5,1]"),
+            _row(id=2, title="Draft", author=None, category=None, description=None, text_hash=None, embedding=None),
+        ])
+
+        lines = b"".join(embeddings_ndjson(bind, after_id=0)).decode().splitlines()
+
+        assert [json.loads(line) for line in lines] == [
+            {"id": 1, "title": "Dune", "author": None, "category": "SF", "description": None,
+             "text_hash": None, "embedding": [0.5, 1]},
+            {"id": 2, "title": "Draft", "author": None, "category": None, "description": None,
+             "text_hash": None, "embedding": None},
+        ]
+        assert conn.execution_options.call_args.kwargs == {"yield_per": 2000}
+
+    def test_interactions_serialise_timestamps(self):
+        at = datetime(2026, 5, 1, 12, 30)
+        bind, _ = _engine([_row(id=9, user_id=1, book_id=2, interaction_type="rate", rating=4.0, created_at=at)])
+
+        (line,) = b"".join(interactions_ndjson(bind, after_id=8)).decode().splitlines()
+
+        assert json.loads(line)["created_at"] == "2026-05-01T12:30:00"
+
+
+class TestNpy:
+    def test_streams_a_loadable_structured_array(self):
+        vectors = np.random.default_rng(1).normal(size=(3, settings.embedding_dimensions)).astype(np.float32)
+        rows = [_row(id=i, embedding="[" + ",".join(map(str, v.tolist())) + "]") for i, v in enumerate(vectors, 1)]
+        bind, _ = _engine(rows, count=3)
+
+        loaded = np.load(io.BytesIO(b"".join(embeddings_npy(bind))))
+
+        assert loaded["id"].tolist() == [1, 2, 3]
+        assert np.allclose(loaded["embedding"], vectors)
+        bind.connect.return_value.execution_options.assert_called_with(isolation_level="REPEATABLE READ")
+
+
+class TestExportRoute:
+    def test_disabled_by_default(self, client):
+        assert client.get("/api/export/embeddings").status_code == 404
+
+    def test_streams_when_enabled(self, client):
+        exporter = MagicMock(return_value=iter([b"{}\n"]))
+        with patch.object(settings, "export_api_enabled", True), \
+                patch.dict("app.routes.export.EXPORTERS", {("interactions", "ndjson"): exporter}):
+            response = client.get("/api/export/interactions?after_id=5")
+            unsupported = client.get("/api/export/interactions?format=npy")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert response.text == "{}\n"
+        assert exporter.call_args.args[1] == 5
+        assert unsupported.status_code == 404
@@ -0,0 +1,80 @@
+"""Tests for hybrid lexical + semantic search."""
+
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+from tenacity import RetryError
+
+from app.database import get_db
+from app.hybrid_search import LexicalHit, is_confident, reciprocal_rank_fusion
+
+
+def _lexical(book_id, trigram=0.2):
+    return LexicalHit(book_id, f"T{book_id}", None, None, None, 0.1, trigram)
+
+
+def _semantic(book_id, similarity):
+    return MagicMock(id=book_id, title=f"T{book_id}", author=None, category=None,
+                     description=None, similarity=similarity)
+
+
+class TestRankFusion:
+    def test_books_found_by_both_rankings_win(self):
+        fused = reciprocal_rank_fusion(
+            [_lexical(1), _lexical(2)], [_semantic(2, 0.9), _semantic(3, 0.8)], limit=3
+        )
+
+        assert [hit.id for hit in fused] == [2, 1, 3]
+        assert fused[0].similarity == 0.9
+        assert fused[1].similarity is None
+
+    def test_confidence_needs_a_near_exact_top_match(self):
+        assert is_confident([_lexical(1, trigram=0.95)])
+        assert not is_confident([_lexical(1, trigram=0.4)])
+        assert not is_confident([])
+
+
+class TestHybridSearchEndpoint:
+    def _get(self, client, url, lexical, embedding):
+        client.app.dependency_overrides[get_db] = lambda: MagicMock()
+        try:
+            with patch("app.routes.recommendations.lexical_search", return_value=lexical), \
+                    patch("app.routes.recommendations.aget_embedding", embedding), \
+                    patch("app.routes.recommendations._search_by_vector",
+                          return_value=[_semantic(7, 0.8)]):
+                return client.get(url)
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+    def test_confident_title_match_skips_the_embedding_call(self, client):
+        embedding = AsyncMock(return_value=[0.1])
+        response = self._get(
+            client, "/api/recommendations/search?q=Dune&mode=hybrid", [_lexical(1, 0.9)], embedding
+        )
+
+        assert response.json()["path"] == "lexical"
+        assert [r["book_id"] for r in response.json()["results"]] == [1]
+        embedding.assert_not_awaited()
+
+    def test_weak_lexical_match_is_fused_with_vector_results(self, client):
+        embedding = AsyncMock(return_value=[0.1])
+        response = self._get(
+            client, "/api/recommendations/search?q=space+opera&mode=hybrid", [_lexical(1)], embedding
+        )
+
+        body = response.json()
+        assert body["path"] == "hybrid"
+        assert {r["book_id"] for r in body["results"]} == {1, 7}
+        embedding.assert_awaited_once()
+
+    @pytest.mark.parametrize("error", [RetryError(MagicMock()), httpx.ConnectError("down")])
+    def test_embedding_outage_falls_back_to_lexical_hits(self, client, error):
+        embedding = AsyncMock(side_effect=error)
+        response = self._get(
+            client, "/api/recommendations/search?q=space+opera&mode=hybrid", [_lexical(1)], embedding
+        )
+
+        assert response.status_code == 200
+        assert response.json()["path"] == "lexical"
+        assert [r["book_id"] for r in response.json()["results"]] == [1]
@@ -0,0 +1,132 @@
+"""Tests for buffered COPY ingestion of user interactions."""
+
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import psycopg2
+
+from app.ingest import InteractionBuffer, copy_rows, interaction_row
+
+
+class TestInteractionRow:
+    """Test event → row mapping."""
+
+    def test_uses_event_envelope_timestamp_in_utc(self):
+        row = interaction_row(
+            "loan.borrowed",
+            {"user_id": 3, "book_id": 9, "_meta": {"timestamp": "2025-03-01T12:00:00+02:00"}},
+        )
+        assert row.interaction_type == "borrow"
+        assert row.created_at == datetime(2025, 3, 1, 10, 0, 0)
+        assert row.rating is None
+
+    def test_copy_writes_csv_with_null_rating(self):
+        cursor = MagicMock()
+        row = interaction_row("rating.created", {"user_id": 1, "book_id": 2, "rating": 4})
+        copy_rows(cursor, [row, row._replace(rating=None)])
+
+        sql, data = cursor.copy_expert.call_args.args
+        lines = data.getvalue().splitlines()
+        assert sql.startswith("COPY user_interaction")
+        assert lines[0].startswith("1,2,rate,4.0,")
+        assert lines[1].startswith("1,2,rate,,")
+
+
+class TestInteractionBuffer:
+    """Test flushing and settlement of buffered rows."""
+
+    def _connection(self):
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        return connection, cursor
+
+    def test_flush_copies_all_rows_then_settles_tokens(self):
+        settled = MagicMock()
+        buffer = InteractionBuffer(settled, flush_size=10, flush_interval_ms=1000)
+        connection, cursor = self._connection()
+        for tag in (1, 2, 3):
+            buffer.add(interaction_row("favorite.added", {"user_id": tag, "book_id": 5}), tag)
+
+        with patch("app.ingest.engine") as engine:
+            engine.raw_connection.return_value = connection
+            buffer.flush()
+
+        cursor.copy_expert.assert_called_once()
+        connection.commit.assert_called_once()
+        settled.assert_called_once_with([1, 2, 3], [])
+
+    def test_failed_copy_falls_back_to_row_inserts(self):
+        settled = MagicMock()
+        buffer = InteractionBuffer(settled, flush_size=10, flush_interval_ms=1000)
+        connection, cursor = self._connection()
+        cursor.copy_expert.side_effect = psycopg2.DataError("bad row")
+        cursor.execute.side_effect = [None, psycopg2.IntegrityError("bad row")]
+        buffer.add(interaction_row("favorite.added", {"user_id": 1, "book_id": 5}), "ok")
+        buffer.add(interaction_row("favorite.added", {"user_id": 2, "book_id": 5}), "bad")
+
+        with patch("app.ingest.engine") as engine, patch("app.ingest.apply_derived"):
+            engine.raw_connection.return_value = connection
+            buffer.flush()
+
+        settled.assert_called_once_with(["ok"], ["bad"])
+
+    def test_unreachable_database_keeps_rows_for_retry(self):
+        settled = MagicMock()
+        buffer = InteractionBuffer(settled, flush_size=10, flush_interval_ms=1000)
+        buffer.add(interaction_row("favorite.added", {"user_id": 1, "book_id": 5}), "tag")
+
+        with patch("app.ingest.engine") as engine:
+            engine.raw_connection.side_effect = RuntimeError("db down")
+            buffer.flush()
+
+        settled.assert_not_called()
+        assert len(buffer._rows) == 1
+
+    def test_lost_connection_keeps_rows_instead_of_dead_lettering(self):
+        settled = MagicMock()
+        buffer = InteractionBuffer(settled, flush_size=10, flush_interval_ms=1000)
+        connection, cursor = self._connection()
+        cursor.copy_expert.side_effect = psycopg2.OperationalError("server closed the connection")
+        buffer.add(interaction_row("favorite.added", {"user_id": 1, "book_id": 5}), "tag")
+
+        with patch("app.ingest.engine") as engine:
+            engine.raw_connection.return_value = connection
+            buffer.flush()
+
+        settled.assert_not_called()
+        cursor.execute.assert_not_called()
+        assert [token for _, token in buffer._rows] == ["tag"]
+
+    def test_connection_lost_mid_isolation_settles_written_rows_and_keeps_the_rest(self):
+        settled = MagicMock()
+        buffer = InteractionBuffer(settled, flush_size=10, flush_interval_ms=1000)
+        connection, cursor = self._connection()
+        cursor.copy_expert.side_effect = psycopg2.DataError("bad row")
+        cursor.execute.side_effect = [None, psycopg2.InterfaceError("connection already closed")]
+        for tag in ("written", "pending-1", "pending-2"):
+            buffer.add(interaction_row("favorite.added", {"user_id": 1, "book_id": 5}), tag)
+
+        with patch("app.ingest.engine") as engine, patch("app.ingest.apply_derived"):
+            engine.raw_connection.return_value = connection
+            buffer.flush()
+
+        settled.assert_called_once_with(["written"], [])
+        assert [token for _, token in buffer._rows] == ["pending-1", "pending-2"]
+
+    def test_rows_of_closed_channels_are_dropped_before_writing(self):
+        settled = MagicMock()
+        closed = {"old"}
+        buffer = InteractionBuffer(
+            settled, flush_size=10, flush_interval_ms=1000, is_live=lambda token: token not in closed
+        )
+        connection, cursor = self._connection()
+        buffer.add(interaction_row("favorite.added", {"user_id": 1, "book_id": 5}), "old")
+        buffer.add(interaction_row("favorite.added", {"user_id": 2, "book_id": 5}), "new")
+
+        with patch("app.ingest.engine") as engine, patch("app.ingest.copy_rows") as copy, \
+                patch("app.ingest.apply_derived"):
+            engine.raw_connection.return_value = connection
+            buffer.flush()
+
+        assert [row.user_id for row in copy.call_args.args[1]] == [2]
+        settled.assert_called_once_with(["new"], [])
@@ -0,0 +1,63 @@
+"""Tests for the local embedding backend (app.local_embedding)."""
+
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.local_embedding import LocalEmbedder
+
+
+def _model(dimensions):
+    model = MagicMock()
+    model.get_sentence_embedding_dimension.return_value = dimensions
+    model.encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), dimensions), dtype=np.float64)
+    return model
+
+
+class TestLocalEmbedder:
+    def test_requires_the_optional_package(self):
+        with patch("app.local_embedding.SentenceTransformer", None), \
+                pytest.raises(RuntimeError, match="sentence-transformers"):
+            LocalEmbedder("any-model")
+
+    def test_rejects_a_model_of_another_dimension(self):
+        with patch("app.local_embedding.SentenceTransformer", return_value=_model(384)), \
+                pytest.raises(RuntimeError, match="384-dimensional"):
+            LocalEmbedder("all-MiniLM-L6-v2")
+
+    def test_encodes_normalised_batches(self):
+        model = _model(settings.embedding_dimensions)
+        with patch("app.local_embedding.SentenceTransformer", return_value=model) as load:
+            embedder = LocalEmbedder("local-model", onnx=True, batch_size=8)
+
+        vectors = asyncio.run(embedder.aembed(["a", "b"]))
+
+        assert load.call_args.kwargs == {"device": "cpu", "backend": "onnx"}
+        assert len(vectors) == 2 and len(vectors[0]) == settings.embedding_dimensions
+        assert model.encode.call_args.kwargs["normalize_embeddings"] is True
+        assert model.encode.call_args.kwargs["batch_size"] == 8
+
+
+class TestLocalBackendSelection:
+    def test_get_embedding_uses_the_local_model_without_an_api_key(self):
+        from app.embedding import get_embedding
+
+        embedder = MagicMock()
+        embedder.embed.return_value = [[0.5] * 4]
+        with patch.object(settings, "embedding_backend", "local"), \
+                patch("app.embedding.get_local_embedder", return_value=embedder), \
+                patch("app.embedding.httpx.post") as post:
+            assert get_embedding("offline text") == [0.5] * 4
+
+        post.assert_not_called()
+        embedder.embed.assert_called_once_with(["offline text"])
+
+    def test_cache_entries_are_keyed_by_backend_model(self):
+        from app.embedding import embedding_model_id
+
+        with patch.object(settings, "embedding_backend", "local"):
+            assert embedding_model_id() == f"local:{settings.local_embedding_model}"
+        assert embedding_model_id() == settings.openai_model
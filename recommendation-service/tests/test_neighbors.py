@@ -0,0 +1,120 @@
+"""Tests for precomputed neighbour lists (app.neighbors)."""
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from app.neighbors import Catalog, _normalize, _refresh_dirty, precomputed_neighbors, reached_floor, top_neighbors
+from app.vector_search import SearchFilters, vector_literal
+
+K = 3
+
+
+def _catalog(size=40, dimensions=8, seed=3):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, size + 1, dtype=np.int64) * 10
+    vectors = _normalize(rng.normal(size=(size, dimensions)).astype(np.float32))
+    _, similarities = top_neighbors(ids, vectors, ids, vectors, K, batch_size=7)
+    return Catalog(1, ids, vectors, similarities[:, K - 1].copy())
+
+
+def _lists(catalog):
+    neighbor_ids, _ = top_neighbors(catalog.ids, catalog.vectors, catalog.ids, catalog.vectors, K, batch_size=64)
+    return {int(book_id): row.tolist() for book_id, row in zip(catalog.ids, neighbor_ids)}
+
+
+def _copied(cursor) -> dict[int, list[int]]:
+    lists: dict[int, list[int]] = {}
+    for line in cursor.copy_expert.call_args.args[1].getvalue().splitlines():
+        book_id, _, neighbor_id, _ = line.split("\t")
+        lists.setdefault(int(book_id), []).append(int(neighbor_id))
+    return lists
+
+
+class TestTopNeighbors:
+    def test_matches_brute_force_ranking_without_self(self):
+        catalog = _catalog()
+
+        neighbor_ids, similarities = top_neighbors(
+            catalog.ids[:5], catalog.vectors[:5], catalog.ids, catalog.vectors, K, batch_size=2
+        )
+
+        scores = catalog.vectors[:5] @ catalog.vectors.T
+        np.fill_diagonal(scores[:, :5], -np.inf)
+        expected = catalog.ids[np.argsort(-scores, axis=1)[:, :K]]
+        assert np.array_equal(neighbor_ids, expected)
+        assert np.all(np.diff(similarities, axis=1) <= 0)
+
+    def test_short_catalog_yields_shorter_lists(self):
+        ids = np.array([1, 2], dtype=np.int64)
+        vectors = _normalize(np.eye(2, dtype=np.float32))
+
+        neighbor_ids, _ = top_neighbors(ids, vectors, ids, vectors, K, batch_size=8)
+
+        assert neighbor_ids.tolist() == [[2], [1]]
+
+    def test_reached_floor_flags_lists_a_vector_would_enter(self):
+        catalog = _catalog()
+        changed = catalog.vectors[:1]
+
+        hit = reached_floor(catalog.ids, catalog.vectors, catalog.floors, catalog.ids[:1], changed, batch_size=4)
+
+        holders = {book_id for book_id, row in _lists(catalog).items() if catalog.ids[0] in row}
+        assert set(catalog.ids[hit].tolist()) == holders
+
+
+class TestIncrementalRefresh:
+    def _refresh(self, catalog, dirty, current):
+        before = _lists(catalog)
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [(book_id, vector_literal(vector)) for book_id, vector in current],
+            [(book_id,) for book_id, row in before.items() if set(row) & set(dirty)],
+        ]
+        with patch("app.neighbors.settings") as settings:
+            settings.neighbors_k, settings.neighbors_batch_size = K, 5
+            refreshed, rewritten = _refresh_dirty(cursor, catalog, dirty)
+        # Untouched lists keep their stored rows
+        return {**{b: row for b, row in before.items() if b not in dirty}, **_copied(cursor)}, refreshed
+
+    def test_moved_vector_rewrites_exactly_the_changed_lists(self):
+        catalog = _catalog()
+        moved = catalog.vectors[7] * 0.1 + catalog.vectors[20]
+
+        stored, refreshed = self._refresh(catalog, [80], [(80, moved)])
+
+        assert stored == _lists(refreshed)
+        assert np.isclose(refreshed.vectors[7] @ _normalize(moved), 1.0, atol=1e-5)
+
+    def test_deleted_and_new_books(self):
+        catalog = _catalog()
+        new_vector = catalog.vectors[3] + catalog.vectors[4]
+
+        stored, refreshed = self._refresh(catalog, [50, 999], [(999, new_vector)])
+
+        assert 50 not in refreshed.ids.tolist() and 999 in refreshed.ids.tolist()
+        assert {b: row for b, row in stored.items() if b != 50} == _lists(refreshed)
+
+
+class TestPrecomputedReads:
+    def _row(self, source_id, book_id, similarity):
+        return MagicMock(source_id=source_id, id=book_id, similarity=similarity)
+
+    def test_only_lists_that_fill_the_limit_are_returned(self):
+        db = MagicMock()
+        db.execute.return_value.fetchall.return_value = [
+            self._row(1, 2, 0.9), self._row(1, 3, 0.8), self._row(4, 5, 0.7),
+        ]
+
+        found = precomputed_neighbors(db, [1, 4], 2, SearchFilters(category="SF", min_similarity=0.85))
+
+        assert list(found) == [1]
+        assert [row.id for row in found[1]] == [2]
+        sql, values = db.execute.call_args.args
+        assert "be.category = :filter_category" in sql.text and values["filter_category"] == "SF"
+
+    def test_limits_beyond_k_search_live(self):
+        db = MagicMock()
+
+        assert precomputed_neighbors(db, [1], 51) == {}
+        db.execute.assert_not_called()
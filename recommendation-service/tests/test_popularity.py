@@ -0,0 +1,75 @@
+"""Tests for the maintained book popularity ranking."""
+
+import math
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.popularity import bump_popularity, log_add, log_decay_weight, top_books, trending_score
+
+
+class TestForwardDecay:
+    def test_weight_doubles_every_half_life(self):
+        now = datetime(2025, 6, 1)
+        assert log_decay_weight(now + timedelta(days=7)) == pytest.approx(log_decay_weight(now) + math.log(2))
+
+    def test_trending_score_is_decayed_count_at_now(self):
+        now = datetime(2025, 6, 1)
+        stored = log_add(log_decay_weight(now), log_decay_weight(now - timedelta(days=7)))
+        assert trending_score(stored, now) == pytest.approx(1.5)
+
+    def test_far_future_interactions_do_not_overflow(self):
+        at = datetime(2300, 1, 1)
+        rows = [(user_id, 10, "borrow", None, at) for user_id in range(1000)]
+        cursor = MagicMock()
+
+        with patch("app.popularity.settings.popularity_half_life_days", 1.0):
+            bump_popularity(cursor, rows)
+            (score,) = cursor.execute.call_args.args[1][2]
+
+            assert math.isfinite(score)
+            assert trending_score(score, at) == pytest.approx(1000)
+            assert trending_score(float("-inf"), at) == 0.0
+
+
+class TestBumpPopularity:
+    def test_aggregates_rows_per_book_into_one_upsert(self):
+        cursor = MagicMock()
+        at = datetime(2025, 6, 1)
+        rows = [
+            (1, 10, "borrow", None, at),
+            (2, 10, "favorite", None, at + timedelta(hours=1)),
+            (3, 11, "rate", 4.0, at),
+        ]
+
+        assert bump_popularity(cursor, rows) == 2
+
+        sql, (book_ids, counts, scores, last) = cursor.execute.call_args.args
+        assert "ON CONFLICT (book_id)" in sql
+        assert "ln(1 + exp(" in sql
+        assert book_ids == [10, 11]
+        assert counts == [2, 1]
+        assert last[0] == at + timedelta(hours=1)
+        assert scores[0] > scores[1]
+
+
+class TestTopBooks:
+    def test_pads_with_unranked_books_when_short(self):
+        db = MagicMock()
+        db.execute.return_value.fetchall.side_effect = [["ranked"], ["pad-1", "pad-2"]]
+
+        assert top_books(db, 3, window="trending", category="Fantasy") == ["ranked", "pad-1", "pad-2"]
+
+        ranked_sql = db.execute.call_args_list[0].args[0].text
+        assert "ORDER BY bp.decayed_score DESC" in ranked_sql
+        assert "bp.category = :category" in ranked_sql
+        assert db.execute.call_args_list[1].args[1]["limit"] == 2
+
+    def test_full_ranking_needs_one_query(self):
+        db = MagicMock()
+        db.execute.return_value.fetchall.return_value = ["a", "b"]
+
+        assert top_books(db, 2) == ["a", "b"]
+        assert db.execute.call_count == 1
+        assert "user_interaction" not in db.execute.call_args.args[0].text
@@ -0,0 +1,168 @@
+"""Tests for incrementally maintained user taste profiles."""
+
+from unittest.mock import MagicMock
+
+import numpy as np
+from pgvector.utils import to_db
+
+from app.profiles import (
+    TasteCluster,
+    add_to_clusters,
+    apply_interactions,
+    interaction_weight,
+    rebuild_profile,
+    remove_from_clusters,
+    reweigh_readers,
+    update_clusters,
+)
+
+
+def _cursor(vectors: dict[int, list[float]], clusters=()) -> MagicMock:
+    """Cursor answering the book-vector lookup, then the cluster read."""
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = [[(book_id, to_db(v)) for book_id, v in vectors.items()], list(clusters)]
+    return cursor
+
+
+class TestInteractionWeight:
+    def test_weights_by_type_and_rating(self):
+        assert interaction_weight("borrow") == 1.0
+        assert interaction_weight("favorite") == 2.0
+        assert interaction_weight("rate", 5) == 1.5
+        assert interaction_weight("rate", 0) == 0.0
+        assert interaction_weight("return") == 0.0
+
+
+class TestApplyInteractions:
+    def test_aggregates_per_user_into_one_upsert(self):
+        cursor = _cursor({10: [1.0, 0.0], 11: [0.0, 1.0]})
+        rows = [
+            (1, 10, "borrow", None),
+            (1, 11, "favorite", None),
+            (2, 10, "rate", 5.0),
+            (2, 99, "borrow", None),  # not embedded yet
+            (3, 10, "return", None),  # weightless
+        ]
+
+        assert apply_interactions(cursor, rows) == 2
+
+        sql, (user_ids, vectors, weights, counts) = cursor.execute.call_args.args
+        assert "ON CONFLICT (user_id)" in sql
+        assert user_ids == [1, 2]
+        assert np.allclose(np.array(vectors[0].strip("[]").split(","), dtype=float), [1.0, 2.0])
+        assert weights == [3.0, 1.5]
+        assert counts == [2, 1]
+
+    def test_weightless_rows_skip_the_database(self):
+        cursor = MagicMock()
+        assert apply_interactions(cursor, [(1, 10, "return", None)]) == 0
+        cursor.execute.assert_not_called()
+
+    def test_rebuild_replaces_existing_profile(self):
+        cursor = _cursor({})
+        cursor.fetchall.side_effect = [[(4, 10, "borrow", None)], [(10, to_db([0.5, 0.5]))], []]
+
+        assert rebuild_profile(cursor, 4) is True
+        assert cursor.execute.call_args_list[0].args[0].startswith("DELETE FROM user_profile")
+        assert cursor.execute.call_args_list[1].args[0].startswith("DELETE FROM user_taste_cluster")
+
+
+
+class TestReweighReaders:
+    def _vector(self, literal: str) -> np.ndarray:
+        return np.array(literal.strip("[]").split(","), dtype=float)
+
+    def test_newly_embedded_book_is_added_from_its_interactions_only(self):
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [(2, 10, "borrow", None), (4, 10, "favorite", None), (4, 10, "return", None)],
+            [],  # no clusters yet
+        ]
+
+        assert reweigh_readers(cursor, {10: (None, np.array([1.0, 0.0]))}) == 2
+
+        statements = [call.args for call in cursor.execute.call_args_list]
+        assert "WHERE book_id = ANY(%s)" in statements[0][0] and statements[0][1] == ([10],)
+        _, (user_ids, vectors, weights, counts) = next(
+            args for args in statements if "ON CONFLICT (user_id)" in args[0]
+        )
+        assert user_ids == [2, 4] and weights == [1.0, 2.0] and counts == [1, 1]
+        assert np.allclose(self._vector(vectors[1]), [2.0, 0.0])
+        assert not any("DELETE FROM user_profile WHERE user_id = ANY(%s)" == args[0] for args in statements)
+
+    def test_replaced_vector_shifts_the_sum_by_the_difference(self):
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [[(4, 10, "favorite", None)], []]
+
+        reweigh_readers(cursor, {10: (np.array([1.0, 0.0]), np.array([0.0, 1.0]))})
+
+        _, (user_ids, vectors, weights, counts) = next(
+            call.args for call in cursor.execute.call_args_list if "ON CONFLICT (user_id)" in call.args[0]
+        )
+        assert user_ids == [4] and weights == [0.0] and counts == [0]
+        assert np.allclose(self._vector(vectors[0]), [-2.0, 2.0])
+
+    def test_deleted_book_is_subtracted_and_emptied_profiles_dropped(self):
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [[(4, 10, "borrow", None)], [(4, 0, to_db([1.0, 0.0]), 1.0, 1)]]
+
+        reweigh_readers(cursor, {10: (np.array([1.0, 0.0]), None)})
+
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        assert "DELETE FROM user_taste_cluster WHERE user_id = ANY(%s)" in statements
+        assert not any(sql.startswith("\n    INSERT INTO user_taste_cluster") for sql in statements)
+        assert statements[-1].startswith("DELETE FROM user_profile") and "interaction_count <= 0" in statements[-1]
+
+    def test_unembedded_deleted_book_touches_nothing(self):
+        cursor = MagicMock()
+        assert reweigh_readers(cursor, {10: (None, None)}) == 0
+        cursor.execute.assert_not_called()
+
+
+class TestTasteClusters:
+    def test_removal_undoes_the_observation(self):
+        clusters = []
+        add_to_clusters(clusters, [1.0, 0.0], 1.0)
+        add_to_clusters(clusters, [0.8, 0.6], 1.0)
+        add_to_clusters(clusters, [0.0, 1.0], 1.0)
+
+        remove_from_clusters(clusters, [0.8, 0.6], 1.0)
+
+        assert clusters[0].member_count == 1 and clusters[0].weight == 1.0
+        assert np.allclose(clusters[0].centroid, [1.0, 0.0])
+        remove_from_clusters(clusters, [0.0, 1.0], 1.0)
+        assert len(clusters) == 1
+
+    def test_distinct_tastes_open_separate_clusters(self):
+        clusters = []
+        assert add_to_clusters(clusters, [1.0, 0.0], 1.0) == 0
+        assert add_to_clusters(clusters, [0.0, 1.0], 1.0) == 1  # orthogonal: new cluster
+        assert add_to_clusters(clusters, [0.9, 0.1], 1.0) == 0  # close to the first
+
+        assert len(clusters) == 2
+        assert clusters[0].member_count == 2 and clusters[0].weight == 2.0
+        assert clusters[0].centroid[1] > 0  # moved towards the new book
+
+    def test_full_set_merges_into_nearest_centroid(self):
+        clusters = [
+            TasteCluster(np.array([1.0, 0.0, 0.0]), 1.0, 1),
+            TasteCluster(np.array([0.0, 1.0, 0.0]), 1.0, 1),
+            TasteCluster(np.array([0.0, 0.0, 1.0]), 3.0, 3),
+        ]
+
+        assert add_to_clusters(clusters, [0.1, 0.1, 1.0], 1.0) == 2
+        assert len(clusters) == 3
+        assert clusters[2].weight == 4.0
+
+    def test_update_locks_reads_and_upserts_touched_clusters(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [(1, 0, to_db([1.0, 0.0]), 2.0, 2)]
+
+        assert update_clusters(cursor, [(1, np.array([0.0, 1.0]), 1.0), (2, np.array([1.0, 0.0]), 1.0)]) == 2
+
+        select_sql = cursor.execute.call_args_list[0].args[0]
+        assert "FOR UPDATE" in select_sql
+        sql, (user_ids, clusters, _, weights, counts) = cursor.execute.call_args.args
+        assert "ON CONFLICT (user_id, cluster)" in sql
+        assert list(zip(user_ids, clusters)) == [(1, 1), (2, 0)]
+        assert weights == [1.0, 1.0] and counts == [1, 1]
@@ -1,6 +1,6 @@
 """Tests for the recommendation-service API routes and embedding."""
 
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from app.database import get_db
 
@@ -76,28 +76,412 @@ class TestEmbedding:
                     raise AssertionError("Expected RetryError")
 
 
+class TestEmbeddingCache:
+    """Test suite for the content-hash embedding cache."""
+
+    def test_cache_key_ignores_whitespace_but_not_model(self):
+        from app.embedding_cache import cache_key
+        assert cache_key("Harry  Potter\n", "m", 1536) == cache_key("Harry Potter", "m", 1536)
+        assert cache_key("Harry Potter", "m", 1536) != cache_key("Harry Potter", "other", 1536)
+        assert cache_key("Harry Potter", "m", 1536) != cache_key("Harry Potter", "m", 256)
+
+    def test_repeated_text_costs_one_api_call(self):
+        with patch("app.embedding.settings") as mock_settings:
+            mock_settings.openai_api_key = "sk-test-valid-key"
+            mock_settings.openai_model = "text-embedding-3-small"
+            mock_settings.embedding_dimensions = 1536
+            mock_settings.embedding_cache_enabled = True
+
+            mock_response = MagicMock()
+            mock_response.json.return_value = {"data": [{"embedding": [0.2] * 1536}]}
+
+            with patch("app.embedding.httpx.post", return_value=mock_response) as post:
+                from app.embedding import get_embedding
+                first = get_embedding("Dune\n\nDesert planet")
+                second = get_embedding("Dune \n\n Desert planet")
+
+        assert first == second
+        post.assert_called_once()
+
+    def test_lru_evicts_oldest_entry(self):
+        from app.embedding_cache import EmbeddingCache
+        cache = EmbeddingCache(max_entries=2)
+        cache.put("a", [1.0], "m", 1)
+        cache.put("b", [2.0], "m", 1)
+        cache.get("a")
+        cache.put("c", [3.0], "m", 1)
+
+        assert cache.get("a") == [1.0]
+        assert cache.get("b") is None
+        assert cache.get("c") == [3.0]
+
+
+class TestEmbeddingBatching:
+    """Test suite for batched embedding requests."""
+
+    def _settings(self, mock_settings):
+        mock_settings.openai_api_key = "sk-test-valid-key"
+        mock_settings.openai_model = "text-embedding-3-small"
+        mock_settings.embedding_dimensions = 1536
+        mock_settings.embedding_cache_enabled = False
+        mock_settings.embedding_batch_max_size = 2
+        mock_settings.embedding_batch_max_tokens = 1000
+
+    def test_get_embeddings_splits_by_batch_size_and_keeps_order(self):
+        def fake_post(url, headers, json, timeout):
+            response = MagicMock()
+            # Reversed on purpose: results must be re-ordered by "index"
+            response.json.return_value = {"data": [
+                {"index": i, "embedding": [float(len(t))]} for i, t in reversed(list(enumerate(json["input"])))
+            ]}
+            return response
+
+        with patch("app.embedding.settings") as mock_settings:
+            self._settings(mock_settings)
+            with patch("app.embedding.httpx.post", side_effect=fake_post) as post:
+                from app.embedding import get_embeddings
+                vectors = get_embeddings(["a", "bb", "ccc"])
+
+        assert vectors == [[1.0], [2.0], [3.0]]
+        assert post.call_count == 2
+
+    def test_batcher_coalesces_concurrent_texts(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from app.embedding import EmbeddingBatcher
+
+        with patch("app.embedding.settings") as mock_settings:
+            self._settings(mock_settings)
+            mock_settings.embedding_batch_max_size = 100
+            with patch("app.embedding.get_embeddings", side_effect=lambda texts: [[1.0]] * len(texts)) as batch:
+                batcher = EmbeddingBatcher(max_batch_size=100, max_batch_tokens=10_000, max_wait_ms=200)
+                with ThreadPoolExecutor(max_workers=5) as pool:
+                    results = list(pool.map(batcher.embed, ["one", "two", "three", "four", "five"]))
+
+        assert results == [[1.0]] * 5
+        assert batch.call_count == 1
+
+    def test_batcher_propagates_api_errors(self):
+        from app.embedding import EmbeddingBatcher
+
+        with patch("app.embedding.settings") as mock_settings:
+            self._settings(mock_settings)
+            with patch("app.embedding.get_embeddings", side_effect=RuntimeError("api down")):
+                batcher = EmbeddingBatcher(max_batch_size=10, max_batch_tokens=10_000, max_wait_ms=1)
+                try:
+                    batcher.embed("text", timeout=5)
+                except RuntimeError as exc:
+                    assert "api down" in str(exc)
+                else:
+                    raise AssertionError("Expected RuntimeError")
+
+
+class TestAsyncEmbedding:
+    """Test suite for the pooled async embedding path."""
+
+    def test_aget_embedding_uses_shared_client_and_cache(self):
+        import asyncio
+        from app import embedding
+
+        response = MagicMock()
+        response.json.return_value = {"data": [{"index": 0, "embedding": [0.3] * 1536}]}
+        client = MagicMock()
+        client.is_closed = False
+        client.post = AsyncMock(return_value=response)
+
+        with patch("app.embedding.settings") as mock_settings:
+            mock_settings.openai_api_key = "sk-test-valid-key"
+            mock_settings.openai_model = "text-embedding-3-small"
+            mock_settings.embedding_dimensions = 1536
+            mock_settings.embedding_cache_enabled = True
+            with patch.object(embedding, "_async_client", client):
+                first = asyncio.run(embedding.aget_embedding("harry potter"))
+                second = asyncio.run(embedding.aget_embedding("harry  potter"))
+
+        assert first == second == [0.3] * 1536
+        client.post.assert_awaited_once()
+
+    def test_aget_embedding_returns_none_with_default_key(self):
+        import asyncio
+        from app.embedding import aget_embedding
+        assert asyncio.run(aget_embedding("test text")) is None
+
+
 class TestSimilarBooksEndpoint:
     """Test suite for /api/recommendations/similar/{book_id}."""
 
     def test_similar_returns_404_when_no_embedding(self, client):
         """Should return 404 when book has no embedding."""
         mock_session = MagicMock()
-        mock_query = MagicMock()
-        mock_query.filter_by.return_value = mock_query
-        mock_query.first.return_value = None
-        mock_session.query.return_value = mock_query
+        mock_session.execute.return_value.fetchall.return_value = []
+        mock_session.query.return_value.filter.return_value.first.return_value = None
         client.app.dependency_overrides[get_db] = lambda: mock_session
 
         try:
-            response = client.get("/api/recommendations/similar/999")
+            with patch("app.vector_search.apply_search_params"):
+                response = client.get("/api/recommendations/similar/999")
         finally:
             client.app.dependency_overrides.pop(get_db, None)
 
         assert response.status_code == 404
 
+    def test_similar_references_the_source_vector_inside_sql(self, client):
+        """The source embedding is never fetched: one statement looks it up by id."""
+        mock_session = MagicMock()
+        mock_session.execute.return_value.fetchall.return_value = [
+            MagicMock(id=2, title="Dune", author="Herbert", category="SF", similarity=0.9)
+        ]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.vector_search.apply_search_params"):
+                response = client.get("/api/recommendations/similar/1?limit=1")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        assert response.json()["recommendations"][0]["book_id"] == 2
+        mock_session.query.assert_not_called()
+        sql, values = mock_session.execute.call_args.args
+        assert "(SELECT embedding FROM book_embedding WHERE id = :ref_book_id)" in sql.text
+        assert values["ref_book_id"] == 1 and "vec" not in values
+
+    def test_similar_reads_precomputed_neighbour_list(self, client):
+        """A stored list long enough for the request skips the live vector search."""
+        mock_session = MagicMock()
+        mock_session.execute.return_value.fetchall.return_value = [
+            MagicMock(source_id=1, id=2, title="Dune", author="Herbert", category="SF", similarity=0.9),
+            MagicMock(source_id=1, id=3, title="Hyperion", author="Simmons", category="SF", similarity=0.2),
+        ]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations.nearest") as live, \
+                    patch("app.routes.recommendations.result_cache") as cache:
+                cache.get.return_value = None
+                response = client.get("/api/recommendations/similar/1?limit=2")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        # Rows below similarity_threshold are trimmed, as on the live path
+        assert [r["book_id"] for r in response.json()["recommendations"]] == [2]
+        live.assert_not_called()
+        # Stored lists lag the catalog until the next refresh: never cached
+        cache.put.assert_not_called()
+        sql, values = mock_session.execute.call_args.args
+        assert "FROM book_neighbors bn" in sql.text and "book_neighbors_dirty" in sql.text
+        assert values["book_ids"] == [1]
+
     def test_search_returns_503_when_embedding_service_unavailable(self, client):
         """Semantic search should report 503 when embeddings are unavailable."""
-        with patch("app.routes.recommendations.get_embedding", return_value=None):
+        with patch("app.routes.recommendations.aget_embedding", AsyncMock(return_value=None)):
             response = client.get("/api/recommendations/search?q=history")
 
         assert response.status_code == 503
+
+
+class TestUserRecommendationsEndpoint:
+    """Test suite for /api/recommendations/for-user/{user_id}."""
+
+    def test_uses_stored_profile_without_loading_book_embeddings(self, client):
+        """A stored taste profile means one lookup plus one vector search."""
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.first.return_value = MagicMock(
+            user_id=3, interaction_count=7
+        )
+        mock_session.query.return_value.filter.return_value.scalar.return_value = 7  # clustered
+        mock_session.execute.return_value.fetchall.return_value = [
+            MagicMock(id=5, title="Dune", author="Herbert", similarity=0.9)
+        ]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations.apply_search_params"):
+                response = client.get("/api/recommendations/for-user/3")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        body = response.json()
+        assert response.status_code == 200
+        assert body["strategy"] == "content_based"
+        assert body["books_used"] == 7
+        assert body["recommendations"][0]["book_id"] == 5
+        mock_session.get.assert_not_called()
+        sql, values = mock_session.execute.call_args.args
+        assert "NOT EXISTS" in sql.text
+        assert "FROM user_profile WHERE user_id = :ref_user_id" in sql.text
+        assert values["ref_user_id"] == 3
+
+    def test_taste_clusters_are_searched_in_one_statement(self, client):
+        """Several clusters: one UNION ALL search, results interleaved by cluster weight."""
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.first.return_value = MagicMock(
+            user_id=3, interaction_count=7
+        )
+        mock_session.query.return_value.filter.return_value.scalar.return_value = 7  # clustered
+        mock_session.query.return_value.filter.return_value.order_by.return_value.all.return_value = [
+            MagicMock(cluster=0, weight=2.0), MagicMock(cluster=1, weight=1.0),
+        ]
+        mock_session.execute.return_value.fetchall.return_value = [
+            MagicMock(query=0, id=5, title="Dune", author="Herbert", similarity=0.9),
+            MagicMock(query=1, id=8, title="Emma", author="Austen", similarity=0.7),
+        ]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.vector_search.apply_search_params"):
+                response = client.get("/api/recommendations/for-user/3?limit=2")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        assert [r["book_id"] for r in response.json()["recommendations"]] == [5, 8]
+        sql = mock_session.execute.call_args.args[0].text
+        assert "UNION ALL" in sql and "user_taste_cluster" in sql
+
+    def test_profile_without_clusters_is_rebuilt_from_history(self, client):
+        """Profiles that predate taste clusters are backfilled before the clusters are searched."""
+        mock_session = MagicMock()
+        profile = MagicMock(user_id=3, interaction_count=7)
+        mock_session.query.return_value.filter.return_value.first.return_value = profile
+        mock_session.query.return_value.filter.return_value.scalar.return_value = 0
+        mock_session.execute.return_value.fetchall.return_value = []
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations.rebuild_profile", return_value=True) as rebuild, \
+                    patch("app.routes.recommendations.apply_search_params"):
+                response = client.get("/api/recommendations/for-user/3")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        assert response.status_code == 200
+        assert rebuild.call_args.args[1] == 3
+        mock_session.commit.assert_called_once()
+
+    def test_cold_start_reads_popularity_table(self, client):
+        """Users without history get the maintained popularity ranking."""
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.first.return_value = None
+        mock_session.query.return_value.scalar.return_value = False
+        popular = [MagicMock(id=1, title="Dune", author="Herbert", interaction_count=12)]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations.rebuild_profile", return_value=False), \
+                    patch("app.routes.recommendations.top_books", return_value=popular) as top:
+                response = client.get("/api/recommendations/for-user/3?limit=5")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        assert response.json()["strategy"] == "popular"
+        assert response.json()["recommendations"][0]["score"] == 12
+        top.assert_called_once_with(mock_session, 5)
+
+
+class TestBatchEndpoints:
+    """Test suite for the POST ...:batch endpoints."""
+
+    def test_similar_batch_runs_one_lateral_query(self, client):
+        mock_session = MagicMock()
+        mock_session.execute.return_value.fetchall.return_value = [
+            MagicMock(source_id=1, id=3, title="A", author=None, category=None, similarity=0.9),
+            MagicMock(source_id=1, id=4, title="B", author=None, category=None, similarity=0.8),
+            MagicMock(source_id=2, id=None),
+        ]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations.apply_search_params"), \
+                    patch("app.routes.recommendations.precomputed_neighbors", return_value={}):
+                response = client.post(
+                    "/api/recommendations/similar:batch", json={"book_ids": [1, 2, 9, 1], "limit": 2}
+                )
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        body = response.json()
+        assert response.status_code == 200
+        assert [r["source_book_id"] for r in body["results"]] == [1, 2]
+        assert [b["book_id"] for b in body["results"][0]["recommendations"]] == [3, 4]
+        assert body["results"][1]["recommendations"] == []
+        assert body["not_found"] == [9]
+        assert mock_session.execute.call_count == 1
+        assert "LATERAL" in mock_session.execute.call_args.args[0].text
+        assert mock_session.execute.call_args.args[1]["ids"] == [1, 2, 9]
+
+    def test_similar_batch_rejects_empty_and_oversized_lists(self, client):
+        assert client.post("/api/recommendations/similar:batch", json={"book_ids": []}).status_code == 422
+        too_many = {"book_ids": list(range(101))}
+        assert client.post("/api/recommendations/similar:batch", json=too_many).status_code == 422
+
+    def test_for_user_batch_searches_all_profiles_at_once(self, client):
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value = [
+            MagicMock(user_id=7, interaction_count=3, embedding_sum=[0.1, 0.2]),
+        ]
+        mock_session.execute.return_value = [
+            MagicMock(user_id=7, id=5, title="Dune", author="Herbert", similarity=0.9),
+        ]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations._cluster_stats", return_value={7: (3, 1)}), \
+                    patch("app.routes.recommendations.apply_search_params"):
+                response = client.post("/api/recommendations/for-user:batch", json={"user_ids": [7]})
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        result = response.json()["results"][0]
+        assert result["strategy"] == "content_based"
+        assert result["books_used"] == 3
+        assert result["recommendations"][0]["book_id"] == 5
+        assert mock_session.execute.call_count == 1
+
+    def test_for_user_batch_backfills_cold_users_in_one_pass(self, client):
+        stored, history, rebuilt = MagicMock(), MagicMock(), MagicMock()
+        stored.filter.return_value = []
+        history.filter.return_value.distinct.return_value = [(7,), (8,)]
+        rebuilt.filter.return_value = [MagicMock(user_id=7, interaction_count=2)]
+        mock_session = MagicMock()
+        mock_session.query.side_effect = [stored, history, rebuilt]
+        mock_session.execute.return_value = []
+        popular = [MagicMock(id=1, title="Dune", author="Herbert", interaction_count=12)]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations.rebuild_profiles", return_value={7}) as rebuild, \
+                    patch("app.routes.recommendations._cluster_stats", return_value={}), \
+                    patch("app.routes.recommendations.top_books", return_value=popular), \
+                    patch("app.routes.recommendations.apply_search_params"):
+                response = client.post("/api/recommendations/for-user:batch", json={"user_ids": [7, 8, 9]})
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        body = response.json()
+        rebuild.assert_called_once()
+        assert rebuild.call_args.args[1] == {7, 8}
+        mock_session.commit.assert_called_once()
+        assert [(r["user_id"], r["strategy"]) for r in body["results"]] == [(7, "content_based"), (9, "popular")]
+        assert body["not_found"] == [8]
+
+    def test_for_user_batch_ranks_clustered_users_like_for_user(self, client):
+        """Several taste clusters: both endpoints share the per-cluster search."""
+        profile = MagicMock(user_id=7, interaction_count=4)
+        rows = [
+            MagicMock(id=5, title="Dune", author="Herbert", category=None, similarity=0.9),
+            MagicMock(id=6, title="Emma", author="Austen", category=None, similarity=0.8),
+        ]
+        client.app.dependency_overrides[get_db] = lambda: MagicMock()
+
+        try:
+            with patch("app.routes.recommendations._load_profile", return_value=profile), \
+                    patch("app.routes.recommendations._profile_rows", return_value=[profile]), \
+                    patch("app.routes.recommendations._cluster_stats", return_value={7: (4, 2)}), \
+                    patch("app.routes.recommendations._content_results", return_value=rows) as content:
+                single = client.get("/api/recommendations/for-user/7?strategy=content_based").json()
+                batch = client.post("/api/recommendations/for-user:batch", json={"user_ids": [7]}).json()
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        assert content.call_count == 2
+        assert batch["results"][0]["recommendations"] == single["recommendations"]
+        assert batch["results"][0]["strategy"] == single["strategy"] == "content_based"
+        assert batch["results"][0]["books_used"] == single["books_used"] == 4
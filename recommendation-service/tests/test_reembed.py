@@ -0,0 +1,19 @@
+"""Tests for the bulk re-embedding job's column swap."""
+
+from unittest.mock import MagicMock
+
+from app.reembed import swap_columns
+from app.search_cache import GENERATION_SHARDS
+
+
+class TestSwapColumns:
+    def test_swap_bumps_every_catalog_generation_shard(self):
+        db = MagicMock()
+
+        swap_columns(db)
+
+        statements = [call.args for call in db.execute.call_args_list]
+        assert statements[0][0].text == "ALTER TABLE book_embedding DROP COLUMN embedding"
+        sql, values = statements[-1]
+        assert "INSERT INTO catalog_generation" in sql.text
+        assert values["shards"] == list(range(GENERATION_SHARDS))
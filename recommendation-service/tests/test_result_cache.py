@@ -0,0 +1,197 @@
+"""Tests for the /similar result cache and its event-driven invalidation."""
+
+from unittest.mock import MagicMock, patch
+
+from app.database import get_db
+from app.result_cache import CachedResult, MemoryBackend, RedisBackend, ResultCache
+
+
+def _rows(*pairs):
+    return [{"id": i, "title": f"B{i}", "author": None, "category": None, "similarity": s} for i, s in pairs]
+
+
+def _cache(now=None, similarities=None):
+    clock = MagicMock(return_value=now or 1000.0)
+    lookup = MagicMock(side_effect=lambda book_id, sources: {
+        source: similarity for source, similarity in (similarities or {}).items() if source in sources
+    })
+    return ResultCache(MemoryBackend(max_entries=10), ttl_seconds=60, clock=clock, similarities=lookup), clock
+
+
+class FakeRedis:
+    """The handful of Redis commands RedisBackend uses, over plain dicts (TTLs ignored)."""
+
+    def __init__(self):
+        self.strings, self.hashes, self.zsets = {}, {}, {}
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def get(self, key):
+        return self.strings.get(key)
+
+    def set(self, key, value, ex=None):
+        self.strings[key] = value
+
+    def incr(self, key):
+        self.strings[key] = int(self.strings.get(key, 0)) + 1
+        return self.strings[key]
+
+    def delete(self, *keys):
+        for key in keys:
+            for store in (self.strings, self.hashes, self.zsets):
+                store.pop(key, None)
+
+    def hlen(self, name):
+        return len(self.hashes.get(name, {}))
+
+    def hexists(self, name, key):
+        return key in self.hashes.get(name, {})
+
+    def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[key] = value
+
+    def hdel(self, name, *keys):
+        for key in keys:
+            self.hashes.get(name, {}).pop(key, None)
+
+    def hvals(self, name):
+        return list(self.hashes.get(name, {}).values())
+
+    def hgetall(self, name):
+        return dict(self.hashes.get(name, {}))
+
+    def zadd(self, name, mapping):
+        self.zsets.setdefault(name, {}).update(mapping)
+
+    def zrem(self, name, *keys):
+        for key in keys:
+            self.zsets.get(name, {}).pop(key, None)
+
+    def zrangebyscore(self, name, low, high):
+        return [key for key, score in self.zsets.get(name, {}).items() if float(low) <= score <= float(high)]
+
+
+class TestRedisBackend:
+    def test_expired_index_entries_make_room_for_new_writes(self):
+        client = FakeRedis()
+        backend = RedisBackend(client, max_entries=2)
+        with patch("app.result_cache.time.time", return_value=1000.0):
+            backend.set("a", CachedResult(1, _rows((2, 0.9)), 0.9, 1010.0))
+            backend.set("b", CachedResult(3, _rows((4, 0.9)), 0.9, 1010.0))
+            backend.set("c", CachedResult(5, _rows((6, 0.9)), 0.9, 1010.0))
+        assert "c" not in client.hashes[backend._index]  # full
+
+        with patch("app.result_cache.time.time", return_value=1020.0):
+            backend.set("c", CachedResult(5, _rows((6, 0.9)), 0.9, 1080.0))
+
+        assert set(client.hashes[backend._index]) == {"c"}
+        assert set(client.zsets[backend._expiry]) == {"c"}
+
+    def test_invalidation_in_another_worker_skips_an_older_put(self):
+        client = FakeRedis()
+        worker_a = ResultCache(RedisBackend(client, max_entries=10), ttl_seconds=60, similarities=MagicMock())
+        worker_b = ResultCache(RedisBackend(client, max_entries=10), ttl_seconds=60, similarities=MagicMock())
+
+        generation = worker_a.generation
+        worker_b.invalidate(7)
+        worker_a.put("1:2", 1, 2, _rows((2, 0.9), (7, 0.8)), generation)
+
+        assert worker_a.get("similar", "1:2") is None
+        worker_a.put("1:2", 1, 2, _rows((2, 0.9), (7, 0.8)), worker_a.generation)
+        assert worker_b.get("similar", "1:2") is not None
+
+
+class TestResultCache:
+    def test_hit_after_put_and_expiry_after_ttl(self):
+        cache, clock = _cache()
+        cache.put("1:2", 1, 2, _rows((2, 0.9), (3, 0.8)), cache.generation)
+
+        assert [row["id"] for row in cache.get("similar", "1:2")] == [2, 3]
+        clock.return_value = 1061.0
+        assert cache.get("similar", "1:2") is None
+
+    def test_invalidates_source_and_member_entries_only(self):
+        cache, _ = _cache()
+        cache.put("1", 1, 2, _rows((2, 0.9), (3, 0.8)), cache.generation)
+        cache.put("5", 5, 2, _rows((6, 0.9), (7, 0.8)), cache.generation)
+
+        assert cache.invalidate(3) == 1
+        assert cache.get("similar", "1") is None
+        assert cache.get("similar", "5") is not None
+
+    def test_new_vector_above_floor_invalidates_neighbour_entries(self):
+        # Book 9's stored embedding is close to book 1 (≥ floor 0.8) and far from book 5
+        cache, _ = _cache(similarities={1: 0.99, 5: 0.1})
+        cache.put("1", 1, 2, _rows((2, 0.9), (3, 0.8)), cache.generation)
+        cache.put("5", 5, 2, _rows((6, 0.9), (7, 0.8)), cache.generation)
+
+        assert cache.invalidate(9, reembedded=True) == 1
+        assert cache.get("similar", "1") is None
+        assert cache.get("similar", "5") is not None
+
+    def test_short_results_are_invalidated_by_any_new_vector(self):
+        cache, _ = _cache(similarities={1: -1.0})
+        cache.put("1", 1, 5, _rows((2, 0.9)), cache.generation)
+
+        assert cache.invalidate(9, reembedded=True) == 1
+
+    def test_similarities_are_only_looked_up_for_new_embeddings(self):
+        cache, _ = _cache()
+        cache.put("1", 1, 2, _rows((2, 0.9), (3, 0.8)), cache.generation)
+
+        assert cache.invalidate(9) == 0
+        cache._similarities.assert_not_called()
+        cache.invalidate(9, reembedded=True)
+        cache._similarities.assert_called_once_with(9, [1])
+
+    def test_put_computed_before_an_invalidation_is_skipped(self):
+        cache, _ = _cache()
+        generation = cache.generation
+        cache.invalidate(2)
+        cache.put("1", 1, 1, _rows((2, 0.9)), generation)
+
+        assert cache.get("similar", "1") is None
+
+
+class TestSimilarEndpointCache:
+    def test_second_request_is_served_without_the_database(self, client):
+        mock_session = MagicMock()
+        mock_session.execute.return_value.fetchall.return_value = [
+            MagicMock(id=2, title="Dune", author="Herbert", category="SF", similarity=0.9)
+        ]
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.routes.recommendations.apply_search_params"):
+                first = client.get("/api/recommendations/similar/1?limit=1")
+                mock_session.reset_mock()
+                second = client.get("/api/recommendations/similar/1?limit=1")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        assert first.json() == second.json()
+        assert second.json()["recommendations"][0]["book_id"] == 2
+        mock_session.query.assert_not_called()
+        mock_session.execute.assert_not_called()
+
+    def test_filtered_request_gets_its_own_cache_entry(self, client):
+        mock_session = MagicMock()
+        mock_session.execute.return_value.fetchall.return_value = []
+        client.app.dependency_overrides[get_db] = lambda: mock_session
+
+        try:
+            with patch("app.vector_search.apply_search_params"), \
+                    patch("app.vector_search.enable_iterative_scan", return_value=True):
+                client.get("/api/recommendations/similar/1?limit=1")
+                mock_session.reset_mock()
+                client.get("/api/recommendations/similar/1?limit=1&category=Fantasy")
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+        sql, values = mock_session.execute.call_args.args
+        assert "be.category = :filter_category" in sql.text
+        assert values["filter_category"] == "Fantasy"
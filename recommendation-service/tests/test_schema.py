@@ -0,0 +1,69 @@
+"""Tests for startup schema upgrades and concurrent index builds."""
+
+from unittest.mock import MagicMock, patch
+
+from app import schema
+
+
+def _bind(locked=True, valid=None):
+    bind = MagicMock()
+    conn = bind.connect.return_value.execution_options.return_value.__enter__.return_value
+    conn.execute.return_value.scalar.return_value = locked
+    conn.execute.return_value.scalars.return_value.all.return_value = []
+    return bind, conn
+
+
+def _statements(conn) -> list[str]:
+    return [str(call.args[0]) for call in conn.execute.call_args_list]
+
+
+class TestEnsureSchema:
+    """Test the synchronous startup DDL."""
+
+    def test_never_builds_indexes_or_rewrites_tables(self):
+        statements = schema._statements()
+
+        assert not any("INDEX" in statement for statement in statements)
+        assert not any("GENERATED" in statement for statement in statements)
+
+
+class TestEnsureIndexes:
+    """Test the background CREATE INDEX CONCURRENTLY pass."""
+
+    def test_builds_missing_indexes_concurrently_in_autocommit(self):
+        bind, conn = _bind()
+        with patch("app.schema._index_valid", return_value=None):
+            schema.ensure_indexes(bind)
+
+        bind.connect.return_value.execution_options.assert_called_once_with(isolation_level="AUTOCOMMIT")
+        creates = [s for s in _statements(conn) if s.startswith("CREATE INDEX")]
+        assert len(creates) == len(schema._indexes())
+        assert all(s.startswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS") for s in creates)
+        assert any(schema.search_index_name() in s and "to_tsvector" in s for s in creates)
+        assert "pg_advisory_unlock" in _statements(conn)[-1]
+
+    def test_rebuilds_invalid_and_skips_valid_indexes(self):
+        bind, conn = _bind()
+        validity = {"ix_book_embedding_category": False}
+        with patch("app.schema._index_valid", side_effect=lambda _, name: validity.get(name, True)):
+            schema.ensure_indexes(bind)
+
+        statements = _statements(conn)
+        assert "DROP INDEX CONCURRENTLY IF EXISTS ix_book_embedding_category" in statements
+        assert [s.split(" ON ")[0] for s in statements if s.startswith("CREATE INDEX")] == [
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_book_embedding_category",
+        ]
+
+    def test_leaves_the_build_to_the_worker_holding_the_lock(self):
+        bind, conn = _bind(locked=False)
+        schema.ensure_indexes(bind)
+
+        assert not any(s.startswith("CREATE INDEX") for s in _statements(conn))
+
+    def test_lexical_search_uses_the_indexed_expression(self):
+        from app.hybrid_search import lexical_search
+
+        db = MagicMock()
+        lexical_search(db, "dune", 5)
+
+        assert f"{schema.search_document()} @@ q.tsq" in str(db.execute.call_args.args[0])
@@ -0,0 +1,111 @@
+"""Tests for the /search query cache (app.search_cache)."""
+
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.database import get_db
+from app.search_cache import SearchCache, bump_generation
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _cache(generations, max_entries=10, clock=None):
+    return SearchCache(max_entries, ttl_seconds=60, check_seconds=1, clock=clock or _Clock(),
+                       read_generation=lambda: generations[0])
+
+
+class TestSearchCache:
+    def test_key_normalises_case_and_whitespace(self):
+        key = SearchCache.key("harry potter", 10, "semantic", {})
+
+        assert SearchCache.key("Harry  Potter ", 10, "semantic", {}) == key
+        assert SearchCache.key("harry potter", 5, "semantic", {}) != key
+
+    def test_catalog_change_is_seen_after_the_check_interval(self):
+        generations, clock = [1], _Clock()
+        cache = _cache(generations, clock=clock)
+        cache.put("k", {"results": []}, cache.current_generation())
+
+        generations[0] = 2
+        assert cache.get("k", cache.current_generation()) == {"results": []}  # not re-read yet
+        clock.now = 1.5
+        assert cache.get("k", cache.current_generation()) is None
+
+    def test_results_computed_under_an_old_generation_are_not_stored(self):
+        generations = [1]
+        cache = _cache(generations)
+        generation = cache.current_generation()
+        cache.clear()
+        generations[0] = 2
+        cache.current_generation()
+
+        cache.put("k", {"results": []}, generation)
+
+        assert cache.get("k", cache.current_generation()) is None
+
+    def test_bounded_by_entries_and_ttl(self):
+        clock = _Clock()
+        cache = _cache([1], max_entries=2, clock=clock)
+        generation = cache.current_generation()
+        for key in ("a", "b", "c"):
+            cache.put(key, {"key": key}, generation)
+
+        assert cache.get("a", generation) is None and cache.get("c", generation) == {"key": "c"}
+        clock.now = 61
+        assert cache.get("c", cache.current_generation()) is None
+
+    def test_unreadable_generation_disables_the_cache(self):
+        def fail():
+            raise ConnectionError("down")
+
+        cache = SearchCache(10, 60, 1, read_generation=fail)
+        generation = cache.current_generation()
+        cache.put("k", {"results": []}, generation)
+
+        assert generation is None and cache.get("k", generation) is None
+
+    def test_bump_uses_one_row_per_shard(self):
+        db = MagicMock()
+
+        bump_generation(db, [1, 17, 2])
+
+        assert db.execute.call_args.args[1] == {"shards": [1, 2]}
+
+
+class TestSearchEndpointCache:
+    def _get(self, client, url, embedding):
+        client.app.dependency_overrides[get_db] = lambda: MagicMock()
+        row = MagicMock(id=7, title="Harry Potter", author=None, category=None, similarity=0.9)
+        try:
+            with patch("app.routes.recommendations.aget_embedding", embedding), \
+                    patch("app.routes.recommendations._search_by_vector", return_value=[row]) as search:
+                return client.get(url).json(), search
+        finally:
+            client.app.dependency_overrides.pop(get_db, None)
+
+    def test_repeated_query_is_served_from_memory(self, client):
+        embedding = AsyncMock(return_value=[0.1])
+
+        first, _ = self._get(client, "/api/recommendations/search?q=Harry+Potter+", embedding)
+        second, search = self._get(client, "/api/recommendations/search?q=harry+potter", embedding)
+
+        assert second["query"] == "harry potter"
+        assert second["results"] == first["results"]
+        embedding.assert_awaited_once_with("harry potter")
+        search.assert_not_called()
+
+    def test_embedding_outage_fallback_is_not_cached(self, client):
+        with patch("app.routes.recommendations.lexical_search",
+                   return_value=[MagicMock(id=1, title="Dune", author=None, category=None, description=None,
+                                           rank=0.1, trigram=0.2)]):
+            url = "/api/recommendations/search?q=dune&mode=hybrid"
+            first, _ = self._get(client, url, AsyncMock(return_value=None))
+            second, search = self._get(client, url, AsyncMock(return_value=[0.1]))
+
+        assert first["path"] == "lexical" and second["path"] == "hybrid"
+        search.assert_called_once()
@@ -0,0 +1,85 @@
+"""Tests for the bulk snapshot import (app.snapshot_import)."""
+
+import csv
+import io
+import json
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+from app.snapshot_import import ENQUEUE_MISSING_SQL, SnapshotVectors, _chunks, book_row, import_snapshot
+
+
+def _write_snapshot(directory, books, interactions=()):
+    (directory / "book_embedding.ndjson").write_text("".join(json.dumps(b) + "\n" for b in books))
+    (directory / "user_interaction.ndjson").write_text("".join(json.dumps(i) + "\n" for i in interactions))
+
+
+def _connection(existing=False):
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (existing,)
+    cursor.fetchall.return_value = [("ix_book_embedding_embedding_hnsw",)]
+    cursor.rowcount = 1
+    bind = MagicMock()
+    bind.raw_connection.return_value = connection
+    return bind, connection, cursor
+
+
+class TestRows:
+    def test_csv_keeps_empty_strings_apart_from_nulls(self):
+        (chunk,) = _chunks([book_row({"id": 1, "title": "Dune", "author": "", "embedding": [0.5, 1.0]})])
+
+        line = chunk.getvalue().strip()
+
+        assert line == '1,"Dune","",,,,"[0.5,1]"'
+        assert next(csv.reader(io.StringIO(line)))[0] == "1"
+
+    def test_npy_vectors_are_matched_by_id(self, tmp_path):
+        array = np.zeros(2, dtype=[("id", "<i8"), ("embedding", "<f4", (2,))])
+        array["id"], array["embedding"] = [3, 7], [[1, 0], [0, 1]]
+        np.save(tmp_path / "books.npy", array)
+        vectors = SnapshotVectors(str(tmp_path / "books.npy"))
+
+        assert book_row({"id": 7, "title": "T"}, vectors)[-1] == "[0,1]"
+        assert book_row({"id": 5, "title": "T", "embedding": [2, 2]}, vectors)[-1] == "[2,2]"
+        assert book_row({"id": 5, "title": "T"}, vectors)[-1] is None
+
+
+class TestImportSnapshot:
+    def test_copies_into_empty_tables_then_builds_the_index(self, tmp_path):
+        _write_snapshot(
+            tmp_path,
+            [{"id": 1, "title": "Dune", "embedding": [0.5, 1.0]}],
+            [{"id": 4, "user_id": 2, "book_id": 1, "interaction_type": "rate", "rating": 5.0,
+              "created_at": "2026-05-01T12:30:00"}],
+        )
+        bind, connection, cursor = _connection()
+
+        with patch("app.snapshot_import.ensure_vector_index") as build, \
+                patch("app.snapshot_import.refresh_popularity") as popularity:
+            counts = import_snapshot(bind, str(tmp_path))
+
+        assert counts == {"books": 1, "interactions": 1, "embedding_jobs": 1}
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        assert "DROP INDEX IF EXISTS ix_book_embedding_embedding_hnsw" in statements
+        # Books without a vector are queued in the import transaction
+        assert ENQUEUE_MISSING_SQL in statements
+        assert "embedding IS NULL" in ENQUEUE_MISSING_SQL and "INSERT INTO embedding_job" in ENQUEUE_MISSING_SQL
+        assert [call.args[0].split(" (")[0] for call in cursor.copy_expert.call_args_list] == [
+            "COPY book_embedding", "COPY user_interaction",
+        ]
+        connection.commit.assert_called_once()
+        build.assert_called_once_with(bind)
+        popularity.assert_called_once_with(bind)
+
+    def test_refuses_to_overwrite_existing_data(self, tmp_path):
+        _write_snapshot(tmp_path, [{"id": 1, "title": "Dune"}])
+        bind, _, cursor = _connection(existing=True)
+
+        with pytest.raises(RuntimeError, match="not empty"):
+            import_snapshot(bind, str(tmp_path))
+        # Startup bootstrap: an already populated replica is left alone
+        assert import_snapshot(bind, str(tmp_path), if_empty=True) is None
+        cursor.copy_expert.assert_not_called()
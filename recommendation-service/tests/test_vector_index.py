@@ -0,0 +1,107 @@
+"""Tests for ANN index management and search profiles."""
+
+from unittest.mock import MagicMock, patch
+
+from app import vector_index
+
+
+class TestSearchParams:
+    """Test search profile resolution and per-transaction settings."""
+
+    def test_explicit_overrides_win_over_profile(self):
+        params = vector_index.resolve_search_params(profile="fast", ef_search=120)
+        assert params["ef_search"] == 120
+        assert params["probes"] == vector_index.SEARCH_PROFILES["fast"]["probes"]
+
+    def test_hnsw_ef_search_is_raised_to_limit(self):
+        db = MagicMock()
+        with patch.object(vector_index.settings, "vector_index_type", "hnsw"):
+            params = vector_index.apply_search_params(db, 50, profile="fast")
+
+        assert params["ef_search"] == 50
+        sql, bind = db.execute.call_args.args
+        assert "hnsw.ef_search" in str(sql)
+        assert bind == {"value": "50"}
+
+    def test_hnsw_ef_search_is_clamped_to_the_pgvector_maximum(self):
+        db = MagicMock()
+        with patch.object(vector_index.settings, "vector_index_type", "hnsw"):
+            params = vector_index.apply_search_params(db, 4000)
+
+        assert params["ef_search"] == vector_index.HNSW_MAX_EF_SEARCH
+        assert db.execute.call_args.args[1] == {"value": "1000"}
+
+    def test_rerank_window_never_exceeds_the_hnsw_maximum(self):
+        with patch.object(vector_index.settings, "vector_index_type", "hnsw"), \
+                patch.object(vector_index.settings, "vector_storage", "halfvec"):
+            assert vector_index.candidate_limit(10) == 10 * vector_index.settings.vector_rerank_factor
+            assert vector_index.candidate_limit(640) == vector_index.HNSW_MAX_EF_SEARCH
+
+    def test_ivfflat_sets_probes(self):
+        db = MagicMock()
+        with patch.object(vector_index.settings, "vector_index_type", "ivfflat"):
+            vector_index.apply_search_params(db, 10, probes=7)
+
+        sql, bind = db.execute.call_args.args
+        assert "ivfflat.probes" in str(sql)
+        assert bind == {"value": "7"}
+
+    def test_profile_query_param_is_validated(self, client):
+        response = client.get("/api/recommendations/similar/1?profile=ludicrous")
+        assert response.status_code == 422
+
+
+class TestIndexBuild:
+    """Test index DDL and build state tracking."""
+
+    def test_hnsw_ddl_uses_cosine_ops_and_build_options(self):
+        ddl = vector_index._index_ddl("hnsw")
+        assert "CONCURRENTLY IF NOT EXISTS ix_book_embedding_embedding_hnsw" in ddl
+        assert "USING hnsw (embedding vector_cosine_ops)" in ddl
+        assert "ef_construction" in ddl
+
+    def test_disabled_index_type_skips_database(self):
+        bind = MagicMock()
+        with patch.object(vector_index.settings, "vector_index_type", "none"):
+            vector_index.ensure_vector_index(bind)
+
+        bind.connect.assert_not_called()
+        assert vector_index._build_state["status"] == "disabled"
+
+    def test_build_failure_is_recorded(self):
+        bind = MagicMock()
+        bind.connect.side_effect = RuntimeError("db down")
+        with patch.object(vector_index.settings, "vector_index_type", "hnsw"):
+            vector_index._build_safely(bind)
+
+        assert vector_index._build_state["status"] == "failed"
+        assert "db down" in vector_index._build_state["error"]
+
+
+class TestReducedPrecision:
+    """Test quantized / truncated index expressions."""
+
+    def test_halfvec_truncated_index_and_matching_order_by(self):
+        with patch.object(vector_index.settings, "vector_storage", "halfvec"), \
+                patch.object(vector_index.settings, "vector_search_dimensions", 512):
+            ddl = vector_index._index_ddl("hnsw")
+            distance = vector_index.ann_distance("embedding", "CAST(:vec AS vector)")
+
+            assert "ix_book_embedding_embedding_hnsw_halfvec512" in ddl
+            assert "((subvector(embedding, 1, 512))::halfvec(512)) halfvec_cosine_ops" in ddl
+            assert distance.startswith("(subvector(embedding, 1, 512))::halfvec(512) <=>")
+            assert vector_index.candidate_limit(10) == 10 * vector_index.settings.vector_rerank_factor
+
+    def test_binary_quantization_uses_hamming_distance(self):
+        with patch.object(vector_index.settings, "vector_storage", "binary"):
+            ddl = vector_index._index_ddl("ivfflat")
+            distance = vector_index.ann_distance("b.embedding", "src.embedding")
+
+        dims = vector_index.settings.embedding_dimensions
+        assert f"(binary_quantize(embedding)::bit({dims})) bit_hamming_ops" in ddl
+        assert distance == f"binary_quantize(b.embedding)::bit({dims}) <~> binary_quantize(src.embedding)::bit({dims})"
+
+    def test_full_precision_needs_no_rerank(self):
+        assert vector_index.exact_index()
+        assert vector_index.candidate_limit(10) == 10
+        assert vector_index.ann_distance("be.embedding", "x") == "be.embedding <=> x"
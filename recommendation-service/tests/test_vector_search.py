@@ -0,0 +1,182 @@
+"""Tests for filtered nearest-neighbour search."""
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from app.vector_search import (
+    ScoredBook,
+    SearchFilters,
+    book_vector,
+    cluster_vector,
+    interleave,
+    nearest,
+    nearest_in_store,
+    nearest_many,
+    vector_literal,
+)
+
+
+def _row(book_id, similarity=0.9, category="Fantasy"):
+    return ScoredBook(book_id, f"T{book_id}", "A", category, None, similarity)
+
+
+def _db(*results):
+    db = MagicMock()
+    db.execute.return_value.fetchall.side_effect = list(results)
+    return db
+
+
+class TestNearest:
+    def test_filters_are_part_of_the_ann_query(self):
+        db = _db([_row(1), _row(2)])
+        filters = SearchFilters(category="Fantasy", exclude=(7,), min_similarity=0.5)
+
+        with patch("app.vector_search.apply_search_params"), \
+                patch("app.vector_search.enable_iterative_scan", return_value=True):
+            rows = nearest(db, [0.1, 0.2], 2, {}, filters, where=["be.id != :book_id"], params={"book_id": 3})
+
+        assert [row.id for row in rows] == [1, 2]
+        sql, values = db.execute.call_args.args
+        assert "be.category = :filter_category" in sql.text
+        assert "be.id != ALL(:filter_exclude)" in sql.text
+        assert "be.id != :book_id" in sql.text
+        assert values["filter_category"] == "Fantasy" and values["book_id"] == 3
+
+    def test_overfetches_until_the_limit_is_met_without_iterative_scan(self):
+        db = _db([_row(1)], [_row(1), _row(2)])
+
+        with patch("app.vector_search.apply_search_params") as apply, \
+                patch("app.vector_search.enable_iterative_scan", return_value=False):
+            rows = nearest(db, [0.1], 2, {}, SearchFilters(category="Fantasy"))
+
+        assert len(rows) == 2
+        assert [c.args[1] for c in apply.call_args_list] == [2, 8]
+
+    def test_falls_back_to_exact_scan_when_overfetch_is_exhausted(self):
+        with patch("app.vector_search.settings") as settings:
+            settings.vector_overfetch_max = 4
+            db = MagicMock()
+            db.execute.return_value.fetchall.side_effect = [[], [], [_row(1)]]
+            with patch("app.vector_search.apply_search_params"), \
+                    patch("app.vector_search.enable_iterative_scan", return_value=False):
+                rows = nearest(db, [0.1], 2, {}, SearchFilters(author="A"))
+
+        assert [row.id for row in rows] == [1]
+        statements = [c.args[0].text for c in db.execute.call_args_list]
+        assert any("enable_indexscan', 'off'" in sql for sql in statements)
+
+    def test_min_similarity_trims_the_ordered_result(self):
+        db = _db([_row(1, 0.8), _row(2, 0.2)])
+
+        with patch("app.vector_search.apply_search_params"):
+            rows = nearest(db, [0.1], 2, {}, SearchFilters(min_similarity=0.3))
+
+        assert [row.id for row in rows] == [1]
+        assert db.execute.call_count == 1
+
+
+    def test_stored_query_vector_is_referenced_not_bound(self):
+        db = _db([_row(1)])
+
+        with patch("app.vector_search.apply_search_params"):
+            nearest(db, book_vector(4), 1, {})
+
+        sql, values = db.execute.call_args.args
+        assert "be.embedding <=> (SELECT embedding FROM book_embedding WHERE id = :ref_book_id)" in sql.text
+        assert "WHERE id = :ref_book_id) IS NOT NULL" in sql.text
+        assert values["ref_book_id"] == 4 and "vec" not in values
+
+
+class TestNearestMany:
+    def test_one_statement_with_a_branch_per_query(self):
+        rows = [
+            MagicMock(query=1, id=5, similarity=0.7),
+            MagicMock(query=0, id=3, similarity=0.9),
+            MagicMock(query=1, id=6, similarity=0.8),
+        ]
+        db = _db(rows)
+
+        with patch("app.vector_search.apply_search_params"):
+            ranked = nearest_many(db, [cluster_vector(2, 0), cluster_vector(2, 1)], 2, {})
+
+        assert [[row.id for row in rows] for rows in ranked] == [[3], [6, 5]]
+        assert db.execute.call_count == 1
+        sql, values = db.execute.call_args.args
+        assert sql.text.count("UNION ALL") == 1
+        assert "cluster = 0" in sql.text and "cluster = 1" in sql.text
+        assert values["ref_user_id"] == 2
+
+
+class TestInterleave:
+    def test_weighted_round_robin_skips_duplicates(self):
+        heavy = [_row(1), _row(2), _row(3), _row(4)]
+        light = [_row(2), _row(9)]
+
+        merged = interleave([heavy, light], [3.0, 1.0], 5)
+
+        assert [row.id for row in merged] == [1, 2, 3, 9, 4]
+
+    def test_exhausted_lists_leave_room_for_the_others(self):
+        merged = interleave([[_row(1)], [_row(2), _row(3)]], [5.0, 1.0], 3)
+
+        assert [row.id for row in merged] == [1, 2, 3]
+
+
+class TestVectorLiteral:
+    def test_round_trips_float32_exactly(self):
+        vector = np.random.default_rng(0).standard_normal(64).astype(np.float32)
+
+        literal = vector_literal(vector)
+
+        assert literal.startswith("[") and literal.endswith("]")
+        assert np.array_equal(np.array(literal[1:-1].split(","), dtype=np.float32), vector)
+
+
+class TestNearestInStore:
+    def test_widens_k_until_enough_rows_match(self):
+        store = MagicMock()
+        store.search.side_effect = [[(1, 0.9), (2, 0.8)], [(1, 0.9), (2, 0.8), (3, 0.7), (4, 0.6)]]
+        hydrated = {1: _row(1), 2: _row(2, category="SF"), 3: _row(3), 4: _row(4, category="SF")}
+
+        with patch("app.vector_search.hydrate",
+                   side_effect=lambda db, hits: [hydrated[i] for i, _ in hits]):
+            rows = nearest_in_store(MagicMock(), store, [0.1], 2, SearchFilters(category="Fantasy"), exclude=[9])
+
+        assert [row.id for row in rows] == [1, 3]
+        assert store.search.call_args_list[1].args[1] == 8
+        assert store.search.call_args.kwargs["exclude"] == [9]
+
+    def test_searches_only_matching_ids_once_overfetch_is_exhausted(self):
+        store = MagicMock()
+        store.search.side_effect = [[(1, 0.9), (2, 0.8)], [(1, 0.9), (2, 0.8), (3, 0.7), (4, 0.6)], [(5, 0.5)]]
+        hydrated = {i: _row(i, category="SF") for i in range(1, 5)}
+        hydrated[5] = _row(5)
+        db = MagicMock()
+        db.execute.return_value.scalars.return_value.all.return_value = [5]
+
+        with patch("app.vector_search.settings") as settings, \
+                patch("app.vector_search.hydrate", side_effect=lambda db, hits: [hydrated[i] for i, _ in hits]):
+            settings.vector_overfetch_max = 4
+            rows = nearest_in_store(db, store, [0.1], 2, SearchFilters(category="Fantasy"))
+
+        assert [row.id for row in rows] == [5]
+        assert [c.args[1] for c in store.search.call_args_list] == [2, 4, 2]
+        assert store.search.call_args.kwargs["include"] == [5]
+        assert "be.category = :filter_category" in db.execute.call_args.args[0].text
+
+    def test_fallback_without_selective_filters_is_valid_sql(self):
+        store = MagicMock()
+        store.search.side_effect = [[(1, 0.9), (2, 0.8)], [(3, 0.7)]]
+        db = MagicMock()
+        db.execute.return_value.scalars.return_value.all.return_value = [3]
+
+        # Books still in the replica but gone from Postgres hydrate to nothing
+        with patch("app.vector_search.settings") as settings, \
+                patch("app.vector_search.hydrate", side_effect=lambda db, hits: [_row(i) for i, _ in hits if i == 3]):
+            settings.vector_overfetch_max = 2
+            rows = nearest_in_store(db, store, [0.1], 2)
+
+        assert [row.id for row in rows] == [3]
+        sql = db.execute.call_args.args[0].text
+        assert sql.rstrip().endswith("WHERE be.embedding IS NOT NULL")
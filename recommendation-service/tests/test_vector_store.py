@@ -0,0 +1,110 @@
+"""Tests for the memory-mapped vector store."""
+
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from app.vector_store import MmapVectorStore
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class TestMmapVectorStore:
+    """Test writes, growth and top-k search against the mmap replica."""
+
+    def test_search_returns_nearest_neighbours_in_order(self, tmp_path):
+        store = MmapVectorStore(str(tmp_path), dim=3, initial_capacity=2)
+        store.upsert(1, [1.0, 0.0, 0.0])
+        store.upsert(2, [0.9, 0.1, 0.0])
+        store.upsert(3, [0.0, 1.0, 0.0])
+
+        results = store.search([1.0, 0.0, 0.0], k=2, exclude=[1])
+
+        assert [book_id for book_id, _ in results] == [2, 3]
+        assert results[0][1] > results[1][1]
+
+    def test_upsert_overwrites_and_remove_hides_vector(self, tmp_path):
+        store = MmapVectorStore(str(tmp_path), dim=3)
+        store.upsert(1, [1.0, 0.0, 0.0])
+        store.upsert(1, [0.0, 0.0, 2.0])
+        store.upsert(2, [0.0, 1.0, 0.0])
+        store.remove(2)
+
+        assert len(store) == 1
+        np.testing.assert_allclose(store.get([1])[1], _unit(0, 0, 1))
+        assert store.search([0.0, 1.0, 0.0], k=5) == [(1, 0.0)]
+
+    def test_growth_is_visible_to_other_instances(self, tmp_path):
+        writer = MmapVectorStore(str(tmp_path), dim=2, initial_capacity=1)
+        reader = MmapVectorStore(str(tmp_path), dim=2, initial_capacity=1)
+
+        for book_id in range(1, 6):
+            writer.upsert(book_id, [float(book_id), 1.0])
+
+        assert len(reader) == 5
+        assert reader.search([5.0, 1.0], k=1)[0][0] == 5
+
+    def test_search_many_excludes_per_query(self, tmp_path):
+        store = MmapVectorStore(str(tmp_path), dim=2)
+        store.upsert(1, [1.0, 0.0])
+        store.upsert(2, [0.0, 1.0])
+
+        results = store.search_many(np.eye(2), k=1, exclude=[[1], [2]])
+
+        assert [hits[0][0] for hits in results] == [2, 1]
+
+    def test_include_restricts_candidates(self, tmp_path):
+        store = MmapVectorStore(str(tmp_path), dim=2)
+        store.upsert(1, [1.0, 0.0])
+        store.upsert(2, [0.0, 1.0])
+
+        assert [book_id for book_id, _ in store.search([1.0, 0.0], k=2, include=[2])] == [2]
+
+    def test_insert_reuses_removed_slot(self, tmp_path):
+        store = MmapVectorStore(str(tmp_path), dim=2)
+        store.upsert(1, [1.0, 0.0])
+        store.upsert(2, [0.0, 1.0])
+        store.remove(1)
+        store.upsert(3, [1.0, 1.0])
+
+        ids, _ = store._view()
+        assert ids.tolist() == [3, 2]
+
+
+class TestSyncFromDb:
+    """Test reuse and reload of the replica at startup."""
+
+    def _session(self, generation, rows):
+        db = MagicMock()
+        db.execute.return_value.scalar.side_effect = [generation, len(rows)]
+        db.execute.return_value.__iter__.side_effect = lambda: iter(rows)
+        return db
+
+    def test_reloads_when_catalog_changed_since_last_load(self, tmp_path):
+        store = MmapVectorStore(str(tmp_path), dim=2)
+        store.sync_from_db(lambda: self._session(5, [(1, [1.0, 0.0])]))
+        store.sync_from_db(lambda: self._session(6, [(1, [0.0, 1.0]), (2, [1.0, 0.0])]))
+
+        assert len(store) == 2
+        np.testing.assert_allclose(store.get([1])[1], [0.0, 1.0])
+
+    def test_reuses_files_loaded_at_the_current_generation(self, tmp_path):
+        store = MmapVectorStore(str(tmp_path), dim=2)
+        store.sync_from_db(lambda: self._session(5, [(1, [1.0, 0.0])]))
+        db = self._session(5, [])
+
+        MmapVectorStore(str(tmp_path), dim=2).sync_from_db(lambda: db)
+
+        assert db.execute.call_count == 1  # the generation only
+        assert len(store) == 1
+
+    def test_reloads_files_of_other_dimensions(self, tmp_path):
+        MmapVectorStore(str(tmp_path), dim=2).sync_from_db(lambda: self._session(5, [(1, [1.0, 0.0])]))
+        store = MmapVectorStore(str(tmp_path), dim=3)
+
+        store.sync_from_db(lambda: self._session(5, [(1, [0.0, 0.0, 1.0])]))
+
+        assert store.search([0.0, 0.0, 1.0], k=1)[0][0] == 1